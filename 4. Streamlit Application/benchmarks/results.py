@@ -0,0 +1,143 @@
+"""
+
+    Benchmark results format.
+
+    Author: Explore Data Science Academy.
+
+    Description: Benchmark runs are stored as JSON documents so that they
+    can be committed, archived and diffed between versions:
+
+        {
+          "schema": 1,
+          "created": "2020-01-01T00:00:00+00:00",
+          "environment": {"python": ..., "numpy": ..., "cpu_count": ...},
+          "config": {...runner settings...},
+          "dataset": {...generator settings...},
+          "stages": {
+            "<stage>": {"count": ..., "mean_ms": ..., "p50_ms": ...,
+                        "p95_ms": ..., "p99_ms": ..., "throughput_per_s": ...,
+                        "peak_rss_mb": ...}
+          },
+          "traces": {
+            "<recommender>": [{"stage": ..., "calls": ..., "wall_s": ...,
+                               "mean_wall_s": ..., "max_peak_alloc_bytes": ...,
+                               ...}]
+          }
+        }
+
+    Stage rows are measured in a process of their own, so `peak_rss_mb` is
+    the peak of that artifact or recommender alone. Trace rows are the
+    `utils.tracing.summary` of a recommender's traced replay. Schema 1
+    documents (without traces, and with peaks accumulated over the whole
+    run) can still be loaded.
+
+    Compare two runs with:
+
+        python -m benchmarks.results old.json new.json
+
+"""
+# Script dependencies
+import argparse
+import datetime
+import json
+import os
+import platform
+import numpy as np
+
+SCHEMA_VERSION = 2
+
+# Stage and trace metrics compared by `compare`, where lower is better
+METRICS = ['p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb']
+TRACE_METRICS = ['mean_wall_s', 'max_peak_alloc_bytes']
+
+
+def environment():
+    """Describe the machine and library versions a run was made on."""
+    import pandas as pd
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def summarise(timings, peak_rss_mb=None):
+    """Latency percentiles and throughput of a list of timings in seconds."""
+    timings = np.asarray(timings, dtype=np.float64)
+    total = timings.sum()
+    return {'count': int(len(timings)),
+            'mean_ms': float(timings.mean() * 1000),
+            'p50_ms': float(np.percentile(timings, 50) * 1000),
+            'p95_ms': float(np.percentile(timings, 95) * 1000),
+            'p99_ms': float(np.percentile(timings, 99) * 1000),
+            'throughput_per_s': float(len(timings) / total) if total > 0 else None,
+            'peak_rss_mb': peak_rss_mb}
+
+
+def new_results(config, dataset):
+    """An empty results document for a run."""
+    return {'schema': SCHEMA_VERSION,
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'environment': environment(),
+            'config': config,
+            'dataset': dataset,
+            'stages': {},
+            'traces': {}}
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('schema') not in (1, SCHEMA_VERSION):
+        raise ValueError(f"Unsupported benchmark schema: {results.get('schema')}")
+    results.setdefault('traces', {})
+    return results
+
+
+def compare(old, new):
+    """Relative change of every stage metric between two runs.
+
+    Parameters
+    ----------
+    old, new : dict
+        Results documents.
+
+    Returns
+    -------
+    list (tuple)
+        (stage, metric, old value, new value, relative change) for each
+        metric present in both runs; a negative change is an improvement.
+        Trace rows are named '<recommender>:<stage>'.
+
+    """
+    def traces(results):
+        return {f'{name}:{row["stage"]}': row
+                for name, rows in results.get('traces', {}).items() for row in rows}
+
+    rows = []
+    for stages, metrics in [((old['stages'], new['stages']), METRICS),
+                            ((traces(old), traces(new)), TRACE_METRICS)]:
+        for stage in sorted(set(stages[0]) & set(stages[1])):
+            for metric in metrics:
+                before = stages[0][stage].get(metric)
+                after = stages[1][stage].get(metric)
+                if before is None or after is None:
+                    continue
+                change = (after - before) / before if before else float('nan')
+                rows.append((stage, metric, before, after, change))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    for stage, metric, before, after, change in compare(load_results(args.old), load_results(args.new)):
+        print(f"{stage:50s} {metric:20s} {before:12.2f} {after:12.2f} {change:+8.1%}")
@@ -0,0 +1,209 @@
+"""
+
+    Recommender benchmark runner.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures the cold-load time of every artifact in the
+    resource registry, then replays a reproducible set of favourite-movie
+    queries against each recommender. Per stage, the latency percentiles,
+    throughput and the peak resident memory of the process are reported
+    in the JSON format of `benchmarks.results`.
+
+    Every artifact load and every recommender runs in a fresh interpreter,
+    so that its peak RSS (which never decreases within a process) and its
+    caches are its own rather than inherited from the previous ones. Each
+    recommender is then replayed a second time, in another fresh process,
+    with tracing enabled: the `utils.tracing` totals of its internal stages
+    are reported under "traces". The latencies are timed untraced, as
+    `tracemalloc` slows every allocation down.
+
+    Run against a synthetic data set from the root of the Streamlit
+    application with:
+
+        python -m benchmarks.runner --resources bench_resources --output results.json
+
+"""
+# Script dependencies
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from benchmarks.results import new_results, save_results, summarise
+
+RECOMMENDERS = ['content', 'collab_neighbourhood', 'collab_foldin', 'hybrid']
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def in_fresh_process(func, *args):
+    """Call `func(*args)` in a new interpreter and return its result."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(func, *args).result()
+
+
+def make_queries(title_list, n_queries, seed):
+    """Favourite-movie triples drawn from the whole catalogue, as offered by the app."""
+    rng = np.random.default_rng(seed)
+    return [[title_list[i] for i in rng.integers(len(title_list), size=3)]
+            for _ in range(n_queries)]
+
+
+def time_calls(func, queries, top_n):
+    timings, failures = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        try:
+            func(query, top_n)
+        except Exception:
+            failures += 1
+            continue
+        timings.append(time.perf_counter() - start)
+    return timings, failures
+
+
+def get_recommender(name):
+    """The `(movie_list, top_n)` function benchmarked as `name`."""
+    from recommenders import collaborative_based
+    from recommenders.content_based import content_model
+    from recommenders.hybrid import hybrid_model
+
+    def collab_engine(engine):
+        def model(movie_list, top_n):
+            collaborative_based.COLLAB_ENGINE = engine
+            return collaborative_based.collab_model(movie_list, top_n)
+        return model
+
+    return {'content': content_model,
+            'collab_neighbourhood': collab_engine('neighbourhood'),
+            'collab_foldin': collab_engine('foldin'),
+            'hybrid': hybrid_model}[name]
+
+
+def measure_load(name):
+    """Cold-load one registry artifact (run in a fresh process)."""
+    from utils import resources
+    start = time.perf_counter()
+    try:
+        resources.WARM_UP_LOADERS[name]()
+    except (OSError, ImportError):
+        return None
+    return summarise([time.perf_counter() - start], peak_rss_mb())
+
+
+def measure_recommender(name, queries, top_n):
+    """Time the first and then every query of one recommender (run in a fresh process)."""
+    recommender = get_recommender(name)
+    stages = {}
+    # The first call pays for lazily built per-recommender state
+    first, _ = time_calls(recommender, queries[:1], top_n)
+    if first:
+        stages[f'{name}.first_call'] = summarise(first, peak_rss_mb())
+    timings, failures = time_calls(recommender, queries, top_n)
+    stats = summarise(timings, peak_rss_mb()) if timings else {'count': 0}
+    stats['failures'] = failures
+    stages[name] = stats
+    return stages
+
+
+def trace_recommender(name, queries, top_n):
+    """Per-stage tracing totals of one recommender's replay (run in a fresh process)."""
+    from utils import tracing
+    recommender = get_recommender(name)
+    tracing.enable()
+    time_calls(recommender, queries, top_n)
+    return tracing.summary()
+
+
+def run(resource_dir, n_queries=50, seed=0, top_n=10, recommenders=None, trace=True):
+    """Benchmark the registry loaders and the recommenders.
+
+    Parameters
+    ----------
+    resource_dir : str
+        Resources folder to benchmark against (e.g. from
+        `benchmarks.synthetic`).
+    n_queries : int
+        Number of queries replayed per recommender.
+    seed : int
+        Seed of the query sampler.
+    top_n : int
+        Number of recommendations requested.
+    recommenders : list (str) or None
+        Names of the recommenders to run; `None` runs all of them.
+    trace : bool
+        Whether to replay each recommender again with tracing enabled.
+
+    Returns
+    -------
+    dict
+        Results document.
+
+    """
+    # The registry reads its root folder on import (here and in the workers)
+    os.environ['EDSA_RESOURCE_DIR'] = resource_dir
+    from utils import resources
+    names = recommenders or RECOMMENDERS
+
+    dataset_path = os.path.join(resource_dir, 'dataset.json')
+    dataset = {}
+    if os.path.exists(dataset_path):
+        with open(dataset_path) as f:
+            dataset = json.load(f)
+    config = {'resource_dir': os.path.abspath(resource_dir), 'n_queries': n_queries,
+              'seed': seed, 'top_n': top_n, 'recommenders': names, 'trace': trace}
+    results = new_results(config, dataset)
+
+    # Cold load of each artifact
+    for name in resources.WARM_UP_LOADERS:
+        stats = in_fresh_process(measure_load, name)
+        if stats is not None:
+            results['stages'][f'load.{name}'] = stats
+
+    queries = make_queries(resources.get_title_list(), n_queries, seed)
+    for name in names:
+        results['stages'].update(in_fresh_process(measure_recommender, name, queries, top_n))
+        if trace:
+            results['traces'][name] = in_fresh_process(trace_recommender, name, queries, top_n)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommenders.')
+    parser.add_argument('--resources', default='resources')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--recommender', action='append', dest='recommenders',
+                        choices=RECOMMENDERS, help='Recommender to run (repeatable); defaults to all.')
+    parser.add_argument('--no-trace', action='store_true',
+                        help='Skip the traced replay of each recommender.')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    results = run(args.resources, args.queries, args.seed, args.top_n, args.recommenders,
+                  not args.no_trace)
+    save_results(args.output, results)
+    for stage, stats in results['stages'].items():
+        if not stats['count']:
+            print(f"{stage:40s} failed {stats['failures']} of {args.queries} queries")
+            continue
+        print(f"{stage:40s} p50 {stats['p50_ms']:10.2f} ms  p99 {stats['p99_ms']:10.2f} ms  "
+              f"rss {stats['peak_rss_mb'] or 0:8.1f} MB")
+    for name, rows in results['traces'].items():
+        for row in rows:
+            print(f"{name + ' ' + row['stage']:40s} calls {row['calls']:6d}  "
+                  f"mean {row['mean_wall_s'] * 1000:10.2f} ms  "
+                  f"alloc {row['max_peak_alloc_bytes'] / 2 ** 20:8.1f} MB")
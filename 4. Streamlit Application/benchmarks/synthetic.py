@@ -0,0 +1,158 @@
+"""
+
+    Synthetic MovieLens-shaped data generator.
+
+    Author: Explore Data Science Academy.
+
+    Description: Writes `movies.csv`, `imdb_data.csv` and `ratings.csv`
+    with the same columns as the MovieLens/IMDB files used by the app, at
+    a configurable scale. Movie popularity and user activity follow power
+    laws, so that the long-tail shape of the real data is preserved. The
+    output folder mirrors the app's `resources` layout and can be pointed
+    to with `EDSA_RESOURCE_DIR`.
+
+    Generate a data set from the root of the Streamlit application with:
+
+        python -m benchmarks.synthetic --ratings 1000000 --output bench_resources
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime',
+          'Documentary', 'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX',
+          'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+
+
+def power_law_weights(n, exponent, rng):
+    """Normalised Zipf-like weights over `n` entries, in random order."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def generate_movies(n_movies, rng):
+    """Movies table with unique, year-suffixed titles and pipe-joined genres."""
+    years = rng.integers(1920, 2020, n_movies)
+    n_genres = rng.integers(1, 4, n_movies)
+    genres = ['|'.join(rng.choice(GENRES, k, replace=False)) for k in n_genres]
+    return pd.DataFrame({'movieId': np.arange(1, n_movies + 1),
+                         'title': [f'Movie {i} ({y})' for i, y in zip(range(1, n_movies + 1), years)],
+                         'genres': genres})
+
+
+def generate_imdb(movie_ids, rng, n_actors=20000, n_directors=4000, n_keywords=8000):
+    """IMDB metadata table with power-law distributed cast, directors and keywords."""
+    n = len(movie_ids)
+    actor_p = power_law_weights(n_actors, 1.1, rng)
+    director_p = power_law_weights(n_directors, 1.1, rng)
+    keyword_p = power_law_weights(n_keywords, 1.0, rng)
+    cast = rng.choice(n_actors, (n, 4), p=actor_p)
+    keywords = rng.choice(n_keywords, (n, 5), p=keyword_p)
+    return pd.DataFrame({
+        'movieId': movie_ids,
+        'title_cast': ['|'.join(f'Actor {a}' for a in row) for row in cast],
+        'director': [f'Director {d}' for d in rng.choice(n_directors, n, p=director_p)],
+        'runtime': rng.integers(70, 200, n),
+        'budget': [f'${b:,}' for b in rng.integers(1, 200, n) * 1_000_000],
+        'plot_keywords': ['|'.join(f'keyword{k}' for k in row) for row in keywords]})
+
+
+def write_ratings(path, n_ratings, n_users, movie_ids, rng, chunksize=1_000_000):
+    """Stream power-law distributed ratings to csv in chunks.
+
+    Duplicate (user, movie) pairs are not removed, mirroring the cost
+    profile of raw rating dumps rather than their exact content.
+
+    """
+    item_p = power_law_weights(len(movie_ids), 1.0, rng)
+    user_p = power_law_weights(n_users, 0.8, rng)
+    # Per-movie quality offsets give the ratings some learnable structure
+    quality = rng.normal(0, 0.6, len(movie_ids))
+    start_time = 789652009
+    written = 0
+    with open(path, 'w') as f:
+        f.write('userId,movieId,rating,timestamp\n')
+        while written < n_ratings:
+            size = min(chunksize, n_ratings - written)
+            users = rng.choice(n_users, size, p=user_p) + 1
+            items = rng.choice(len(movie_ids), size, p=item_p)
+            stars = np.clip(np.rint((3.5 + quality[items] + rng.normal(0, 0.9, size)) * 2) / 2, 0.5, 5.0)
+            stamps = rng.integers(start_time, start_time + 25 * 365 * 86400, size)
+            pd.DataFrame({'userId': users, 'movieId': movie_ids[items],
+                          'rating': stars, 'timestamp': stamps}).to_csv(f, header=False, index=False)
+            written += size
+
+
+def generate(output, n_ratings=1_000_000, n_movies=30000, n_users=None, seed=42):
+    """Generate a complete synthetic resources folder.
+
+    Parameters
+    ----------
+    output : str
+        Folder to create; data is written to `<output>/data`.
+    n_ratings : int
+        Number of ratings (10k to 25M is the intended range).
+    n_movies : int
+        Catalogue size (MovieLens 25M lists about 62,000 movies). Any size
+        works with the app, whose title search covers the whole catalogue.
+    n_users : int or None
+        Number of users; defaults to one user per 150 ratings.
+    seed : int
+        Random seed, so that runs are reproducible.
+
+    Returns
+    -------
+    dict
+        Description of the generated data set.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_users = n_users or max(n_ratings // 150, 10)
+    data_dir = os.path.join(output, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(os.path.join(output, 'models'), exist_ok=True)
+
+    movies = generate_movies(n_movies, rng)
+    movies.to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+    generate_imdb(movies['movieId'].values, rng).to_csv(os.path.join(data_dir, 'imdb_data.csv'), index=False)
+    write_ratings(os.path.join(data_dir, 'ratings.csv'), n_ratings, n_users, movies['movieId'].values, rng)
+
+    spec = {'n_ratings': n_ratings, 'n_movies': n_movies, 'n_users': n_users, 'seed': seed}
+    with open(os.path.join(output, 'dataset.json'), 'w') as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def train_svd(output, n_factors=50, n_epochs=10):
+    """Fit a small surprise SVD on the generated ratings as `models/SVD_01.pkl`."""
+    import pickle
+    import surprise
+    ratings = pd.read_csv(os.path.join(output, 'data', 'ratings.csv'),
+                          usecols=['userId', 'movieId', 'rating'])
+    ratings = ratings.drop_duplicates(['userId', 'movieId'])
+    data = surprise.Dataset.load_from_df(ratings, surprise.Reader(rating_scale=(0.5, 5.0)))
+    model = surprise.SVD(n_factors=n_factors, n_epochs=n_epochs).fit(data.build_full_trainset())
+    with open(os.path.join(output, 'models', 'SVD_01.pkl'), 'wb') as f:
+        pickle.dump(model, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate MovieLens-shaped benchmark data.')
+    parser.add_argument('--output', default='bench_resources')
+    parser.add_argument('--ratings', type=int, default=1_000_000)
+    parser.add_argument('--movies', type=int, default=30000)
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--train-svd', action='store_true',
+                        help='Also fit a small SVD model (requires scikit-surprise).')
+    args = parser.parse_args()
+
+    spec = generate(args.output, args.ratings, args.movies, args.users, args.seed)
+    if args.train_svd:
+        train_svd(args.output)
+    print(f"Synthetic data set {spec} written to: {args.output}")
@@ -26,6 +26,8 @@
 
 """
 # Streamlit dependencies
+import logging
+import os
 import streamlit as st
 from PIL import Image
 
@@ -34,12 +36,50 @@ import pandas as pd
 import numpy as np
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from utils import tracing
+from utils.resources import get_catalog, get_title_index, warm_up
+from recommenders.cache import cache_stats
+from recommenders.serving import recommend_within, serving_stats
 
-# Data Loading
-title_list = load_movie_titles('resources/data/movies.csv')
+logger = logging.getLogger(__name__)
+
+# Data and models are loaded on first use and shared by all sessions.
+# Set EDSA_WARM_UP=1 at deploy time to load them before the first request.
+if os.environ.get('EDSA_WARM_UP'):
+    warm_up()
+
+
+# Explanation shown when a cheaper tier answered in place of the chosen algorithm
+TIER_NOTES = {'neighbours': "The recommender could not answer right now, so these are "
+                            "movies rated alike by other viewers.",
+              'popular': "The recommender could not answer right now, so these are "
+                         "popular movies in the same genres."}
+
+# Number of matching titles offered per favourite movie
+TITLE_OPTIONS = 50
+
+def title_options(query, slot=0):
+    """Catalogue titles best matching a search query.
+
+    Without a query, each of the three options suggests a different
+    band of the most popular movies.
+
+    """
+    index = get_title_index()
+    if query.strip():
+        rows = index.search(query, TITLE_OPTIONS)
+    else:
+        rows = index.popular(3 * TITLE_OPTIONS)[slot * TITLE_OPTIONS:(slot + 1) * TITLE_OPTIONS]
+    # Duplicate titles resolve to the same movie, so offer them once
+    return list(dict.fromkeys(get_catalog().titles_of_rows(rows)))
+
+
+def toggle_tracing():
+    """Apply the Diagnostics page's tracing checkbox."""
+    if st.session_state['tracing_enabled']:
+        tracing.enable()
+    else:
+        tracing.disable()
 
 
 # App declaration
@@ -47,7 +87,8 @@ def main():
 
     # DO NOT REMOVE the 'Recommender System' option below, however,
     # you are welcome to add more options to enrich your app.
-    page_options = ["Recommender System", "Solution Overview","Exploratory Data Analysis","About Us"]
+    page_options = ["Recommender System", "Solution Overview","Exploratory Data Analysis","About Us",
+                    "Diagnostics"]
 
     # -------------------------------------------------------------------
     # ----------- !! THIS CODE MUST NOT BE ALTERED !! -------------------
@@ -61,13 +102,17 @@ def main():
         # Recommender System algorithm selection
         sys = st.radio("Select an algorithm",
                        ('Content Based Filtering',
-                        'Collaborative Based Filtering'))
+                        'Collaborative Based Filtering',
+                        'Hybrid Filtering'))
 
         # User-based preferences
         st.write('### Enter Your Three Favorite Movies')
-        movie_1 = st.selectbox('Fisrt Option',title_list[14930:15200])
-        movie_2 = st.selectbox('Second Option',title_list[25055:25255])
-        movie_3 = st.selectbox('Third Option',title_list[21100:21200])
+        search_1 = st.text_input('Search for your first movie', key='search_1')
+        movie_1 = st.selectbox('Fisrt Option',title_options(search_1))
+        search_2 = st.text_input('Search for your second movie', key='search_2')
+        movie_2 = st.selectbox('Second Option',title_options(search_2, 1))
+        search_3 = st.text_input('Search for your third movie', key='search_3')
+        movie_3 = st.selectbox('Third Option',title_options(search_3, 2))
         fav_movies = [movie_1,movie_2,movie_3]
 
         # Perform top-10 movie recommendation generation
@@ -75,12 +120,16 @@ def main():
             if st.button("Recommend"):
                 try:
                     with st.spinner('Crunching the numbers...'):
-                        top_recommendations = content_model(movie_list=fav_movies,
-                                                            top_n=10)
+                        served = recommend_within('content', fav_movies, top_n=10)
+                        top_recommendations = served.titles
                     st.title("We think you'll like:")
+                    if served.tier in TIER_NOTES:
+                        st.caption(TIER_NOTES[served.tier])
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception as error:
+                    logger.exception("Content-based recommendation failed")
+                    tracing.record_error('content_model', error)
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -89,12 +138,34 @@ def main():
             if st.button("Recommend"):
                 try:
                     with st.spinner('Crunching the numbers...'):
-                        top_recommendations = collab_model(movie_list=fav_movies,
-                                                           top_n=10)
+                        served = recommend_within('collaborative', fav_movies, top_n=10)
+                        top_recommendations = served.titles
+                    st.title("We think you'll like:")
+                    if served.tier in TIER_NOTES:
+                        st.caption(TIER_NOTES[served.tier])
+                    for i,j in enumerate(top_recommendations):
+                        st.subheader(str(i+1)+'. '+j)
+                except Exception as error:
+                    logger.exception("Collaborative recommendation failed")
+                    tracing.record_error('collab_model', error)
+                    st.error("Oops! Looks like this algorithm does't work.\
+                              We'll need to fix it!")
+
+
+        if sys == 'Hybrid Filtering':
+            if st.button("Recommend"):
+                try:
+                    with st.spinner('Crunching the numbers...'):
+                        served = recommend_within('hybrid', fav_movies, top_n=10)
+                        top_recommendations = served.titles
                     st.title("We think you'll like:")
+                    if served.tier in TIER_NOTES:
+                        st.caption(TIER_NOTES[served.tier])
                     for i,j in enumerate(top_recommendations):
                         st.subheader(str(i+1)+'. '+j)
-                except:
+                except Exception as error:
+                    logger.exception("Hybrid recommendation failed")
+                    tracing.record_error('hybrid_model', error)
                     st.error("Oops! Looks like this algorithm does't work.\
                               We'll need to fix it!")
 
@@ -176,6 +247,56 @@ def main():
 
         # local_css('resources/pages/html_style.css')
 
+    if page_selection == "Diagnostics":
+        st.title("Diagnostics")
+        st.write("Per-stage timings of the recommenders and data loading. Tracing is off \
+          by default (set `EDSA_TRACING=1`); while on, every stage records its wall time, \
+          CPU time, peak Python allocation and input sizes. Allocation peaks are process-wide: \
+          stages which overlap another request record none.")
+        # Tracing is process-wide: show its current state, and only change
+        # it when this user toggles the box
+        st.session_state['tracing_enabled'] = tracing.enabled()
+        st.checkbox("Enable tracing", key='tracing_enabled', on_change=toggle_tracing)
+        if st.button("Reset"):
+            tracing.reset()
+
+        st.write("### Stages")
+        summary = tracing.summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary).set_index('stage'))
+        else:
+            st.info("No stages recorded yet: enable tracing and request some recommendations.")
+        records = list(tracing.RECORDS)[-50:]
+        if records:
+            st.write("### Recent stages")
+            st.dataframe(pd.DataFrame(records[::-1]))
+
+        st.write("### Caches")
+        st.dataframe(pd.DataFrame(cache_stats()).T)
+
+        st.write("### Serving tiers")
+        tiers = serving_stats()
+        st.dataframe(pd.DataFrame({'requests': pd.Series(tiers['served'])}))
+        st.dataframe(pd.DataFrame({'primary bypassed': pd.Series(tiers['bypassed'])}))
+
+        st.write("### Errors")
+        if tracing.ERRORS:
+            st.dataframe(pd.DataFrame(list(tracing.ERRORS)[::-1]))
+        else:
+            st.write("No handled errors.")
+
+        stats = cache_stats()
+        gauges = {f'cache_{key}': {name: cache[key] for name, cache in stats.items()}
+                  for key in ['hits', 'misses', 'size']}
+        gauges.update(requests_served=tiers['served'], primary_bypassed=tiers['bypassed'])
+        c1, c2 = st.columns(2)
+        with c1:
+            st.download_button("Export Prometheus metrics", tracing.to_prometheus(gauges),
+                               file_name='edsa_metrics.prom', mime='text/plain')
+        with c2:
+            st.download_button("Export JSON lines", tracing.to_jsonl(),
+                               file_name='edsa_stages.jsonl', mime='application/json')
+
     # You may want to add more sections here for aspects such as an EDA,
     # or to provide your business pitch.
 
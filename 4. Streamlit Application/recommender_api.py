@@ -0,0 +1,290 @@
+"""
+
+    Headless recommendation API.
+
+    Author: Explore Data Science Academy.
+
+    Description: A local HTTP/JSON service exposing the content,
+    collaborative and hybrid recommenders to other services. Requests arriving within
+    a few milliseconds of each other are grouped by a micro-batcher and
+    scored with one vectorised call. Each algorithm has a bounded queue:
+    when it is full, new requests are rejected with `503` instead of
+    queueing without limit.
+
+    Every request has a latency budget. When the recommender misses it,
+    fails or is overloaded, the response comes from the precomputed
+    fallback tiers (see `recommenders.serving`) and says so in `tier`.
+
+    Start the service from the root of the Streamlit application with:
+
+        python recommender_api.py --port 8000
+
+    Endpoints:
+
+        GET  /health      -> {"status": "ok", "queues": {...}, "caches": {...}}
+        POST /recommend   <- {"algorithm": "content" | "collaborative" | "hybrid",
+                              "movies": ["Title (1995)", ...], "top_n": 10}
+                          -> {"algorithm": ..., "tier": "primary" | "neighbours" |
+                              "popular", "recommendations": [...]}
+
+"""
+# Script dependencies
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Custom Libraries
+from utils.resources import get_catalog, warm_up
+from recommenders.cache import cache_stats
+from recommenders.collaborative_based import collab_model_batch
+from recommenders.content_based import content_model_batch
+from recommenders.hybrid import hybrid_model_batch
+from recommenders.serving import REQUEST_BUDGET, TIERS, fallback
+
+ALGORITHMS = {'content': content_model_batch,
+              'collaborative': collab_model_batch,
+              'hybrid': hybrid_model_batch}
+
+MAX_TOP_N = 100
+# Favourite movies accepted per request
+MAX_MOVIES = 20
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a batcher's queue is full."""
+
+
+class MicroBatcher:
+    """Group concurrent requests into batched calls of a scoring function.
+
+    Parameters
+    ----------
+    score_batch : callable
+        ``score_batch(movie_lists, top_n)`` returning one result per list.
+    executor : concurrent.futures.Executor
+        Runs the (blocking) scoring calls off the event loop.
+    max_batch : int
+        Largest number of requests scored together.
+    max_wait : float
+        Seconds to wait for more requests after the first one arrives.
+    max_queue : int
+        Requests that may wait before new ones are rejected.
+
+    """
+
+    def __init__(self, score_batch, executor, max_batch=32, max_wait=0.005, max_queue=256):
+        self.score_batch = score_batch
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.requests = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def submit(self, movie_list, top_n):
+        """Queue a request; returns a future resolving to its recommendations."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((movie_list, top_n, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded()
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Requests whose caller gave up (e.g. timed out) are not scored
+            pending = [request for request in batch if not request[2].done()]
+            self.expired += len(batch) - len(pending)
+            if not pending:
+                continue
+            batch = pending
+            # Requests with a different top_n are scored in separate calls
+            groups = {}
+            for request in batch:
+                groups.setdefault(request[1], []).append(request)
+            for top_n, requests in groups.items():
+                await self._score(loop, top_n, requests)
+            self.batches += 1
+            self.requests += len(batch)
+
+    async def _score(self, loop, top_n, requests):
+        movie_lists = [movie_list for movie_list, _, _ in requests]
+        try:
+            results = await loop.run_in_executor(self.executor, self.score_batch, movie_lists, top_n)
+        except Exception:
+            # Isolate the failing request(s) by scoring one at a time
+            results = []
+            for movie_list in movie_lists:
+                try:
+                    results.append((await loop.run_in_executor(
+                        self.executor, self.score_batch, [movie_list], top_n))[0])
+                except Exception as error:
+                    results.append(error)
+        for (_, _, future), result in zip(requests, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {'depth': self.queue.qsize(), 'capacity': self.queue.maxsize,
+                'requests': self.requests, 'batches': self.batches, 'rejected': self.rejected,
+                'expired': self.expired}
+
+
+class RecommenderService:
+    """HTTP front end routing requests to one micro-batcher per algorithm."""
+
+    def __init__(self, max_batch, max_wait, max_queue, workers, budget=REQUEST_BUDGET):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batchers = {name: MicroBatcher(func, self.executor, max_batch, max_wait, max_queue)
+                         for name, func in ALGORITHMS.items()}
+        self.budget = budget
+        self.served = {tier: 0 for tier in TIERS}
+        self.started = time.time()
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload = await self._dispatch(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except ValueError as error:
+            status, payload = 400, {'error': str(error)}
+        except Exception as error:
+            # Always answer, even when the service itself fails
+            logger.exception("Request failed")
+            status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        writer.close()
+
+    async def _dispatch(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            raise ValueError("Malformed request line")
+        method, path = request_line[0], request_line[1]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if path == '/health' and method == 'GET':
+            return 200, {'status': 'ok', 'uptime_s': round(time.time() - self.started, 1),
+                         'queues': {name: b.stats() for name, b in self.batchers.items()},
+                         'caches': cache_stats(), 'tiers': self.served}
+        if path != '/recommend':
+            return 404, {'error': f"Unknown path: {path}"}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+
+        length = int(headers.get('content-length', 0))
+        try:
+            request = json.loads(await reader.readexactly(length) or b'{}')
+        except json.JSONDecodeError as error:
+            raise ValueError(f"Invalid JSON body: {error}")
+        if not isinstance(request, dict):
+            raise ValueError("The JSON body must be an object")
+        algorithm = request.get('algorithm', 'content')
+        movies = request.get('movies')
+        top_n = request.get('top_n', 10)
+        if not isinstance(algorithm, str) or algorithm not in self.batchers:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+        if (not isinstance(movies, list) or not 0 < len(movies) <= MAX_MOVIES
+                or not all(isinstance(title, str) for title in movies)):
+            raise ValueError(f"'movies' must be a list of 1 to {MAX_MOVIES} titles")
+        # bool is a subclass of int, but `true` is not a number of results
+        if isinstance(top_n, bool) or not isinstance(top_n, int) or not 0 < top_n <= MAX_TOP_N:
+            raise ValueError(f"'top_n' must be an integer between 1 and {MAX_TOP_N}")
+        catalog = get_catalog()
+        unknown = [title for title in movies if title not in catalog]
+        if unknown:
+            raise ValueError(f"Unknown movies: {unknown}")
+
+        recommendations, failure = [], None
+        try:
+            recommendations = await asyncio.wait_for(
+                self.batchers[algorithm].submit(movies, top_n), self.budget)
+        except Overloaded:
+            failure = 503, {'error': 'Too many pending requests, retry later'}
+        except asyncio.TimeoutError:
+            failure = 503, {'error': f"No result within {self.budget:.3g}s, retry later"}
+        except Exception as error:
+            failure = 500, {'error': f"{type(error).__name__}: {error}"}
+        tier = 'primary'
+        if failure is not None or not recommendations:
+            # Degrade to the precomputed tiers (a few array lookups)
+            result = fallback(movies, top_n)
+            if result is not None:
+                recommendations, tier = result
+            elif failure is not None:
+                return failure
+        self.served[tier] += 1
+        return 200, {'algorithm': algorithm, 'tier': tier, 'recommendations': recommendations}
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+async def serve(host, port, max_batch, max_wait, max_queue, workers, budget):
+    service = RecommenderService(max_batch, max_wait, max_queue, workers, budget)
+    batchers = [asyncio.create_task(b.run()) for b in service.batchers.values()]
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Recommender API listening on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in batchers:
+            task.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recommendations over HTTP/JSON.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=32,
+                        help='Largest number of requests scored together.')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='How long a batch waits for more requests.')
+    parser.add_argument('--max-queue', type=int, default=256,
+                        help='Pending requests per algorithm before rejecting with 503.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Threads running the scoring calls.')
+    parser.add_argument('--budget-ms', type=float, default=1000 * REQUEST_BUDGET,
+                        help='Latency budget of a request before falling back.')
+    args = parser.parse_args()
+
+    # Load every artifact before accepting traffic
+    warm_up()
+    asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms / 1000,
+                      args.max_queue, args.workers, args.budget_ms / 1000))
@@ -0,0 +1,379 @@
+"""
+
+    Approximate nearest-neighbour (ANN) index over dense item vectors.
+
+    Author: Explore Data Science Academy.
+
+    Description: A pure-NumPy inverted-file (IVF) index for maximum inner
+    product search. Items are clustered with k-means into `n_lists`
+    lists; a query only scores the items of the `nprobe` lists whose
+    centroids are closest to it, and that shortlist is re-ranked exactly
+    with the full-precision vectors. Raising `nprobe` trades speed for
+    recall, up to an exact search when every list is probed. How many
+    lists reach a given recall depends on how clustered the vectors are,
+    so `calibrate` measures it on sample queries when the index is built
+    and the index searches with that setting by default.
+
+    Inner products are turned into Euclidean distances by appending one
+    dimension to the items (`sqrt(M^2 - |x|^2)`, with `M` the largest
+    item norm) and a zero to the queries, so the same index serves the
+    SVD item factors (scores `p_u . q_i + b_i`) and unit-length content
+    vectors (cosine similarity).
+
+    Build an index and measure its recall from the root of the Streamlit
+    application with:
+
+        python -m recommenders.ann --source factors --recall
+
+"""
+# Script dependencies
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+# Lists scanned per query by the recommenders; unset, every index uses
+# the setting calibrated when it was built
+ANN_NPROBE = int(os.environ['ANN_NPROBE']) if os.environ.get('ANN_NPROBE') else None
+# Recall@10 against exact search that `calibrate` aims for
+ANN_TARGET_RECALL = float(os.environ.get('ANN_TARGET_RECALL', 0.95))
+
+
+def fingerprint(vectors):
+    """Digest of item vectors, identifying the model an index was built from."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    digest = hashlib.sha1(str(vectors.shape).encode())
+    digest.update(vectors.data)
+    return digest.hexdigest()
+
+
+def kmeans(points, n_clusters, n_iter=10, seed=0, block_size=4096):
+    """Lloyd's k-means with block-wise assignment.
+
+    Parameters
+    ----------
+    points : ndarray
+        float32 point per row.
+    n_clusters : int
+        Number of centroids.
+    n_iter : int
+        Assignment / update rounds.
+    seed : int
+        Seed of the initial centroids (a random sample of the points).
+    block_size : int
+        Points assigned at once; bounds memory to block_size x n_clusters.
+
+    Returns
+    -------
+    ndarray
+        float32 n_clusters x dimension centroids.
+
+    """
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(points, centroids, block_size)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+        # Re-seed empty clusters with random points
+        centroids[~filled] = points[rng.choice(len(points), (~filled).sum(), replace=False)]
+    return centroids
+
+
+def assign(points, centroids, block_size=4096):
+    """Index of the nearest centroid of every point."""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        # argmin |x - c|^2 == argmax (x . c - |c|^2 / 2)
+        labels[start:start + block_size] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """Inverted-file index for top-k inner product search.
+
+    Parameters
+    ----------
+    centroids : ndarray
+        float32 n_lists x (dimension + 1) centroids in the augmented space.
+    offsets : ndarray (int)
+        Start of every list in `ids` (length n_lists + 1).
+    ids : ndarray (int)
+        Item rows, grouped by list.
+    vectors : ndarray
+        float32 augmented vectors, in the order of `ids`.
+    params : dict
+        Build settings (e.g. `n_lists`, `max_norm`), the `fingerprint`
+        of the indexed vectors and the calibrated `nprobe`.
+
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, params=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.params = dict(params or {})
+        self._half_norms = 0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=10, seed=0, sample_size=None):
+        """Cluster item vectors into an index.
+
+        Parameters
+        ----------
+        vectors : ndarray
+            Item vector per row (e.g. item factors with their bias
+            appended, or unit-length content vectors).
+        n_lists : int or None
+            Number of lists; defaults to ~4 sqrt(n_items).
+        n_iter : int
+            k-means rounds.
+        seed : int
+            Random seed.
+        sample_size : int or None
+            Points used to fit the centroids; defaults to 64 per list.
+
+        Returns
+        -------
+        IVFIndex
+            The index over every row of `vectors`.
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n_items = len(vectors)
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(n_items))), n_items)
+        norms = np.linalg.norm(vectors, axis=1)
+        max_norm = float(norms.max()) if n_items else 0.0
+        extra = np.sqrt(np.maximum(max_norm ** 2 - norms ** 2, 0))[:, None]
+        augmented = np.hstack([vectors, extra]).astype(np.float32)
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(sample_size or 64 * n_lists, n_items)
+        sample = augmented[np.sort(rng.choice(n_items, sample_size, replace=False))]
+        centroids = kmeans(sample, n_lists, n_iter, seed)
+
+        labels = assign(augmented, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        params = {'n_lists': n_lists, 'n_iter': n_iter, 'seed': seed, 'max_norm': max_norm,
+                  'n_items': n_items, 'dimension': vectors.shape[1],
+                  'fingerprint': fingerprint(vectors)}
+        return cls(centroids, offsets, order, augmented[order], params)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by `save`."""
+        with np.load(path) as archive:
+            return cls(archive['centroids'], archive['offsets'], archive['ids'], archive['vectors'],
+                       json.loads(str(archive['params'])))
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+                 vectors=self.vectors, params=json.dumps(self.params))
+        # Written to a temporary file so readers never see a partial index
+        os.replace(tmp_path, path)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @property
+    def nprobe(self):
+        """Lists scanned by default: the calibrated setting, else n_lists / 8."""
+        return min(self.params.get('nprobe') or max(8, -(-self.n_lists // 8)), self.n_lists)
+
+    def matches(self, vectors):
+        """Whether the index was built from exactly these item vectors."""
+        vectors = np.asarray(vectors)
+        if vectors.shape != (self.params.get('n_items'), self.params.get('dimension')):
+            return False
+        if 'fingerprint' in self.params:
+            return self.params['fingerprint'] == fingerprint(vectors)
+        # Indexes saved before fingerprints were recorded are compared in full
+        return np.array_equal(self.vectors[:, :-1], np.asarray(vectors, dtype=np.float32)[self.ids])
+
+    def calibrate(self, queries, target_recall=ANN_TARGET_RECALL, k=10):
+        """Set the default `nprobe` to the fewest lists reaching a target recall.
+
+        Parameters
+        ----------
+        queries : ndarray
+            Sample query vector per row, like the ones served.
+        target_recall : float
+            Mean recall@k against exact search to reach.
+        k : int
+            Cut-off of the recall.
+
+        Returns
+        -------
+        int
+            The calibrated `nprobe` (also stored in `params`).
+
+        """
+        exact = [set(rows.tolist()) for rows, _ in self.exact_search(queries, k)]
+        nprobe = 1
+        while nprobe < self.n_lists:
+            approximate = self.search(queries, k, nprobe)
+            hits = [len(e.intersection(a[0].tolist())) / max(len(e), 1)
+                    for a, e in zip(approximate, exact)]
+            if np.mean(hits) >= target_recall:
+                break
+            nprobe *= 2
+        self.params['nprobe'] = min(nprobe, self.n_lists)
+        self.params['target_recall'] = target_recall
+        return self.params['nprobe']
+
+    def search(self, queries, k=10, nprobe=None, excludes=None):
+        """Approximate top-k items by inner product for several queries.
+
+        Parameters
+        ----------
+        queries : ndarray
+            Query vector per row, in the original (non-augmented) space.
+        k : int
+            Number of items returned per query.
+        nprobe : int or None
+            Lists scanned per query; `n_lists` gives an exact search.
+            Defaults to the calibrated `nprobe` of the index.
+        excludes : list (iterable (int)) or None
+            Item rows which may not be returned, per query.
+
+        Returns
+        -------
+        list (tuple (ndarray, ndarray))
+            Item rows and exact inner products of the top items of each
+            query, by descending score (fewer than k when the probed lists
+            hold fewer items).
+
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = np.hstack([queries, np.zeros((len(queries), 1), dtype=np.float32)])
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        # Nearest lists in the augmented space == largest q . c - |c|^2 / 2
+        list_scores = queries @ self.centroids.T - self._half_norms
+        probes = np.argpartition(-list_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists, exclude in zip(queries, probes, excludes or [()] * len(queries)):
+            positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            # Exact re-rank of the shortlist
+            scores = self.vectors[positions] @ query
+            ids = self.ids[positions]
+            exclude = np.asarray(list(exclude), dtype=np.int64)
+            if len(exclude):
+                keep = ~np.isin(ids, exclude)
+                ids, scores = ids[keep], scores[keep]
+            top = min(k, len(ids))
+            if top == 0:
+                results.append((ids, scores))
+                continue
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            results.append((ids[best], scores[best]))
+        return results
+
+    def exact_search(self, queries, k=10):
+        """Exact top-k items by inner product (the reference for `recall`)."""
+        return self.search(queries, k, nprobe=self.n_lists)
+
+
+def recall(index, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Measure recall and speed of an index against exact search.
+
+    Parameters
+    ----------
+    index : IVFIndex
+        Index to evaluate.
+    queries : ndarray
+        Query vector per row.
+    k : int
+        Cut-off of the recall.
+    nprobes : iterable (int)
+        Settings of `nprobe` to compare.
+
+    Returns
+    -------
+    list (dict)
+        `nprobe`, mean `recall@k` and `ms_per_query` of every setting,
+        plus a row for the exact search.
+
+    """
+    start = time.perf_counter()
+    exact = index.exact_search(queries, k)
+    rows = [{'nprobe': index.n_lists, f'recall@{k}': 1.0,
+             'ms_per_query': 1000 * (time.perf_counter() - start) / len(queries)}]
+    for nprobe in sorted(set(min(n, index.n_lists) for n in nprobes)):
+        start = time.perf_counter()
+        approximate = index.search(queries, k, nprobe)
+        elapsed = time.perf_counter() - start
+        hits = [len(np.intersect1d(a[0], e[0])) / max(len(e[0]), 1)
+                for a, e in zip(approximate, exact)]
+        rows.append({'nprobe': nprobe, f'recall@{k}': float(np.mean(hits)),
+                     'ms_per_query': 1000 * elapsed / len(queries)})
+    return sorted(rows, key=lambda row: row['nprobe'])
+
+
+def factor_vectors(model):
+    """Item vectors of a `FactorModel`: factors with the item bias appended."""
+    return np.hstack([model.qi, model.bi[:, None]])
+
+
+def factor_queries(user_vectors):
+    """Queries scoring `factor_vectors` as ``p_u . q_i + b_i``."""
+    user_vectors = np.atleast_2d(np.asarray(user_vectors, dtype=np.float32))
+    return np.hstack([user_vectors, np.ones((len(user_vectors), 1), dtype=np.float32)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build an ANN index over item vectors.')
+    parser.add_argument('--source', choices=['factors', 'genome'], default='factors',
+                        help='SVD item factors or genome content features.')
+    parser.add_argument('--lists', type=int, default=None, help='Number of IVF lists.')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--recall', action='store_true',
+                        help='Also report recall against exact search.')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--target-recall', type=float, default=ANN_TARGET_RECALL,
+                        help='Recall@k the default nprobe of the index is calibrated for.')
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    args = parser.parse_args()
+
+    from utils.resources import get_factor_model, get_genome_features, resource_path
+    args.output = args.output or resource_path('models', f'{args.source}_ann.npz')
+    rng = np.random.default_rng(0)
+    if args.source == 'factors':
+        model = get_factor_model()
+        vectors = factor_vectors(model)
+        queries = factor_queries(model.pu[rng.choice(len(model.pu), min(args.queries, len(model.pu)),
+                                                     replace=False)])
+    else:
+        features = get_genome_features()
+        if features is None:
+            raise SystemExit("Genome features have not been built; run "
+                             "`python -m recommenders.genome_features`")
+        vectors = np.asarray(features.vectors)
+        queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, args.lists, args.iterations)
+    nprobe = index.calibrate(queries, args.target_recall, args.k)
+    index.save(args.output)
+    print(f"Index of {len(vectors)} items in {index.n_lists} lists built in "
+          f"{time.perf_counter() - start:.1f}s and saved to: {args.output}")
+    print(f"nprobe={nprobe} reaches recall@{args.k} >= {args.target_recall} on "
+          f"{len(queries)} sample queries")
+    if args.recall:
+        for row in recall(index, queries, args.k):
+            print("  ".join(f"{key}={value:.4g}" if isinstance(value, float) else f"{key}={value}"
+                            for key, value in row.items()))
@@ -0,0 +1,188 @@
+"""
+
+    Two-level recommendation cache.
+
+    Author: Explore Data Science Academy.
+
+    Description: The first level holds per-movie candidate lists (and
+    their scores), so that a new combination of favourites only has to
+    merge cached pieces. The second level is a bounded LRU cache with a
+    time-to-live over complete results, keyed on the algorithm, the
+    normalised favourites and `top_n`. Both levels count hits and misses,
+    and are cleared when the version of the artifacts they were computed
+    from changes.
+
+"""
+# Script dependencies
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries; the least recently used entry is
+        evicted first.
+    ttl : float or None
+        Seconds an entry stays valid; `None` keeps entries until evicted.
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def validate(self, version):
+        """Clear the cache when the artifact version it was filled from changes."""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'invalidations': self.invalidations}
+
+
+# Level 1: per-movie candidates, keyed on (algorithm, movie)
+candidate_cache = LRUCache(maxsize=20000)
+# Level 2: complete results, keyed on (algorithm, favourites, top_n)
+result_cache = LRUCache(maxsize=4096, ttl=600)
+
+
+def result_key(algorithm, movie_list, top_n, ordered=True):
+    """Normalised result cache key.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm (and engine) producing the result.
+    movie_list : list (str)
+        Favourite movies.
+    top_n : int
+        Number of recommendations.
+    ordered : bool
+        Whether the position of a favourite affects the result; when it
+        does not, permutations of the same favourites share an entry.
+
+    """
+    favourites = tuple(title.strip() for title in movie_list)
+    if not ordered:
+        favourites = tuple(sorted(favourites))
+    return algorithm, favourites, int(top_n)
+
+
+def cached_candidates(algorithm, keys, compute):
+    """Fetch per-movie candidates, computing only the missing ones.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm the candidates belong to.
+    keys : list
+        Movie keys (e.g. rows or movie IDs).
+    compute : callable
+        ``compute(missing_keys)`` returning one candidate entry per key.
+
+    Returns
+    -------
+    list
+        Candidate entries, in the order of `keys`.
+
+    """
+    found = {key: candidate_cache.get((algorithm, key)) for key in keys}
+    missing = [key for key, value in found.items() if value is None]
+    if missing:
+        for key, value in zip(missing, compute(missing)):
+            candidate_cache.put((algorithm, key), value)
+            found[key] = value
+    return [found[key] for key in keys]
+
+
+def cached_results(algorithm, movie_lists, top_n, compute, ordered=True):
+    """Serve results from the result cache, computing only the misses.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the algorithm (and engine) producing the results.
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of recommendations per request.
+    compute : callable
+        ``compute(missing_movie_lists, top_n)`` returning one result per
+        list.
+    ordered : bool
+        See `result_key`.
+
+    Returns
+    -------
+    list (list)
+        One result per request, in order.
+
+    """
+    keys = [result_key(algorithm, movie_list, top_n, ordered) for movie_list in movie_lists]
+    results = [result_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        computed = compute([movie_lists[i] for i in missing], top_n)
+        for i, result in zip(missing, computed):
+            results[i] = tuple(result)
+            result_cache.put(keys[i], results[i])
+    # Hand out copies so callers cannot alter cached entries
+    return [list(result) for result in results]
+
+
+def validate(version):
+    """Invalidate both levels if the artifact version changed."""
+    candidate_cache.validate(version)
+    result_cache.validate(version)
+
+
+def cache_stats():
+    return {'candidates': candidate_cache.stats(), 'results': result_cache.stats()}
@@ -28,123 +28,191 @@
 """
 
 # Script dependencies
-import pandas as pd
+import os
+import weakref
 import numpy as np
 import scipy as sp
-import operator
-import pickle
-import copy
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
 
 # Custom Libraries
-from utils.data_loader import load_movie_titles
+from recommenders.ann import ANN_NPROBE, factor_queries
+from recommenders.cache import cached_candidates, cached_results, validate
+from utils.tracing import stage
+from utils.resources import (artifact_version, get_catalog, get_ratings_store,
+                             get_factor_model, get_ann_index)
+
+# Recommendation engine used by `collab_model`: 'neighbourhood' matches the
+# app user to similar MovieLens users, 'foldin' projects them straight into
+# the SVD latent space.
+COLLAB_ENGINE = os.environ.get('COLLAB_ENGINE', 'neighbourhood')
+
+# Ratings given to the three favourite movies
+FAVOURITE_RATINGS = [5.0, 5.0, 4.5]
+
+def favourite_ratings(n_movies):
+    """Ratings of `n_movies` favourites: `FAVOURITE_RATINGS`, then 5.0 for any extra movie."""
+    ratings = np.full(n_movies, 5.0, dtype=np.float32)
+    ratings[:len(FAVOURITE_RATINGS)] = FAVOURITE_RATINGS[:n_movies]
+    return ratings
+
+# Data is loaded on first use through the shared resource registry:
+# ratings are memory-mapped from the columnar store and we make use of an
+# SVD model trained on a subset of the MovieLens 10k dataset, whose
+# factors are scored with vectorised matrix products.
+
+# Candidate users of each loaded model, with the ratings store they were
+# matched against: {model: (weak reference to the store, candidates)}
+_candidates = weakref.WeakKeyDictionary()
+
+def get_candidates(scorer):
+    """Users eligible for matching, resolved to factor rows of `scorer`.
+
+    Every user known to both the model and the ratings store, so that any
+    movie of the catalogue can be matched to its top users. Kept per
+    loaded model object rather than per file stamp: the rows are only
+    valid for the user matrix of the model they were resolved against,
+    e.g. a hosted model may lag behind (or run ahead of) the files.
 
-# Importing train and test datasets
-ratings_df = pd.read_csv('resources/data/ratings.csv', usecols=['userId', 'movieId', 'rating'])
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',')
-# ratings_df.drop(['timestamp'], axis=1,inplace=True)
-
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/SVD_01.pkl', 'rb'))
+    """
+    store = get_ratings_store()
+    cached = _candidates.get(scorer)
+    if cached is None or cached[0]() is not store:
+        with stage('load.candidates', users=len(scorer.raw_user_ids)):
+            candidate_users = np.intersect1d(scorer.raw_user_ids, store.user_ids)
+            candidates = candidate_users, scorer.user_rows(candidate_users)
+        cached = _candidates[scorer] = (weakref.ref(store), candidates)
+    return cached[1]
 
-# Create a subset of movies based on selectable options to improve performance
-title_list = load_movie_titles('resources/data/movies.csv')
-movie_list_1 = title_list[14930:15200]
-movie_list_2 = title_list[25055:25255]
-movie_list_3 = title_list[21100:21200]
-combined_movies_list = movie_list_1 + movie_list_2 + movie_list_3
-movie_options = movies_df[movies_df['title'].isin(combined_movies_list)]
 
-# Create a subset based of the option above
-def ratings_subset(movie_options, ratings_df):
-    """Create a subset based on the movie options
+def pred_movies(movie_list):
+    """Maps the given favourite movies selected within the app to corresponding
+    users within the MovieLens dataset.
 
     Parameters
     ----------
-    movie_options : list
-        A subset of the movies_df.
-    ratings_df : DataFrame
-        Rating DataFrame to subset
+    movie_list : list (int)
+        Movie IDs of the three favourite movies selected by the app user.
 
     Returns
     -------
-    DataFrame
-        A subset of the ratings DataFrame.
+    list
+        User-ID's of users with similar high ratings for each movie.
 
     """
-    ratings_ids = ratings_df[ratings_df['movieId'].isin(movie_options['movieId'].tolist())]
-    ratings_subset = ratings_df[ratings_df['userId'].isin(ratings_ids['userId'].tolist())]
-    return ratings_subset
+    def top_users(movie_ids):
+        scorer = get_factor_model()
+        candidate_users, candidate_rows = get_candidates(scorer)
+        # Score every candidate user against all uncached movies at once and
+        # take the top 50 user id's from each movie with highest rankings
+        with stage('collab.top_users', movies=len(movie_ids), users=len(candidate_rows)):
+            top = scorer.top_users(candidate_rows, scorer.item_rows(movie_ids), k=50)
+        return [candidate_users[row] for row in top]
+
+    # Return a list of user id's, reusing the users of movies seen before
+    return np.concatenate(cached_candidates('collab_users', list(movie_list), top_users)).tolist()
 
-# Return a subset of ratings
-listed_ratings = ratings_subset(movie_options, ratings_df)
+def collab_model(movie_list,top_n):
+    """Performs Collaborative filtering based upon a list of movies supplied
+       by the app user.
 
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    return collab_model_batch([movie_list], top_n)[0]
+
+def collab_model_batch(movie_lists, top_n):
+    """Serve several `collab_model` requests together.
 
-def prediction_item(item_id):
-    """Map a given favourite movie to users within the
-       MovieLens dataset with the same preference.
+    Results are cached per engine. With the fold-in engine all app users
+    are ranked with one matrix product; the neighbourhood engine serves
+    them one after the other.
 
     Parameters
     ----------
-    item_id : int
-        A MovieLens Movie ID.
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
 
     Returns
     -------
-    list
-        User IDs of users with similar high ratings for the given movie.
+    list (list (str))
+        Titles of the top-n recommendations of each request.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(listed_ratings, reader)
-    a_train = load_df.build_full_trainset()
+    if COLLAB_ENGINE not in ('neighbourhood', 'foldin'):
+        raise ValueError(f"Unknown collaborative engine: {COLLAB_ENGINE}")
+    with stage('collab.request', requests=len(movie_lists), top_n=top_n):
+        validate(artifact_version())
+        return cached_results(f'collab_{COLLAB_ENGINE}', movie_lists, top_n, recommend)
+
+def recommend(movie_lists, top_n):
+    """Compute collaborative recommendations for several requests (uncached)."""
+    # get movie ids for movie_list
+    catalog = get_catalog()
+    movie_id_lists = [catalog.ids_of_titles(movie_list) for movie_list in movie_lists]
+    if COLLAB_ENGINE == 'foldin':
+        return foldin_model(movie_id_lists, top_n)
+    return [neighbourhood_model(movie_list, movie_ids, top_n)
+            for movie_list, movie_ids in zip(movie_lists, movie_id_lists)]
 
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id, uid=ui, verbose = False))
-    return predictions
+def foldin_model(movie_id_lists, top_n):
+    """Recommend movies by folding app users into the SVD latent space.
 
-def pred_movies(movie_list):
-    """Maps the given favourite movies selected within the app to corresponding
-    users within the MovieLens dataset.
+    The cost of a request only depends on the number of factors and the
+    size of the catalogue, not on the ratings of neighbouring users. When
+    an ANN index over the item factors has been built, only the items of
+    the closest index lists are scored.
 
     Parameters
     ----------
-    movie_list : list
-        Three favourite movies selected by the app user.
+    movie_id_lists : list (list (int))
+        Movie IDs of the favourite movies of each app user.
+    top_n : int
+        Number of top recommendations to return to each user.
 
     Returns
     -------
-    list
-        User-ID's of users with similar high ratings for each movie.
+    list (list (str))
+        Titles of the top-n movie recommendations for each user.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 50 user id's from each movie with highest rankings
-        for pred in predictions[:50]:
-            id_store.append(pred.uid)
-    # Return a list of user id's
-    return id_store
-
-def collab_model(movie_list,top_n):
-    """Performs Collaborative filtering based upon a list of movies supplied
-       by the app user.
+    catalog = get_catalog()
+    scorer = get_factor_model()
+    with stage('collab.fold_in', requests=len(movie_id_lists), factors=scorer.n_factors):
+        item_rows = [scorer.item_rows(movie_ids) for movie_ids in movie_id_lists]
+        user_vectors = np.stack([scorer.fold_in(rows, favourite_ratings(len(rows)))
+                                 for rows in item_rows])
+    excludes = [rows[rows >= 0] for rows in item_rows]
+    ann = get_ann_index('factors')
+    with stage('collab.rank', requests=len(movie_id_lists), items=len(scorer.qi),
+               ann=ann is not None):
+        if ann is not None:
+            top_rows = [rows for rows, _ in ann.search(factor_queries(user_vectors), top_n,
+                                                       ANN_NPROBE, excludes)]
+        else:
+            top_rows = scorer.rank_items_batch(user_vectors, top_n, excludes)
+    return [catalog.titles_of_ids(scorer.raw_item_ids[rows]) for rows in top_rows]
+
+def neighbourhood_model(movie_list, movie_ids, top_n):
+    """Recommend the movies favoured by MovieLens users similar to the app user.
 
     Parameters
     ----------
     movie_list : list (str)
         Favorite movies chosen by the app user.
-    top_n : type
+    movie_ids : list (int)
+        Movie IDs of the favourite movies.
+    top_n : int
         Number of top recommendations to return to the user.
 
     Returns
@@ -153,72 +221,109 @@ def collab_model(movie_list,top_n):
         Titles of the top-n movie recommendations to the user.
 
     """
-
-    # get movie ids for movie_list
-    movie_ids = []
-    for movie in movie_list:
-        movie_ids.append(int(movie_options['movieId'][movie_options['title']==movie]))
-
     # Create list of users which would rate these movies highly
-    user_ids = pred_movies(movie_list)
-
-    # Create dataframe of all the movies that these users have rated
-    df_init_users = listed_ratings[listed_ratings['userId'].isin(user_ids)]
+    store = get_ratings_store()
+    with stage('collab.users', movies=len(movie_ids)):
+        user_codes = np.unique(store.user_codes(pred_movies(movie_ids)))
+        user_codes = user_codes[user_codes >= 0]
+
+    # Utility matrix of these users plus the app user (last row), built
+    # directly in CSR form from the store's integer codes
+    favourites, first = np.unique(movie_ids, return_index=True)
+    favourite_codes = store.item_codes(favourites)
+    # Favourites nobody rated get columns of their own past the store's items
+    unrated = favourite_codes < 0
+    favourite_codes[unrated] = store.n_items + np.arange(unrated.sum())
+    with stage('collab.utility_matrix', users=len(user_codes)):
+        util_matrix = utility_matrix(store, user_codes, favourite_codes,
+                                     favourite_ratings(len(movie_ids))[first])
+        util_matrix_norm = normalise_rows(util_matrix)
+
+    # Cosine similarity of the app user to every other user (one row only)
+    with stage('collab.similarity', users=len(user_codes), nnz=util_matrix_norm.nnz):
+        norms = np.sqrt(np.asarray(util_matrix_norm.multiply(util_matrix_norm).sum(axis=1)).ravel())
+        user_vector = util_matrix_norm[-1].T
+        similarity = np.asarray((util_matrix_norm[:-1] @ user_vector).todense()).ravel()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = similarity / (norms[:-1] * norms[-1])
+        # Users whose ratings are all equal carry no preference information
+        similarity[norms[:-1] == 0] = -np.inf
 
-    # Add new user with ratings to userlist
-    new_rating_1 = {'userId':200000, 'movieId':movie_ids[0], 'rating':5.0}
-    new_rating_2 = {'userId':200000, 'movieId':movie_ids[1], 'rating':5.0}
-    new_rating_3 = {'userId':200000, 'movieId':movie_ids[2], 'rating':4.5}
-    df_init_users = df_init_users.append([new_rating_1,new_rating_2,new_rating_3], ignore_index=True)
+    # Gather the k users which are most similar to the reference user
+    k = min(50, int(np.isfinite(similarity).sum()))
+    if k == 0:
+        return []
+    top = np.argpartition(-similarity, k - 1)[:k]
+    sim_users = top[np.argsort(-similarity[top], kind='stable')]
+
+    # Items maximally rated by each similar user, in order of the users
+    sim_matrix = util_matrix_norm[sim_users]
+    counts = np.diff(sim_matrix.indptr)
+    row_max = np.repeat(np.maximum.reduceat(sim_matrix.data, sim_matrix.indptr[:-1][counts > 0]),
+                        counts[counts > 0])
+    favorite_user_items = sim_matrix.indices[sim_matrix.data == row_max]
+
+    # Tally which ones are most popular overall (ties keep their first
+    # appearance) and return the top-N instances
+    items, first_seen, tally = np.unique(favorite_user_items, return_index=True, return_counts=True)
+    keep = ~np.isin(items, favourite_codes)
+    items, first_seen, tally = items[keep], first_seen[keep], tally[keep]
+    top_N = items[np.lexsort((first_seen, -tally))][:top_n]
 
-    # Creating Util matrix,replace NANs and transpose
-    util_matrix = pd.pivot_table(df_init_users,values='rating',columns='movieId',index='userId')
-    util_matrix_norm = util_matrix.apply(lambda x: (x-np.mean(x))/(np.max(x)-np.min(x)), axis=1)
-    util_matrix_norm = util_matrix_norm.fillna(0)
-    util_matrix_norm = util_matrix_norm.T
-    util_matrix_norm = util_matrix_norm.loc[:, (util_matrix_norm != 0).any(axis=0)]
+    # Return Movie Names
+    return get_catalog().titles_of_ids(store.item_ids[top_N])
 
-    # Save the utility matrix in scipy's sparse matrix format
-    util_matrix_sparse = sp.sparse.csr_matrix(util_matrix_norm.values)
+def utility_matrix(store, user_codes, new_item_codes, new_ratings):
+    """Ratings of some users plus a new user as a sparse users x items matrix.
 
-    # Compute the similarity matrix using the cosine similarity metric
-    user_similarity = cosine_similarity(util_matrix_sparse.T)
+    Parameters
+    ----------
+    store : RatingsStore
+        Memory-mapped ratings.
+    user_codes : ndarray (int)
+        Store codes of the users, one row each.
+    new_item_codes : ndarray (int)
+        Item columns rated by the new user (its row comes last); codes
+        beyond the store's items add columns.
+    new_ratings : ndarray (float)
+        Ratings of the new user.
 
-    # Save the matrix as a dataframe to allow for easier indexing
-    user_sim_df = pd.DataFrame(user_similarity,
-                               index = util_matrix_norm.columns,
-                               columns = util_matrix_norm.columns)
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 matrix with one row per user; memory scales with the
+        number of ratings, not users x movies.
 
-    user = 200000
-    k=50
-    # Gather the k users which are most similar to the reference user
-    sim_users = user_sim_df.sort_values(by=user, ascending=False).index[1:k+1]
-    favorite_user_items = [] # <-- List of highest rated items gathered from the k users
-    most_common_favorites = {} # <-- Dictionary of highest rated items in common for the k users
-
-    for i in sim_users:
-        # Maximum rating given by the current user to an item
-        max_score = util_matrix_norm.loc[:, i].max()
-        # Save the names of items maximally rated by the current user
-        favorite_user_items.append(util_matrix_norm[util_matrix_norm.loc[:, i]==max_score].index.tolist())
-
-    # Loop over each user's favorite items and tally which ones are
-    # most popular overall.
-    for item_collection in range(len(favorite_user_items)):
-        for item in favorite_user_items[item_collection]:
-            if item in most_common_favorites:
-                most_common_favorites[item] += 1
-            else:
-                most_common_favorites[item] = 1
-    # Sort the overall most popular items and return the top-N instances
-    sorted_list = sorted(most_common_favorites.items(), key=operator.itemgetter(1), reverse=True)[:top_n+1]
-    top_N = [x[0] for x in sorted_list]
+    """
+    positions = store._positions(store.user_indptr, user_codes)
+    counts = np.diff(store.user_indptr)[user_codes]
+    order = np.argsort(new_item_codes)
+    indptr = np.concatenate([[0], np.cumsum(counts), [counts.sum() + len(order)]])
+    indices = np.concatenate([store.user_items[positions], new_item_codes[order]])
+    data = np.concatenate([store.decode(store.user_ratings[positions]), new_ratings[order]])
+    n_items = max(store.n_items, int(new_item_codes.max()) + 1)
+    return sp.sparse.csr_matrix((data.astype(np.float32), indices, indptr),
+                                shape=(len(user_codes) + 1, n_items))
+
+def normalise_rows(matrix):
+    """Mean-centre and range-scale the stored ratings of every row.
+
+    Matches ``(x - mean(x)) / (max(x) - min(x))`` over the rated items of
+    each user; rows with a single distinct rating become empty.
 
-    # Return Movie Names
-    recommendations = []
-    for movieid in top_N:
-        recommendations.append(movies_df[movies_df['movieId']==movieid]['title'].tolist())
-    recommendations = [item for sublist in recommendations for item in sublist]
-    recommendations = [x for x in recommendations if x not in movie_list]
-    recommendations[:top_n]
-    return recommendations
+    """
+    counts = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    nonempty = matrix.indptr[:-1][counts > 0]
+    means = np.zeros(matrix.shape[0], dtype=np.float32)
+    spans = np.zeros(matrix.shape[0], dtype=np.float32)
+    means[counts > 0] = np.add.reduceat(matrix.data, nonempty) / counts[counts > 0]
+    spans[counts > 0] = (np.maximum.reduceat(matrix.data, nonempty)
+                         - np.minimum.reduceat(matrix.data, nonempty))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data = (matrix.data - means[rows]) / spans[rows]
+    data[~np.isfinite(data)] = 0
+    normalised = sp.sparse.csr_matrix((data.astype(np.float32), matrix.indices, matrix.indptr),
+                                      shape=matrix.shape)
+    normalised.eliminate_zeros()
+    return normalised
@@ -29,59 +29,124 @@
 
 # Script dependencies
 import os
-import pandas as pd
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-imdb = pd.read_csv('resources/data/imdb_data.csv').fillna('')
-movies = movies.dropna()
+# Custom Libraries
+from recommenders.ann import ANN_NPROBE
+from recommenders.cache import cached_candidates, cached_results, validate
+from recommenders.content_index import merge_candidates, neighbour_row
+from utils.tracing import stage
+from utils.resources import (artifact_version, get_catalog, get_ann_index, get_genome_features,
+                             get_neighbour_index, get_text_features)
 
-# Generate dataframe for recommender
-movies = pd.merge(movies,imdb,on='movieId',how='left')
+# Features used by `content_model`: 'text' uses the cast, crew, genres and
+# plot keywords of each movie, 'genome' the dense tag-genome embeddings
+# (see `recommenders.genome_features`), falling back to the text features
+# for movies without genome scores.
+CONTENT_BACKEND = os.environ.get('CONTENT_BACKEND', 'text')
 
-# Remove NaN values
 
-# movies['rating']=movies['rating'].fillna(0)
-movies['title_cast'] = movies['title_cast'].fillna('')
-movies['genres'] = movies['genres'].fillna('')
-movies['plot_keywords'] = movies['plot_keywords'].fillna('')
-movies['director'] = movies['director'].fillna('')
+# Number of neighbours kept per favourite movie when no index is available
+CANDIDATES_PER_MOVIE = 100
 
+def movie_candidates(features, rows, k=CANDIDATES_PER_MOVIE):
+    """Compute the top neighbours of a few rows directly from the features.
+
+    Only the similarity rows of the chosen movies are computed, so this
+    fallback never materialises the full N x N similarity matrix.
 
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    features : scipy.sparse.csr_matrix
+        Movie x feature matrix, e.g. from `utils.resources.get_text_features`.
+    rows : list (int)
+        Rows of the movies chosen by the app user.
+    k : int
+        Number of neighbours to keep per movie.
+
     Returns
     -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
-    """
-    # Split genre data into individual words.
-    movies['input'] = movies['plot_keywords']+'|'+movies['title_cast']+'|'+movies['director']+'|'+movies['genres']
-    movies['input'] = movies['input'].str.replace('|', ' ')
-
-
-
-    # Function to convert genres column from list to strings
+    list (tuple (ndarray, ndarray))
+        Neighbour rows and similarity scores of each movie.
 
-    def string(input):
-        string = ''
-        for i in input:
-            string = string + str(i)
-        return string
-
-    movies['input'] = movies['input'].apply(string)
+    """
+    with stage('content.similarity', movies=len(rows), catalogue=features.shape[0],
+               nnz=features.nnz):
+        similarity = cosine_similarity(features[rows], features, dense_output=True)
+        similarity = similarity.astype(np.float32)
+    with stage('content.top_k', movies=len(rows), k=k):
+        k = min(k, similarity.shape[1] - 1)
+        candidates = []
+        for scores, row in zip(similarity, rows):
+            scores[row] = -np.inf
+            top = np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            candidates.append((top.astype(np.int32), scores[top]))
+    return candidates
+
+def text_candidates(rows):
+    """Neighbours of catalogue rows from the text features."""
+    neighbours = get_neighbour_index()
+    if neighbours is not None:
+        # Read the precomputed neighbour lists of the chosen movies
+        index, _ = neighbours
+        return [neighbour_row(index, row) for row in rows]
+    # No index has been built: score the chosen movies against the
+    # catalogue, reusing the candidates of movies seen before
+    return cached_candidates(
+        'content', rows, lambda missing: movie_candidates(get_text_features(), missing))
+
+def genome_candidates(rows):
+    """Neighbours of catalogue rows from the genome embeddings."""
+    features = get_genome_features()
+    if features is None:
+        raise FileNotFoundError("Genome features have not been built; run "
+                                "`python -m recommenders.genome_features`")
+    ann = get_ann_index('genome')
+    rows = np.asarray(rows, dtype=np.int64)
+    has_genome = features.feature_rows[rows] >= 0
+    candidates = [None] * len(rows)
+    for i, candidate in zip(np.flatnonzero(has_genome),
+                            cached_candidates('content_genome', rows[has_genome].tolist(),
+                                              lambda missing: features.neighbours(
+                                                  missing, CANDIDATES_PER_MOVIE, ann, ANN_NPROBE))):
+        candidates[i] = candidate
+    for i, candidate in zip(np.flatnonzero(~has_genome), text_candidates(rows[~has_genome].tolist())):
+        candidates[i] = candidate
+    return candidates
+
+def recommend(movie_lists, top_n):
+    """Compute content-based recommendations for several requests (uncached).
 
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
 
-    movies_subset = movies[:subset_size] # return subset of dataframe
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
 
-    return movies_subset
+    """
+    # The text neighbour index and the genome features share the catalogue rows
+    catalog = get_catalog()
+    fetch = genome_candidates if CONTENT_BACKEND == 'genome' else text_candidates
+
+    rows_per_list = [catalog.rows_of_titles(movie_list).tolist() for movie_list in movie_lists]
+    unique_rows = sorted({row for rows in rows_per_list for row in rows})
+    with stage(f'content.candidates.{CONTENT_BACKEND}', movies=len(unique_rows)):
+        candidates = dict(zip(unique_rows, fetch(unique_rows)))
+
+    with stage('content.merge', requests=len(movie_lists), top_n=top_n):
+        recommendations = []
+        for rows in rows_per_list:
+            top_indexes, _ = merge_candidates([candidates[row] for row in rows], top_n, exclude=rows)
+            recommendations.append(catalog.titles_of_rows(top_indexes))
+    return recommendations
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.
@@ -102,42 +167,29 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer(analyzer='word',ngram_range=(1, 2),min_df=0, stop_words='english')
-    count_matrix = count_vec.fit_transform(data['input'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
+    return content_model_batch([movie_list], top_n)[0]
+
+def content_model_batch(movie_lists, top_n=10):
+    """Serve several `content_model` requests together.
+
+    Results are cached; the order of the favourites does not matter.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
+
+    """
+    if CONTENT_BACKEND not in ('text', 'genome'):
+        raise ValueError(f"Unknown content backend: {CONTENT_BACKEND}")
+    with stage('content.request', requests=len(movie_lists), top_n=top_n):
+        validate(artifact_version())
+        return cached_results(f'content_{CONTENT_BACKEND}', movie_lists, top_n, recommend,
+                              ordered=False)
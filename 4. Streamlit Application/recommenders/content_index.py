@@ -0,0 +1,186 @@
+"""
+
+    Precomputed top-K content neighbour index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Offline build step and loader for a sparse neighbour
+    index over the content features of every movie. Each row of the
+    index holds the `top_k` most similar movies (int32 row ids) and their
+    cosine similarity (float32), stored in CSR form so that the app only
+    needs to read a handful of rows per request instead of materialising
+    the dense N x N similarity matrix.
+
+    Build the index from the root of the Streamlit application with:
+
+        python -m recommenders.content_index --top-k 100
+
+    It is computed from the hashed text features saved by
+    `recommenders.text_features`, which are built in-process if missing.
+
+"""
+# Script dependencies
+import argparse
+import os
+import numpy as np
+import scipy.sparse as sps
+from sklearn.preprocessing import normalize
+
+
+def build_neighbour_index(features, top_k=100, block_size=512):
+    """Compute the top-k cosine neighbours of every row of a feature matrix.
+
+    Parameters
+    ----------
+    features : scipy.sparse matrix or ndarray
+        Item x feature matrix, one row per movie.
+    top_k : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of rows scored at once. Peak memory is roughly
+        `block_size * n_items * 4` bytes.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        n_items x n_items matrix holding float32 similarity scores for the
+        top-k neighbours of each row, sorted by descending score.
+
+    """
+    if sps.issparse(features):
+        features = normalize(sps.csr_matrix(features, dtype=np.float32))
+    else:
+        features = normalize(np.asarray(features, dtype=np.float32))
+    n_items = features.shape[0]
+    top_k = min(top_k, n_items - 1)
+
+    indptr = np.arange(0, (n_items + 1) * top_k, top_k, dtype=np.int64)
+    indices = np.empty(n_items * top_k, dtype=np.int32)
+    data = np.empty(n_items * top_k, dtype=np.float32)
+
+    for start in range(0, n_items, block_size):
+        stop = min(start + block_size, n_items)
+        block = features[start:stop] @ features.T
+        if sps.issparse(block):
+            block = block.toarray()
+        block = np.asarray(block, dtype=np.float32)
+        # A movie is never its own neighbour
+        rows = np.arange(stop - start)
+        block[rows, rows + start] = -np.inf
+
+        top = np.argpartition(-block, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        indices[start * top_k:stop * top_k] = top.ravel()
+        data[start * top_k:stop * top_k] = top_scores.ravel()
+
+    return sps.csr_matrix((data, indices, indptr), shape=(n_items, n_items))
+
+
+def save_neighbour_index(path, index, movie_ids, titles):
+    """Persist a neighbour index alongside its row -> movie mapping.
+
+    Parameters
+    ----------
+    path : str
+        Destination `.npz` file.
+    index : scipy.sparse.csr_matrix
+        Neighbour index as returned by `build_neighbour_index`.
+    movie_ids : array-like (int)
+        MovieLens movie ID of each index row.
+    titles : array-like (str)
+        Title of each index row.
+
+    """
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path,
+             indptr=index.indptr.astype(np.int64),
+             indices=index.indices.astype(np.int32),
+             data=index.data.astype(np.float32),
+             shape=np.asarray(index.shape, dtype=np.int64),
+             movie_ids=np.asarray(movie_ids, dtype=np.int32),
+             titles=np.asarray(titles, dtype=str))
+    # Written to a temporary file so readers never see a partial index
+    os.replace(tmp_path, path)
+
+
+def load_neighbour_index(path):
+    """Load a neighbour index written by `save_neighbour_index`.
+
+    Parameters
+    ----------
+    path : str
+        Location of the `.npz` artifact.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, ndarray, ndarray)
+        The neighbour index, the movie ID of each row and the title of
+        each row.
+
+    """
+    with np.load(path) as archive:
+        index = sps.csr_matrix((archive['data'], archive['indices'], archive['indptr']),
+                               shape=tuple(archive['shape']))
+        return index, archive['movie_ids'], archive['titles']
+
+
+def neighbour_row(index, row):
+    """Neighbour rows and scores of one movie (views into the index)."""
+    start, stop = index.indptr[row], index.indptr[row + 1]
+    return index.indices[start:stop], index.data[start:stop]
+
+
+def merge_candidates(candidate_lists, top_n, exclude=()):
+    """Merge several (rows, scores) candidate lists into a single ranking.
+
+    Candidates appearing in more than one list keep their best score.
+
+    Parameters
+    ----------
+    candidate_lists : list (tuple (ndarray, ndarray))
+        Candidate rows and scores, e.g. one list per favourite movie.
+    top_n : int
+        Number of candidates to return.
+    exclude : iterable (int)
+        Rows which may not be recommended (e.g. the chosen movies).
+
+    Returns
+    -------
+    tuple (ndarray, ndarray)
+        Row ids and scores of the top-n merged candidates.
+
+    """
+    candidates = np.concatenate([rows for rows, _ in candidate_lists])
+    scores = np.concatenate([scores for _, scores in candidate_lists])
+
+    # Keep the best score of every candidate, ranked in descending order
+    order = np.argsort(-scores, kind='stable')
+    candidates, scores = candidates[order], scores[order]
+    _, first = np.unique(candidates, return_index=True)
+    first = np.sort(first)
+    candidates, scores = candidates[first], scores[first]
+
+    keep = ~np.isin(candidates, np.asarray(list(exclude), dtype=candidates.dtype))
+    return candidates[keep][:top_n], scores[keep][:top_n]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the content neighbour index.')
+    parser.add_argument('--top-k', type=int, default=100,
+                        help='Number of neighbours stored per movie.')
+    parser.add_argument('--block-size', type=int, default=512,
+                        help='Rows scored per block; bounds peak memory.')
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    args = parser.parse_args()
+
+    from utils.resources import get_catalog, get_text_features, resource_path
+    args.output = args.output or resource_path('models', 'content_neighbours.npz')
+    catalog = get_catalog()
+    index = build_neighbour_index(get_text_features(), args.top_k, args.block_size)
+    save_neighbour_index(args.output, index, catalog.movie_ids, catalog.titles)
+    print(f"Neighbour index for {index.shape[0]} movies saved to: {args.output}")
@@ -0,0 +1,238 @@
+"""
+
+    Parallel offline evaluation of recommendation models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Splits the ratings store into train and holdout ratings
+    (per-user time-based or leave-k-out), then scores many holdout users
+    at once: a block of users is ranked against the whole catalogue with
+    one matrix product, their training items are masked out, and MAP@K,
+    Precision@K and Recall@K are computed with vectorised NumPy. Catalogue
+    coverage and the RMSE over the holdout ratings are reported too.
+
+    Blocks of users are spread across a process pool. Workers open the
+    memory-mapped ratings store and the holdout mask themselves, so the
+    (read-only) inputs are shared through the OS page cache rather than
+    copied to every process.
+
+    Evaluate from the root of the Streamlit application with:
+
+        python -m recommenders.evaluation --split leave-k-out --k 10
+
+    Without `--model`, an ALS model is first trained on the training split
+    and saved next to the store as `evaluation_model.npz`; a model given
+    with `--model` must have been trained without the holdout ratings.
+
+"""
+# Script dependencies
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Custom Libraries
+from recommenders.factor_model import load_factor_model
+from utils.ratings_store import RatingsStore
+
+
+def time_split(store, test_fraction=0.2):
+    """Hold out the most recent ratings of every user.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Ratings to split; must have been converted with timestamps.
+    test_fraction : float
+        Fraction of each user's ratings held out (rounded down, so users
+        with very few ratings stay entirely in the training set).
+
+    Returns
+    -------
+    ndarray (bool)
+        Mask over the user-major ratings, True for holdout ratings.
+
+    """
+    if not store.meta['has_timestamps']:
+        raise ValueError("A time-based split needs a ratings store with timestamps")
+    counts = np.diff(store.user_indptr)
+    return _split_by_rank(store, np.asarray(store.user_timestamps),
+                          np.floor(counts * test_fraction).astype(np.int64))
+
+
+def leave_k_out(store, k=5, seed=0):
+    """Hold out k random ratings of every user with more than k ratings."""
+    counts = np.diff(store.user_indptr)
+    keys = np.random.default_rng(seed).random(store.n_ratings)
+    return _split_by_rank(store, keys, np.where(counts > k, k, 0))
+
+
+def _split_by_rank(store, keys, n_test):
+    """Mark the n_test[u] ratings of each user with the largest keys."""
+    counts = np.diff(store.user_indptr)
+    users = np.repeat(np.arange(store.n_users), counts)
+    # Positions are already grouped by user, so this sorts within users
+    order = np.lexsort((keys, users))
+    rank = np.arange(store.n_ratings) - np.repeat(store.user_indptr[:-1], counts)
+    mask = np.zeros(store.n_ratings, dtype=bool)
+    mask[order[rank >= (counts - n_test)[users]]] = True
+    return mask
+
+
+# State of each worker process, set up once by `_init_worker`
+_worker = {}
+
+def _init_worker(store_path, model_path, mask_path, k):
+    store = RatingsStore(store_path)
+    model = load_factor_model(model_path)
+    _worker.update(store=store, model=model, k=k,
+                   test_mask=np.load(mask_path, mmap_mode='r'),
+                   user_map=model.user_rows(store.user_ids.tolist()),
+                   item_map=model.item_rows(store.item_ids.tolist()))
+
+
+def _evaluate_block(user_codes):
+    """Ranking metrics of a block of users (summed, for later averaging)."""
+    store, model, k = _worker['store'], _worker['model'], _worker['k']
+    test_mask, user_map, item_map = _worker['test_mask'], _worker['user_map'], _worker['item_map']
+    n_model_items = len(model.qi)
+
+    user_vectors, _ = model._gather(user_map[user_codes], model.pu, model.bu)
+    scores = user_vectors @ model.qi.T
+    scores += model.bi[None, :]
+
+    relevant = np.zeros((len(user_codes), n_model_items), dtype=bool)
+    n_test = np.zeros(len(user_codes), dtype=np.int64)
+    for i, user in enumerate(user_codes):
+        start, stop = store.user_indptr[user], store.user_indptr[user + 1]
+        items = item_map[np.asarray(store.user_items[start:stop])]
+        is_test = np.asarray(test_mask[start:stop])
+        n_test[i] = np.count_nonzero(is_test)
+        train_items, test_items = items[~is_test], items[is_test]
+        # Already seen (training) movies are never recommended
+        scores[i, train_items[train_items >= 0]] = -np.inf
+        relevant[i, test_items[test_items >= 0]] = True
+
+    k = min(k, n_model_items)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+    hits = np.take_along_axis(relevant, top, axis=1)
+
+    cumulative_hits = np.cumsum(hits, axis=1)
+    precision_at = cumulative_hits / np.arange(1, k + 1)
+    average_precision = (precision_at * hits).sum(axis=1) / np.minimum(n_test, k)
+    return {'users': len(user_codes),
+            'map': float(average_precision.sum()),
+            'precision': float((cumulative_hits[:, -1] / k).sum()),
+            'recall': float((cumulative_hits[:, -1] / n_test).sum()),
+            'recommended': np.unique(top)}
+
+
+def _holdout_rmse(store, model, test_mask, chunksize=1_000_000):
+    """RMSE of the model over the holdout ratings."""
+    user_map = model.user_rows(store.user_ids.tolist())
+    item_map = model.item_rows(store.item_ids.tolist())
+    squared, count = 0.0, 0
+    for start in range(0, store.n_ratings, chunksize):
+        stop = min(start + chunksize, store.n_ratings)
+        positions = start + np.flatnonzero(test_mask[start:stop])
+        users = np.searchsorted(store.user_indptr, positions, side='right') - 1
+        estimates = model.predict_pairs(user_map[users], item_map[np.asarray(store.user_items[positions])])
+        errors = estimates - store.decode(store.user_ratings[positions])
+        squared += float(errors @ errors)
+        count += len(positions)
+    return float(np.sqrt(squared / count)) if count else float('nan')
+
+
+def evaluate(store_path, model_path, test_mask, k=10, n_jobs=None, block_size=256,
+             mask_path=None):
+    """Evaluate a model on the holdout ratings of a split.
+
+    Parameters
+    ----------
+    store_path : str
+        Ratings store directory.
+    model_path : str
+        Model trained on the training ratings only (exported factors or a
+        pickled surprise SVD).
+    test_mask : ndarray (bool)
+        Holdout mask from `time_split` or `leave_k_out`.
+    k : int
+        Cut-off of the ranking metrics.
+    n_jobs : int or None
+        Worker processes; defaults to the number of CPU cores.
+    block_size : int
+        Users scored per matrix product.
+    mask_path : str or None
+        Where the mask is saved for the workers to memory-map; defaults to
+        a file next to the store.
+
+    Returns
+    -------
+    dict
+        MAP@K, Precision@K, Recall@K, coverage, RMSE and timings.
+
+    """
+    start = time.perf_counter()
+    n_jobs = n_jobs or os.cpu_count()
+    mask_path = mask_path or os.path.join(store_path, 'holdout_mask.npy')
+    np.save(mask_path, test_mask)
+
+    store = RatingsStore(store_path)
+    counts = np.diff(store.user_indptr)
+    test_counts = np.add.reduceat(test_mask.astype(np.int64), store.user_indptr[:-1]) * (counts > 0)
+    users = np.flatnonzero((test_counts > 0) & (test_counts < counts))
+    blocks = [users[i:i + block_size] for i in range(0, len(users), block_size)]
+
+    totals = {'users': 0, 'map': 0.0, 'precision': 0.0, 'recall': 0.0}
+    recommended = []
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(store_path, model_path, mask_path, k)) as executor:
+        for part in executor.map(_evaluate_block, blocks):
+            recommended.append(part.pop('recommended'))
+            for key in totals:
+                totals[key] += part[key]
+
+    model = load_factor_model(model_path)
+    n_users = max(totals['users'], 1)
+    return {'k': k,
+            'users': totals['users'],
+            f'map@{k}': totals['map'] / n_users,
+            f'precision@{k}': totals['precision'] / n_users,
+            f'recall@{k}': totals['recall'] / n_users,
+            'coverage': len(np.unique(np.concatenate(recommended))) / len(model.qi) if recommended else 0.0,
+            'rmse': _holdout_rmse(store, model, test_mask),
+            'seconds': time.perf_counter() - start}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a recommendation model offline.')
+    parser.add_argument('--store', default='resources/data/ratings_store')
+    parser.add_argument('--model', default=None,
+                        help='Model trained on the training split; omit to train one with ALS.')
+    parser.add_argument('--split', choices=['time', 'leave-k-out'], default='time')
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--leave-k', type=int, default=5)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--factors', type=int, default=100,
+                        help='Factors of the ALS model trained when --model is omitted.')
+    parser.add_argument('--epochs', type=int, default=10)
+    args = parser.parse_args()
+
+    store = RatingsStore(args.store)
+    if args.split == 'time':
+        test_mask = time_split(store, args.test_fraction)
+    else:
+        test_mask = leave_k_out(store, args.leave_k)
+
+    model_path = args.model
+    if model_path is None:
+        from recommenders.factor_training import train_als
+        model, _ = train_als(store, n_factors=args.factors, n_epochs=args.epochs, mask=~test_mask)
+        model_path = os.path.join(args.store, 'evaluation_model.npz')
+        model.publish(model_path)
+
+    for name, value in evaluate(args.store, model_path, test_mask, args.k, args.jobs).items():
+        print(f"{name:>14s}: {value}")
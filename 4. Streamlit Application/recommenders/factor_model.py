@@ -0,0 +1,460 @@
+"""
+
+    Vectorised scoring of matrix-factorisation models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Wraps the learnt factors of an SVD model (user factors
+    `pu`, item factors `qi`, biases `bu`/`bi` and the global mean) so that
+    many users can be scored against a batch of items with a single NumPy
+    matrix product, instead of calling `model.predict` once per pair.
+
+    Models are served from a versioned artifact directory: one float32
+    `.npy` file per array (memory-mapped on load, so concurrent app and
+    API processes share their pages through the OS cache) and a
+    `meta.json` header with the global mean, the rating scale, the
+    training parameters and a hash of the training data. Loading it needs
+    no unpickling. Published models live in versioned directories
+    (`svd_factors.v<ns>`) and `svd_factors` is a symbolic link to the
+    current one, replaced in a single rename. Convert the pickled surprise
+    model with:
+
+        python -m recommenders.factor_model resources/models/SVD_01.pkl
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import pickle
+import time
+import numpy as np
+
+# Custom Libraries
+from utils.publishing import publish_directory, resolve_published, to_json
+
+ARTIFACT_FORMAT = 'factor-model'
+ARTIFACT_VERSION = 1
+
+# Arrays making up an artifact, written as `<name>.npy`
+_ARRAYS = ['pu', 'qi', 'bu', 'bi', 'raw_user_ids', 'raw_item_ids', 'user_order', 'item_order']
+
+
+class FactorModel:
+    """Latent factors and biases of a trained rating model.
+
+    Estimates follow the biased SVD model used by `surprise`:
+    ``r_ui = mu + b_u + b_i + q_i . p_u``, where the user (or item) terms
+    are dropped for ids unknown to the model.
+
+    Parameters
+    ----------
+    pu : ndarray
+        User factors, one row per known user.
+    qi : ndarray
+        Item factors, one row per known item.
+    bu : ndarray
+        User biases.
+    bi : ndarray
+        Item biases.
+    global_mean : float
+        Mean rating of the training data.
+    raw_user_ids : array-like
+        Raw (MovieLens) user ID of each row of `pu`.
+    raw_item_ids : array-like
+        Raw (MovieLens) movie ID of each row of `qi`.
+    rating_scale : tuple (float, float)
+        Lowest and highest possible rating.
+    metadata : dict or None
+        Provenance saved with the model (e.g. `params`, `data_hash`).
+
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, raw_user_ids, raw_item_ids,
+                 rating_scale=(0.5, 5.0), metadata=None):
+        self.pu = np.asarray(pu, dtype=np.float32)
+        self.qi = np.asarray(qi, dtype=np.float32)
+        self.bu = np.asarray(bu, dtype=np.float32)
+        self.bi = np.asarray(bi, dtype=np.float32)
+        self.global_mean = float(global_mean)
+        self.raw_user_ids = np.asarray(raw_user_ids)
+        self.raw_item_ids = np.asarray(raw_item_ids)
+        self.rating_scale = tuple(rating_scale)
+        self.metadata = dict(metadata or {})
+        # Sort orders of the raw ids, computed on first lookup
+        self.user_order = None
+        self.item_order = None
+
+    @classmethod
+    def from_surprise(cls, algo):
+        """Extract the factors of a fitted `surprise.SVD` instance.
+
+        Parameters
+        ----------
+        algo : surprise.SVD
+            A trained SVD model, e.g. the content of `SVD_01.pkl`.
+
+        Returns
+        -------
+        FactorModel
+            Scoring engine holding float32 copies of the model factors.
+
+        """
+        trainset = algo.trainset
+        raw_user_ids = [trainset.to_raw_uid(u) for u in range(trainset.n_users)]
+        raw_item_ids = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+        params = {name: getattr(algo, name) for name in
+                  ['n_factors', 'n_epochs', 'biased', 'init_mean', 'init_std_dev',
+                   'lr_bu', 'lr_bi', 'lr_pu', 'lr_qi', 'reg_bu', 'reg_bi', 'reg_pu', 'reg_qi']
+                  if hasattr(algo, name)}
+        return cls(algo.pu, algo.qi, algo.bu, algo.bi, trainset.global_mean,
+                   raw_user_ids, raw_item_ids, trainset.rating_scale,
+                   metadata={'trainer': f'surprise.{type(algo).__name__}', 'params': params,
+                             'n_ratings': trainset.n_ratings})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load an artifact directory written by `save`.
+
+        Parameters
+        ----------
+        path : str
+            Artifact directory.
+        mmap : bool
+            Memory-map the arrays (read-only) instead of reading them.
+
+        Returns
+        -------
+        FactorModel
+            The model; loading only reads the header and maps the arrays.
+
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != ARTIFACT_FORMAT or meta.get('version') != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported model artifact: {meta.get('format')} "
+                             f"version {meta.get('version')}")
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+                  for name in _ARRAYS}
+        model = cls(arrays['pu'], arrays['qi'], arrays['bu'], arrays['bi'], meta['global_mean'],
+                    arrays['raw_user_ids'], arrays['raw_item_ids'], meta['rating_scale'],
+                    meta['metadata'])
+        model.user_order, model.item_order = arrays['user_order'], arrays['item_order']
+        return model
+
+    def save(self, path, metadata=None):
+        """Write the model as an artifact directory.
+
+        Parameters
+        ----------
+        path : str
+            Destination directory, created if needed.
+        metadata : dict or None
+            Extra provenance merged into the model's `metadata`.
+
+        """
+        self.metadata.update(metadata or {})
+        os.makedirs(path, exist_ok=True)
+        arrays = {'pu': self.pu, 'qi': self.qi, 'bu': self.bu, 'bi': self.bi,
+                  'raw_user_ids': self.raw_user_ids, 'raw_item_ids': self.raw_item_ids,
+                  'user_order': self._order('user'), 'item_order': self._order('item')}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
+        # The header is written last: its modification time versions the artifact
+        meta = {'format': ARTIFACT_FORMAT, 'version': ARTIFACT_VERSION,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'n_users': len(self.pu), 'n_items': len(self.qi), 'n_factors': self.n_factors,
+                'global_mean': self.global_mean, 'rating_scale': list(self.rating_scale),
+                'metadata': self.metadata}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2, default=to_json)
+
+    @classmethod
+    def from_npz(cls, path):
+        """Load factors written by `to_npz`."""
+        with np.load(path) as archive:
+            metadata = json.loads(str(archive['metadata'])) if 'metadata' in archive else None
+            return cls(archive['pu'], archive['qi'], archive['bu'], archive['bi'],
+                       archive['global_mean'], archive['raw_user_ids'], archive['raw_item_ids'],
+                       tuple(archive['rating_scale'].tolist()), metadata)
+
+    def to_npz(self, path):
+        """Save the factors, biases and id maps as a NumPy archive."""
+        np.savez(path, pu=self.pu, qi=self.qi, bu=self.bu, bi=self.bi,
+                 global_mean=np.float64(self.global_mean),
+                 raw_user_ids=self.raw_user_ids, raw_item_ids=self.raw_item_ids,
+                 rating_scale=np.asarray(self.rating_scale, dtype=np.float64),
+                 metadata=json.dumps(self.metadata, default=to_json))
+
+    def publish(self, path, keep=2):
+        """Atomically replace the model at `path` with this one.
+
+        `.npz` destinations receive an archive, written next to it and
+        renamed into place. Anything else is published as a new version
+        directory `<path>.v<ns>` behind a symbolic link (see
+        `utils.publishing.publish_directory`), so `path` always names a
+        complete model (e.g. for the app's resource registry, which reloads
+        on modification time).
+
+        Parameters
+        ----------
+        path : str
+            Destination archive or link.
+        keep : int
+            Version directories kept, the current one included.
+
+        """
+        if path.endswith('.npz'):
+            tmp_path = path + '.tmp.npz'
+            self.to_npz(tmp_path)
+            os.replace(tmp_path, path)
+            return
+        publish_directory(self.save, path, keep)
+
+    @property
+    def n_factors(self):
+        return self.qi.shape[1]
+
+    def _order(self, kind):
+        """Sort order of the raw user or item ids (cached)."""
+        if getattr(self, f'{kind}_order') is None:
+            raw_ids = getattr(self, f'raw_{kind}_ids')
+            setattr(self, f'{kind}_order', np.argsort(raw_ids, kind='stable'))
+        return getattr(self, f'{kind}_order')
+
+    def _rows(self, kind, raw_ids):
+        """Binary search of raw ids in the sorted raw ids of `kind`."""
+        raw_ids = np.asarray(raw_ids)
+        known_ids = getattr(self, f'raw_{kind}_ids')
+        order = self._order(kind)
+        if len(known_ids) == 0 or len(raw_ids) == 0:
+            return np.full(len(raw_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(known_ids, raw_ids, sorter=order), len(order) - 1)
+        rows = np.asarray(order[positions], dtype=np.int64)
+        return np.where(known_ids[rows] == raw_ids, rows, -1)
+
+    def user_rows(self, raw_ids):
+        """Map raw user IDs to factor rows, using -1 for unknown users."""
+        return self._rows('user', raw_ids)
+
+    def item_rows(self, raw_ids):
+        """Map raw movie IDs to factor rows, using -1 for unknown items."""
+        return self._rows('item', raw_ids)
+
+    def _gather(self, rows, factors, biases):
+        """Factors and biases for `rows`, zeroed where a row is unknown."""
+        known = rows >= 0
+        safe = np.where(known, rows, 0)
+        vectors = factors[safe] * known[:, None]
+        offsets = biases[safe] * known
+        return vectors, offsets
+
+    def score(self, user_rows, item_rows):
+        """Estimate the rating of every user for every item.
+
+        Parameters
+        ----------
+        user_rows : ndarray (int)
+            Factor rows of the users to score (-1 for unknown users).
+        item_rows : ndarray (int)
+            Factor rows of the items to score (-1 for unknown items).
+
+        Returns
+        -------
+        ndarray
+            len(user_rows) x len(item_rows) float32 matrix of estimates.
+
+        """
+        user_vectors, user_biases = self._gather(np.asarray(user_rows), self.pu, self.bu)
+        item_vectors, item_biases = self._gather(np.asarray(item_rows), self.qi, self.bi)
+        scores = user_vectors @ item_vectors.T
+        scores += user_biases[:, None]
+        scores += item_biases[None, :]
+        scores += self.global_mean
+        return scores
+
+    def predict_pairs(self, user_rows, item_rows):
+        """Estimate the rating of each (user, item) pair, clipped to the rating scale.
+
+        Parameters
+        ----------
+        user_rows, item_rows : ndarray (int)
+            Factor rows of each pair (-1 for unknown ids, which fall back
+            to the remaining bias terms).
+
+        Returns
+        -------
+        ndarray
+            float32 estimate per pair.
+
+        """
+        user_vectors, user_biases = self._gather(np.asarray(user_rows), self.pu, self.bu)
+        item_vectors, item_biases = self._gather(np.asarray(item_rows), self.qi, self.bi)
+        estimates = np.einsum('ij,ij->i', user_vectors, item_vectors)
+        estimates += user_biases + item_biases + self.global_mean
+        return np.clip(estimates, *self.rating_scale)
+
+    def top_users(self, user_rows, item_rows, k=50):
+        """Find the k users with the highest estimate for each item.
+
+        Parameters
+        ----------
+        user_rows : ndarray (int)
+            Factor rows of the candidate users.
+        item_rows : ndarray (int)
+            Factor rows of the items.
+        k : int
+            Number of users to keep per item.
+
+        Returns
+        -------
+        ndarray
+            len(item_rows) x k array of positions into `user_rows`, each row
+            sorted by descending estimate.
+
+        """
+        scores = self.score(user_rows, item_rows).T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1)
+
+    def fold_in(self, item_rows, ratings, reg=0.05):
+        """Project a new user into the latent space from a few ratings.
+
+        Solves the regularised least-squares problem
+        ``min_p sum_i (r_i - mu - b_i - q_i . p)^2 + reg * n * |p|^2`` over the
+        n rated items, which is the closed-form user step of ALS. With no
+        known items the zero vector is returned, so ranking falls back to
+        the item biases.
+
+        Parameters
+        ----------
+        item_rows : ndarray (int)
+            Factor rows of the rated items. Unknown items (-1) are ignored.
+        ratings : array-like (float)
+            Rating given to each item.
+        reg : float
+            L2 regularisation strength.
+
+        Returns
+        -------
+        ndarray
+            float32 latent vector of the new user.
+
+        """
+        item_rows = np.asarray(item_rows)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        known = item_rows >= 0
+        q = self.qi[item_rows[known]]
+        residuals = ratings[known] - self.global_mean - self.bi[item_rows[known]]
+        gram = q.T @ q + reg * max(len(q), 1) * np.eye(self.n_factors, dtype=np.float32)
+        return np.linalg.solve(gram, q.T @ residuals).astype(np.float32)
+
+    def rank_items(self, user_vector, top_n=10, exclude=()):
+        """Rank the whole catalogue for a latent user vector.
+
+        Parameters
+        ----------
+        user_vector : ndarray
+            Latent vector, e.g. from `fold_in`.
+        top_n : int
+            Number of items to return.
+        exclude : iterable (int)
+            Item rows which may not be returned.
+
+        Returns
+        -------
+        ndarray
+            Item rows of the top-n items, by descending estimate.
+
+        """
+        return self.rank_items_batch(np.asarray(user_vector)[None, :], top_n, [exclude])[0]
+
+    def rank_items_batch(self, user_vectors, top_n=10, excludes=None):
+        """Rank the whole catalogue for several latent user vectors at once.
+
+        All users are scored with a single matrix product, which is how
+        concurrent requests are served together.
+
+        Parameters
+        ----------
+        user_vectors : ndarray
+            One latent vector per row.
+        top_n : int
+            Number of items to return per user.
+        excludes : list (iterable (int)) or None
+            Item rows which may not be returned, per user.
+
+        Returns
+        -------
+        ndarray
+            len(user_vectors) x top_n item rows, by descending estimate.
+
+        """
+        scores = np.asarray(user_vectors, dtype=np.float32) @ self.qi.T
+        scores += self.bi[None, :]
+        for row, exclude in enumerate(excludes or []):
+            scores[row, np.asarray(list(exclude), dtype=np.int64)] = -np.inf
+        top_n = min(top_n, scores.shape[1])
+        top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1)
+
+def load_factor_model(path):
+    """Load a `FactorModel` from an artifact, exported factors or a pickled surprise model.
+
+    Parameters
+    ----------
+    path : str
+        An artifact directory written by `FactorModel.save`, a `.npz`
+        archive written by `FactorModel.to_npz`, or a pickled
+        `surprise.SVD` model such as `SVD_01.pkl`. Pickles can run
+        arbitrary code, so only load those from trusted sources.
+
+    Returns
+    -------
+    FactorModel
+        The scoring engine.
+
+    """
+    if path.endswith('.npz'):
+        return FactorModel.from_npz(path)
+    if os.path.isdir(path) or not os.path.exists(path):
+        # A published link (or its newest version while the link is swapped)
+        for attempt in range(3):
+            try:
+                return FactorModel.load(resolve_published(path) or path)
+            except FileNotFoundError:
+                # The resolved version was pruned by a concurrent publish
+                if attempt == 2:
+                    raise
+    with open(path, 'rb') as f:
+        return FactorModel.from_surprise(pickle.load(f))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a model as a memory-mappable artifact.')
+    parser.add_argument('model', help='Pickled surprise model or exported .npz factors.')
+    parser.add_argument('--output', default='resources/models/svd_factors')
+    parser.add_argument('--store', default='resources/data/ratings_store',
+                        help='Ratings store the model was trained on.')
+    parser.add_argument('--ratings', default='resources/data/ratings.csv',
+                        help='Ratings csv converted when the store is missing or stale.')
+    parser.add_argument('--data-hash', default=None,
+                        help='Fingerprint of the training data (defaults to the store\'s).')
+    args = parser.parse_args()
+
+    model = load_factor_model(args.model)
+    if args.data_hash is None:
+        from utils.ratings_store import open_ratings_store
+        try:
+            args.data_hash = open_ratings_store(args.store, args.ratings).fingerprint()
+        except FileNotFoundError:
+            print(f"No ratings store at {args.store}: no data hash recorded")
+    if args.data_hash:
+        model.metadata['data_hash'] = args.data_hash
+    model.metadata['source'] = os.path.basename(args.model)
+    model.publish(args.output)
+    print(f"Model ({len(model.pu)} users, {len(model.qi)} movies, {model.n_factors} factors) "
+          f"exported to: {args.output}")
@@ -0,0 +1,464 @@
+"""
+
+    Out-of-core, multi-core matrix factorisation training.
+
+    Author: Explore Data Science Academy.
+
+    Description: Biased alternating least squares (ALS) over the
+    memory-mapped ratings store. Each half-epoch solves one small ridge
+    regression per user (or item) against the fixed factors of the other
+    side; rows are processed in blocks across a thread pool, and the
+    normal equations of a block are built with batched matrix products
+    over rows padded to equal length, so the linear algebra runs in
+    NumPy/LAPACK outside the GIL rather than row by row in Python. Ratings are
+    read block by block from the memory-mapped store, so the data set is
+    never materialised as a DataFrame. The model and update rule match
+    `FactorModel`: ``r_ui = mu + b_u + b_i + q_i . p_u``.
+
+    `train_sgd` trains the same model with minibatch SGD, the way the
+    surprise SVD does, streaming the store chunk by chunk.
+
+    `incremental_update` refreshes an existing model from a batch of new
+    ratings with a few minibatch SGD passes, touching only the affected
+    user and item rows.
+
+"""
+# Script dependencies
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Custom Libraries
+from recommenders.factor_model import FactorModel
+
+
+def holdout_mask(n_ratings, fraction, seed=0):
+    """Boolean mask over the user-major ratings, True for training ratings."""
+    if not fraction:
+        return None
+    return np.random.default_rng(seed).random(n_ratings) >= fraction
+
+
+def rmse(store, model, mask=None, select=True, chunksize=1_000_000):
+    """Root mean squared error of a model over (a subset of) the store.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Ratings to evaluate, in store codes matching the model rows.
+    model : FactorModel
+        Model whose rows follow the store's user and item codes.
+    mask : ndarray (bool) or None
+        Rating selector; `None` evaluates every rating.
+    select : bool
+        Evaluate the ratings where `mask` equals this value.
+
+    Returns
+    -------
+    float
+        The RMSE, or nan when no rating is selected.
+
+    """
+    squared, count = 0.0, 0
+    for start in range(0, store.n_ratings, chunksize):
+        stop = min(start + chunksize, store.n_ratings)
+        positions = np.arange(start, stop)
+        if mask is not None:
+            positions = positions[mask[start:stop] == select]
+        users = np.searchsorted(store.user_indptr, positions, side='right') - 1
+        items = np.asarray(store.user_items[positions])
+        estimates = (model.global_mean + model.bu[users] + model.bi[items]
+                     + np.einsum('ij,ij->i', model.pu[users], model.qi[items]))
+        estimates = np.clip(estimates, *model.rating_scale)
+        errors = estimates - store.decode(store.user_ratings[positions])
+        squared += float(errors @ errors)
+        count += len(positions)
+    return float(np.sqrt(squared / count)) if count else float('nan')
+
+
+# Ratings per batched Gram product; bounds the memory of one batch to
+# about BATCH_BUDGET x (n_factors + 1) floats
+BATCH_BUDGET = 1 << 16
+
+
+def _half_step(indptr, cols, values, positions, mask, fixed_factors, fixed_biases,
+               global_mean, reg, n_jobs, block_size):
+    """Solve the factors and biases of one side given the other side.
+
+    For each row r with ratings v over columns c, the solution of
+    ``min sum (v - mu - b_c - [F_c, 1] . x)^2 + reg * n_r * |x|^2`` gives
+    ``x = [p_r, b_r]``.
+
+    The normal equations of a block are built without a Python loop over
+    its rows: rows are sorted by their number of ratings, and the rows
+    sharing a count (up to `BATCH_BUDGET` ratings at a time) lay out as
+    one (rows, count, k + 1) array, whose Gram matrices are one stacked
+    matrix product. Padding rows of different counts to a common length
+    was measured not to pay: the extra products cost as much as the
+    batches they merge.
+
+    """
+    n_rows = len(indptr) - 1
+    k = fixed_factors.shape[1]
+    factors = np.zeros((n_rows, k), dtype=np.float32)
+    biases = np.zeros(n_rows, dtype=np.float32)
+    # Fixed factors with a column of ones (for the bias)
+    augmented = np.ones((len(fixed_factors), k + 1))
+    augmented[:, :k] = fixed_factors
+
+    def solve_block(start):
+        stop = min(start + block_size, n_rows)
+        lo, hi = indptr[start], indptr[stop]
+        c = np.asarray(cols[lo:hi], dtype=np.int64)
+        v = np.asarray(values[lo:hi], dtype=np.float64) / 2
+        row_of = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+        if mask is not None:
+            keep = mask[positions[lo:hi]] if positions is not None else mask[lo:hi]
+            c, v, row_of = c[keep], v[keep], row_of[keep]
+        y = v - global_mean - fixed_biases[c]
+        counts = np.bincount(row_of, minlength=stop - start)
+
+        # Rows by number of ratings, with their ratings laid out in that order
+        order = np.argsort(counts, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        by_rank = np.argsort(rank[row_of], kind='stable')
+        c, y = c[by_rank], y[by_rank]
+        sorted_counts = counts[order]
+        ends = np.cumsum(sorted_counts)
+
+        # Normal equations in the sorted row order, so batches fill slices
+        grams = np.empty((stop - start, k + 1, k + 1))
+        rhs = np.empty((stop - start, k + 1))
+        diagonal = np.arange(k + 1)
+        first = 0
+        while first < len(order):
+            # Rows with as many ratings as the first, within the budget
+            count = sorted_counts[first]
+            last = min(np.searchsorted(sorted_counts, count, 'right'),
+                       first + max(BATCH_BUDGET // max(count, 1), 1))
+            begin, end = ends[first] - count, ends[last - 1]
+            z = augmented[c[begin:end]].reshape(last - first, count, k + 1)
+            targets = y[begin:end].reshape(last - first, count)
+            if last - first == 1:
+                # A long row alone: NumPy computes z.T @ z as a symmetric
+                # rank-k update, at half the cost of a general product
+                grams[first] = z[0].T @ z[0]
+            else:
+                np.matmul(z.transpose(0, 2, 1), z, out=grams[first:last])
+            grams[first:last, diagonal, diagonal] += reg * max(count, 1)
+            np.matmul(targets[:, None, :], z, out=rhs[first:last, None, :])
+            first = last
+        solution = np.linalg.solve(grams, rhs[..., None])[..., 0]
+        factors[start + order] = solution[:, :k]
+        biases[start + order] = solution[:, k]
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        list(executor.map(solve_block, range(0, n_rows, block_size)))
+    return factors, biases
+
+
+def _save_checkpoint(path, state):
+    """Write a checkpoint atomically, so an interrupted write never corrupts it."""
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **state)
+    os.replace(tmp_path, path)
+
+
+def train_als(store, n_factors=100, reg=0.05, n_epochs=15, holdout=0.0, seed=0,
+              checkpoint_path=None, n_jobs=None, block_size=512, init_std_dev=0.05,
+              callback=None, mask=None):
+    """Train a biased matrix factorisation model with ALS.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Memory-mapped training ratings.
+    n_factors : int
+        Number of latent factors.
+    reg : float
+        L2 regularisation, scaled by the number of ratings of each row.
+    n_epochs : int
+        Number of full (user + item) ALS sweeps.
+    holdout : float
+        Fraction of ratings held out to report validation RMSE.
+    seed : int
+        Seed for the factor initialisation and the holdout split.
+    checkpoint_path : str or None
+        `.npz` file written after every epoch. When it exists and was made
+        with the same parameters on the same ratings, training resumes
+        from it.
+    n_jobs : int or None
+        Worker threads; defaults to the number of CPU cores.
+    block_size : int
+        Rows solved per task.
+    init_std_dev : float
+        Standard deviation of the initial item factors.
+    callback : callable or None
+        Called as ``callback(epoch, model, history_entry)`` after every
+        epoch; returning True stops training early.
+    mask : ndarray (bool) or None
+        Explicit training mask over the user-major ratings (True for
+        training ratings), e.g. from an evaluation split. Overrides
+        `holdout`.
+
+    Returns
+    -------
+    tuple (FactorModel, list (dict))
+        The trained model (rows follow the store codes) and the per-epoch
+        training history.
+
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    params = {'n_factors': n_factors, 'reg': reg, 'holdout': holdout, 'seed': seed,
+              'init_std_dev': init_std_dev, 'n_ratings': store.n_ratings}
+    data_hash = store.fingerprint()
+    if mask is None:
+        mask = holdout_mask(store.n_ratings, holdout, seed)
+    else:
+        params['mask_size'] = int(np.count_nonzero(mask))
+
+    rng = np.random.default_rng(seed)
+    qi = rng.normal(0, init_std_dev, (store.n_items, n_factors)).astype(np.float32)
+    bi = np.zeros(store.n_items, dtype=np.float32)
+    pu = np.zeros((store.n_users, n_factors), dtype=np.float32)
+    bu = np.zeros(store.n_users, dtype=np.float32)
+    train_ratings = store.user_ratings if mask is None else np.asarray(store.user_ratings)[mask]
+    global_mean = float(np.mean(train_ratings, dtype=np.float64) / 2)
+    first_epoch, history = 0, []
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with np.load(checkpoint_path) as checkpoint:
+            if (json.loads(str(checkpoint['params'])) == params
+                    and str(checkpoint.get('data_hash', '')) == data_hash):
+                pu, qi, bu, bi = (checkpoint[name] for name in ['pu', 'qi', 'bu', 'bi'])
+                first_epoch = int(checkpoint['epoch']) + 1
+                history = json.loads(str(checkpoint['history']))
+
+    model = FactorModel(pu, qi, bu, bi, global_mean, store.user_ids, store.item_ids)
+    for epoch in range(first_epoch, n_epochs):
+        start = time.perf_counter()
+        pu, bu = _half_step(store.user_indptr, store.user_items, store.user_ratings, None, mask,
+                            qi, bi, global_mean, reg, n_jobs, block_size)
+        qi, bi = _half_step(store.item_indptr, store.item_users, store.item_ratings,
+                            store.item_order, mask, pu, bu, global_mean, reg, n_jobs, block_size)
+        model = FactorModel(pu, qi, bu, bi, global_mean, store.user_ids, store.item_ids)
+
+        entry = {'epoch': epoch, 'seconds': time.perf_counter() - start,
+                 'train_rmse': rmse(store, model, mask, True)}
+        if mask is not None:
+            entry['valid_rmse'] = rmse(store, model, mask, False)
+        history.append(entry)
+
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, {'pu': pu, 'qi': qi, 'bu': bu, 'bi': bi,
+                                               'epoch': epoch, 'params': json.dumps(params),
+                                               'data_hash': data_hash,
+                                               'history': json.dumps(history)})
+        if callback is not None and callback(epoch, model, entry):
+            break
+    model.metadata.update({'trainer': 'als', 'params': params, 'data_hash': data_hash})
+    return model, history
+
+
+def extend_model(model, raw_user_ids, raw_item_ids, init_std_dev=0.05, seed=0):
+    """Add rows for users and items unknown to a model.
+
+    New factors are drawn around zero and new biases start at zero, so a
+    new row initially predicts close to the baseline estimate.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Base model; it is not modified.
+    raw_user_ids, raw_item_ids : array-like
+        Raw IDs seen in new ratings; those already known are ignored.
+
+    Returns
+    -------
+    FactorModel
+        A copy of the model including the new rows.
+
+    """
+    rng = np.random.default_rng(seed)
+    raw_user_ids = np.asarray(list(dict.fromkeys(np.asarray(raw_user_ids).tolist())))
+    raw_item_ids = np.asarray(list(dict.fromkeys(np.asarray(raw_item_ids).tolist())))
+    new_users = raw_user_ids[model.user_rows(raw_user_ids) < 0]
+    new_items = raw_item_ids[model.item_rows(raw_item_ids) < 0]
+    k = model.n_factors
+    return FactorModel(
+        np.vstack([model.pu, rng.normal(0, init_std_dev, (len(new_users), k))]),
+        np.vstack([model.qi, rng.normal(0, init_std_dev, (len(new_items), k))]),
+        np.concatenate([model.bu, np.zeros(len(new_users))]),
+        np.concatenate([model.bi, np.zeros(len(new_items))]),
+        model.global_mean,
+        np.concatenate([model.raw_user_ids, np.asarray(new_users, dtype=model.raw_user_ids.dtype)]),
+        np.concatenate([model.raw_item_ids, np.asarray(new_items, dtype=model.raw_item_ids.dtype)]),
+        model.rating_scale, model.metadata)
+
+
+def sgd_epoch(model, user_rows, item_rows, ratings, lr=0.005, reg=0.02, batch_size=4096, rng=None):
+    """One pass of minibatch SGD over a set of ratings, updating `model` in place.
+
+    Only the factors and biases of the users and items present in the
+    ratings are modified. The gradients of a row repeated within a
+    minibatch are averaged (accumulated with `np.add.at`, then divided by
+    the row's count in the batch), so a popular item takes one step of
+    size `lr` per batch however often it occurs, and the batch size does
+    not change the effective learning rate of popular rows.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Model to update; its arrays must be writeable.
+    user_rows, item_rows : ndarray (int)
+        Factor rows of each rating.
+    ratings : ndarray (float)
+        Rating values.
+    lr : float
+        Learning rate.
+    reg : float
+        L2 regularisation.
+    batch_size : int
+        Ratings per vectorised update.
+    rng : numpy.random.Generator or None
+        Shuffles the ratings; `None` keeps their order.
+
+    """
+    order = rng.permutation(len(ratings)) if rng is not None else np.arange(len(ratings))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        u, i, r = user_rows[batch], item_rows[batch], ratings[batch]
+        p, q = model.pu[u], model.qi[i]
+        errors = r - (model.global_mean + model.bu[u] + model.bi[i] + np.einsum('ij,ij->i', p, q))
+        # Step size of each rating: lr shared between the repeats of its row
+        u_step = lr / _batch_counts(u)
+        i_step = lr / _batch_counts(i)
+        np.add.at(model.bu, u, u_step * (errors - reg * model.bu[u]))
+        np.add.at(model.bi, i, i_step * (errors - reg * model.bi[i]))
+        np.add.at(model.pu, u, u_step[:, None] * (errors[:, None] * q - reg * p))
+        np.add.at(model.qi, i, i_step[:, None] * (errors[:, None] * p - reg * q))
+
+
+def _batch_counts(rows):
+    """Number of occurrences within `rows` of each element of `rows`."""
+    _, inverse, counts = np.unique(rows, return_inverse=True, return_counts=True)
+    return counts[inverse].astype(np.float32)
+
+
+def train_sgd(store, n_factors=100, lr=0.005, reg=0.02, n_epochs=20, mask=None, seed=0,
+              init_std_dev=0.05, batch_size=1024, chunksize=1_000_000, callback=None):
+    """Train a biased matrix factorisation model with minibatch SGD.
+
+    The out-of-core counterpart of the surprise SVD in `train_colbased.py`
+    (`lr` and `reg` play the part of `lr_all` and `reg_all`). Each epoch
+    visits the store in chunks of consecutive ratings taken in random
+    order, and shuffles the ratings within each chunk, so only one chunk
+    is ever materialised.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Memory-mapped ratings.
+    n_factors : int
+        Number of latent factors.
+    lr, reg : float
+        Learning rate and L2 regularisation.
+    n_epochs : int
+        Number of passes over the training ratings.
+    mask : ndarray (bool) or None
+        Training mask over the user-major ratings (True for training
+        ratings); the other ratings give a validation RMSE every epoch.
+        `None` trains on every rating.
+    seed : int
+        Seed for the factor initialisation and the shuffling.
+    init_std_dev : float
+        Standard deviation of the initial factors.
+    batch_size : int
+        Ratings per vectorised update.
+    chunksize : int
+        Consecutive ratings read from the store at once.
+    callback : callable or None
+        Called as ``callback(epoch, model, history_entry)`` after every
+        epoch; returning True stops training early.
+
+    Returns
+    -------
+    tuple (FactorModel, list (dict))
+        The trained model (rows follow the store codes) and the per-epoch
+        training history.
+
+    """
+    rng = np.random.default_rng(seed)
+    params = {'n_factors': n_factors, 'lr': lr, 'reg': reg, 'seed': seed,
+              'init_std_dev': init_std_dev, 'n_ratings': store.n_ratings}
+    train_ratings = store.user_ratings if mask is None else np.asarray(store.user_ratings)[mask]
+    global_mean = float(np.mean(train_ratings, dtype=np.float64) / 2)
+    model = FactorModel(rng.normal(0, init_std_dev, (store.n_users, n_factors)),
+                        rng.normal(0, init_std_dev, (store.n_items, n_factors)),
+                        np.zeros(store.n_users), np.zeros(store.n_items), global_mean,
+                        store.user_ids, store.item_ids)
+
+    history = []
+    for epoch in range(n_epochs):
+        start = time.perf_counter()
+        for chunk_start in rng.permutation(np.arange(0, store.n_ratings, chunksize)):
+            chunk_stop = min(chunk_start + chunksize, store.n_ratings)
+            positions = np.arange(chunk_start, chunk_stop)
+            if mask is not None:
+                positions = positions[mask[chunk_start:chunk_stop]]
+            users = np.searchsorted(store.user_indptr, positions, side='right') - 1
+            sgd_epoch(model, users, np.asarray(store.user_items[positions]),
+                      store.decode(store.user_ratings[positions]), lr, reg, batch_size, rng)
+
+        entry = {'epoch': epoch, 'seconds': time.perf_counter() - start}
+        if mask is not None:
+            entry['valid_rmse'] = rmse(store, model, mask, False, chunksize)
+        history.append(entry)
+        if callback is not None and callback(epoch, model, entry):
+            break
+    params['n_epochs'] = len(history)
+    model.metadata.update({'trainer': 'sgd', 'params': params, 'data_hash': store.fingerprint()})
+    return model, history
+
+
+def incremental_update(model, raw_user_ids, raw_item_ids, ratings, n_epochs=5, lr=0.005,
+                       reg=0.02, seed=0):
+    """Refresh a model from new ratings without retraining it.
+
+    Unknown users and items are added, then a bounded number of SGD
+    passes over the new ratings refreshes only the affected factors and
+    biases. The base model is left untouched.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Frozen base model.
+    raw_user_ids, raw_item_ids : array-like
+        Raw IDs of each new rating.
+    ratings : array-like (float)
+        New rating values.
+    n_epochs : int
+        Number of SGD passes over the new ratings.
+    lr, reg : float
+        SGD learning rate and L2 regularisation (as in surprise's SVD).
+    seed : int
+        Seed for the initialisation of new rows and the shuffling.
+
+    Returns
+    -------
+    FactorModel
+        The updated model.
+
+    """
+    updated = extend_model(model, raw_user_ids, raw_item_ids, seed=seed)
+    user_rows = updated.user_rows(np.asarray(raw_user_ids).tolist())
+    item_rows = updated.item_rows(np.asarray(raw_item_ids).tolist())
+    ratings = np.asarray(ratings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    for _ in range(n_epochs):
+        sgd_epoch(updated, user_rows, item_rows, ratings, lr, reg, rng=rng)
+    updated.metadata['incremental_updates'] = updated.metadata.get('incremental_updates', 0) + 1
+    return updated
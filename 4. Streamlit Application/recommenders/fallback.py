@@ -0,0 +1,239 @@
+"""
+
+    Precomputed fallback recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: Offline build step and lookups for the cheap tiers used
+    when a recommender misses its deadline or fails (see
+    `recommenders.serving`). Everything is derived from the ratings:
+
+    - item neighbours: the `top_k` movies whose (mean-centred) ratings
+      correlate best with each movie's, for movies with at least
+      `min_ratings` ratings, stored as a CSR index over catalogue rows;
+    - popularity: movies ranked by their damped mean rating, which pulls
+      the mean of rarely rated movies towards the global mean, overall and
+      within each genre.
+
+    Serving either tier is a handful of array lookups.
+
+    Build the fallbacks from the root of the Streamlit application with:
+
+        python -m recommenders.fallback --top-k 50
+
+"""
+# Script dependencies
+import argparse
+import os
+import time
+import numpy as np
+import scipy.sparse as sps
+
+# Custom Libraries
+from recommenders.content_index import build_neighbour_index, merge_candidates, neighbour_row
+
+
+def damped_means(store, prior=50):
+    """Mean rating of every store item, damped towards the global mean.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Memory-mapped ratings.
+    prior : float
+        Weight of the global mean, in ratings.
+
+    Returns
+    -------
+    tuple (ndarray, ndarray)
+        float32 damped mean and int64 number of ratings of each item.
+
+    """
+    counts = np.diff(store.item_indptr)
+    totals = np.add.reduceat(store.decode(store.item_ratings).astype(np.float64),
+                             store.item_indptr[:-1][counts > 0])
+    sums = np.zeros(store.n_items)
+    sums[counts > 0] = totals
+    global_mean = sums.sum() / max(counts.sum(), 1)
+    return ((sums + prior * global_mean) / (counts + prior)).astype(np.float32), counts
+
+
+def rating_features(store):
+    """Item x user matrix of mean-centred ratings, from the item-major store layout."""
+    ratings = store.decode(store.item_ratings)
+    counts = np.diff(store.item_indptr)
+    means = np.zeros(store.n_items, dtype=np.float32)
+    rated = counts > 0
+    means[rated] = np.add.reduceat(ratings, store.item_indptr[:-1][rated]) / counts[rated]
+    ratings -= np.repeat(means, counts)
+    return sps.csr_matrix((ratings, np.asarray(store.item_users), np.asarray(store.item_indptr)),
+                          shape=(store.n_items, store.n_users))
+
+
+def build_fallbacks(store, movies, top_k=50, min_ratings=20, genre_top_n=100, prior=50,
+                    block_size=512):
+    """Compute the fallback lists over the rows of a movies table.
+
+    Parameters
+    ----------
+    store : RatingsStore
+        Memory-mapped ratings.
+    movies : DataFrame
+        Movies table (`movieId`, `genres`) whose rows are the catalogue rows.
+    top_k : int
+        Neighbours kept per movie.
+    min_ratings : int
+        Ratings a movie needs to get (and be) a neighbour.
+    genre_top_n : int
+        Movies kept per genre.
+    prior : float
+        Damping of the popularity score, in ratings.
+    block_size : int
+        Movies scored at once by the neighbour search.
+
+    Returns
+    -------
+    Fallbacks
+        The fallback lists.
+
+    """
+    movie_ids = movies['movieId'].values.astype(np.int64)
+    codes = store.item_codes(movie_ids)
+    known = codes >= 0
+
+    # Neighbours among the often rated movies, mapped from store codes to catalogue rows
+    code_rows = np.full(store.n_items, -1, dtype=np.int64)
+    code_rows[codes[known]] = np.flatnonzero(known)
+    eligible = np.flatnonzero((np.diff(store.item_indptr) >= min_ratings) & (code_rows >= 0))
+    rows, columns, data = [], [], []
+    if len(eligible) > 1:
+        index = build_neighbour_index(rating_features(store)[eligible], top_k, block_size)
+        rows = np.repeat(code_rows[eligible], np.diff(index.indptr))
+        columns = code_rows[eligible][index.indices]
+        data = index.data
+        # Only positively correlated movies are worth recommending
+        positive = data > 0
+        rows, columns, data = rows[positive], columns[positive], data[positive]
+    neighbours = sps.csr_matrix((np.asarray(data, dtype=np.float32), (rows, columns)),
+                                shape=(len(movie_ids), len(movie_ids)))
+
+    # Popularity of every catalogue row; unrated movies come last
+    means, counts = damped_means(store, prior)
+    scores = np.full(len(movie_ids), -np.inf, dtype=np.float32)
+    scores[known] = np.where(counts[codes[known]] > 0, means[codes[known]], -np.inf)
+    rated = np.flatnonzero(np.isfinite(scores))
+    popular = rated[np.argsort(-scores[rated], kind='stable')].astype(np.int32)
+
+    row_genres = movies['genres'].fillna('').str.split('|').tolist()
+    genres = sorted({genre for names in row_genres for genre in names
+                     if genre and genre != '(no genres listed)'})
+    genre_masks = np.zeros(len(movie_ids), dtype=np.int64)
+    for bit, genre in enumerate(genres):
+        genre_masks[[genre in names for names in row_genres]] |= 1 << bit
+    genre_lists = [popular[(genre_masks[popular] >> bit) & 1 == 1][:genre_top_n]
+                   for bit in range(len(genres))]
+    genre_indptr = np.concatenate([[0], np.cumsum([len(rows) for rows in genre_lists])])
+    genre_rows = np.concatenate(genre_lists + [np.empty(0, dtype=np.int32)]).astype(np.int32)
+    return Fallbacks(movie_ids, neighbours, popular, np.asarray(genres, dtype=str), genre_masks,
+                     genre_indptr, genre_rows)
+
+
+class Fallbacks:
+    """Item-neighbour and popularity lists over the catalogue rows.
+
+    Parameters
+    ----------
+    movie_ids : ndarray (int)
+        Movie ID of each catalogue row the lists were built for.
+    neighbours : scipy.sparse.csr_matrix
+        Rating-based neighbours (and correlations) of each row.
+    popular : ndarray (int)
+        Rated rows, most popular first.
+    genres : ndarray (str)
+        Genre names; genre `i` is bit `i` of `genre_masks`.
+    genre_masks : ndarray (int)
+        Genres of each row, as a bit mask.
+    genre_indptr, genre_rows : ndarray (int)
+        Most popular rows of each genre, in CSR layout.
+
+    """
+
+    _ARRAYS = ['movie_ids', 'popular', 'genres', 'genre_masks', 'genre_indptr', 'genre_rows']
+
+    def __init__(self, movie_ids, neighbours, popular, genres, genre_masks, genre_indptr,
+                 genre_rows):
+        self.movie_ids = movie_ids
+        self.neighbours = neighbours
+        self.popular = popular
+        self.genres = genres
+        self.genre_masks = genre_masks
+        self.genre_indptr = genre_indptr
+        self.genre_rows = genre_rows
+
+    @classmethod
+    def load(cls, path):
+        """Load fallbacks written by `save`."""
+        with np.load(path) as archive:
+            neighbours = sps.csr_matrix((archive['data'], archive['indices'], archive['indptr']),
+                                        shape=(len(archive['movie_ids']),) * 2)
+            return cls(archive['movie_ids'], neighbours,
+                       *(archive[name] for name in cls._ARRAYS[1:]))
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, data=self.neighbours.data, indices=self.neighbours.indices,
+                 indptr=self.neighbours.indptr,
+                 **{name: getattr(self, name) for name in self._ARRAYS})
+        # Written to a temporary file so readers never see partial fallbacks
+        os.replace(tmp_path, path)
+
+    def matches(self, catalog):
+        """Whether the lists were built over the rows of `catalog`."""
+        return np.array_equal(self.movie_ids, catalog.movie_ids)
+
+    def similar(self, rows, top_n, exclude=()):
+        """Merged rating neighbours of several rows (may return fewer than top_n)."""
+        rows = [row for row in rows if self.neighbours.indptr[row + 1] > self.neighbours.indptr[row]]
+        if not rows:
+            return np.empty(0, dtype=np.int32)
+        top, _ = merge_candidates([neighbour_row(self.neighbours, row) for row in rows],
+                                  top_n, exclude)
+        return top
+
+    def most_popular(self, rows, top_n, exclude=()):
+        """Most popular movies sharing a genre with `rows`, then overall."""
+        rows = np.asarray(rows, dtype=np.int64)
+        mask = int(np.bitwise_or.reduce(self.genre_masks[rows])) if len(rows) else 0
+        genre_lists = [self.genre_rows[self.genre_indptr[bit]:self.genre_indptr[bit + 1]]
+                       for bit in range(len(self.genres)) if (mask >> bit) & 1]
+        # Alternate between the genres, best first
+        width = max([len(genre_rows) for genre_rows in genre_lists], default=0)
+        padded = np.full((len(genre_lists), width), -1, dtype=np.int64)
+        for i, genre_rows in enumerate(genre_lists):
+            padded[i, :len(genre_rows)] = genre_rows
+        candidates = np.concatenate([padded.T.ravel(), self.popular[:top_n + len(exclude) + 1]])
+        candidates = candidates[(candidates >= 0) & ~np.isin(candidates, list(exclude))]
+        _, first = np.unique(candidates, return_index=True)
+        return candidates[np.sort(first)][:top_n]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the fallback recommendation lists.')
+    parser.add_argument('--top-k', type=int, default=50, help='Neighbours kept per movie.')
+    parser.add_argument('--min-ratings', type=int, default=20,
+                        help='Ratings a movie needs to take part in the neighbour lists.')
+    parser.add_argument('--genre-top-n', type=int, default=100)
+    parser.add_argument('--block-size', type=int, default=512)
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    args = parser.parse_args()
+
+    from utils.resources import get_movies, get_ratings_store, resource_path
+    args.output = args.output or resource_path('models', 'fallbacks.npz')
+    start = time.perf_counter()
+    fallbacks = build_fallbacks(get_ratings_store(), get_movies(), args.top_k, args.min_ratings,
+                                args.genre_top_n, block_size=args.block_size)
+    fallbacks.save(args.output)
+    print(f"Fallbacks for {len(fallbacks.movie_ids)} movies ({fallbacks.neighbours.nnz} neighbours, "
+          f"{len(fallbacks.genres)} genres) built in {time.perf_counter() - start:.1f}s "
+          f"and saved to: {args.output}")
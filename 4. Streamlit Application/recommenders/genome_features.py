@@ -0,0 +1,204 @@
+"""
+
+    Dense tag-genome embeddings for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Pivots the MovieLens tag genome (`genome_scores.csv`, the
+    relevance of ~1,100 tags to every movie) into a compact float32
+    movie x tag matrix, optionally reduced to fewer dimensions with a
+    truncated SVD. Rows are L2-normalised, so the cosine similarity
+    between movies is a plain (BLAS) matrix product. The matrix is saved
+    as a `.npy` file and memory-mapped by the app, with the movie ID of
+    each row in a sidecar file.
+
+    Only movies with genome scores get a row; movies without one are
+    handled by the text features.
+
+    Build the features from the root of the Streamlit application with:
+
+        python -m recommenders.genome_features --components 128
+
+"""
+# Script dependencies
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+# Custom Libraries
+from utils.data_loader import read_together, replace_together
+
+
+def build_genome_matrix(scores_path, chunksize=1_000_000):
+    """Pivot the genome scores into a dense movie x tag matrix.
+
+    Parameters
+    ----------
+    scores_path : str
+        Location of `genome_scores.csv` (`movieId`, `tagId`, `relevance`).
+    chunksize : int
+        Rows of the csv read at once.
+
+    Returns
+    -------
+    tuple (ndarray, ndarray)
+        float32 relevance matrix (one row per movie, one column per tag)
+        and the movie ID of each row, in ascending order.
+
+    """
+    movie_ids, tag_ids, relevance = [], [], []
+    dtypes = {'movieId': np.int32, 'tagId': np.int32, 'relevance': np.float32}
+    for chunk in pd.read_csv(scores_path, dtype=dtypes, chunksize=chunksize):
+        movie_ids.append(chunk['movieId'].values)
+        tag_ids.append(chunk['tagId'].values)
+        relevance.append(chunk['relevance'].values)
+    movie_ids, movie_rows = np.unique(np.concatenate(movie_ids), return_inverse=True)
+    tags, tag_columns = np.unique(np.concatenate(tag_ids), return_inverse=True)
+
+    matrix = np.zeros((len(movie_ids), len(tags)), dtype=np.float32)
+    matrix[movie_rows, tag_columns] = np.concatenate(relevance)
+    return matrix, movie_ids.astype(np.int64)
+
+
+def reduce_dimensions(matrix, n_components, seed=0):
+    """Project the genome matrix onto its top singular vectors.
+
+    Parameters
+    ----------
+    matrix : ndarray
+        Movie x tag relevance matrix.
+    n_components : int
+        Number of dimensions kept.
+    seed : int
+        Seed of the randomised SVD solver.
+
+    Returns
+    -------
+    ndarray
+        float32 movie x n_components matrix.
+
+    """
+    svd = TruncatedSVD(n_components=n_components, random_state=seed)
+    return svd.fit_transform(matrix).astype(np.float32)
+
+
+class GenomeFeatures:
+    """L2-normalised genome embeddings of the movies which have them.
+
+    Parameters
+    ----------
+    vectors : ndarray
+        float32 movie x dimension matrix with unit-length rows (may be a
+        read-only memory map).
+    movie_ids : array-like (int)
+        MovieLens movie ID of each row of `vectors`.
+
+    """
+
+    def __init__(self, vectors, movie_ids):
+        self.vectors = vectors
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        if len(self.movie_ids) != len(vectors):
+            raise ValueError("vectors and movie_ids must have the same length")
+        self.catalog_rows = None
+        self.feature_rows = None
+
+    @staticmethod
+    def ids_path(path):
+        return os.path.splitext(path)[0] + '_ids.npy'
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map features written by `save`."""
+        ids_path = cls.ids_path(path)
+        return read_together(lambda: cls(np.load(path, mmap_mode='r'), np.load(ids_path)),
+                             [ids_path, path])
+
+    def save(self, path):
+        ids_path = self.ids_path(path)
+        # Both files are written aside, then swapped in with the matrix
+        # last: its modification time versions the pair
+        np.save(ids_path + '.tmp.npy', self.movie_ids)
+        np.save(path + '.tmp.npy', np.ascontiguousarray(self.vectors, dtype=np.float32))
+        replace_together([(ids_path + '.tmp.npy', ids_path), (path + '.tmp.npy', path)])
+
+    @property
+    def n_dims(self):
+        return self.vectors.shape[1]
+
+    def align(self, catalog):
+        """Map feature rows to and from the rows of a `MovieCatalog`."""
+        self.catalog_rows = catalog.rows_of_ids(self.movie_ids.tolist())
+        self.feature_rows = np.full(len(catalog), -1, dtype=np.int64)
+        known = self.catalog_rows >= 0
+        self.feature_rows[self.catalog_rows[known]] = np.flatnonzero(known)
+        return self
+
+    def neighbours(self, rows, k=100, ann=None, nprobe=None):
+        """Top-k most similar movies of several catalogue rows.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the movies, each of which must have a
+            genome vector (see `feature_rows`).
+        k : int
+            Number of neighbours kept per movie.
+        ann : IVFIndex or None
+            ANN index over `vectors`; when given, only the movies of the
+            `nprobe` closest index lists are scored.
+        nprobe : int or None
+            Index lists scanned per movie (defaults to the index's own).
+
+        Returns
+        -------
+        list (tuple (ndarray, ndarray))
+            Catalogue rows and cosine similarity of the neighbours of
+            each movie, sorted by descending similarity.
+
+        """
+        feature_rows = self.feature_rows[np.asarray(rows, dtype=np.int64)]
+        if ann is not None:
+            queries = np.asarray(self.vectors[feature_rows])
+            candidates = []
+            for top, scores in ann.search(queries, k, nprobe, [[row] for row in feature_rows]):
+                # Movies absent from the catalogue are never recommended
+                keep = self.catalog_rows[top] >= 0
+                candidates.append((self.catalog_rows[top[keep]].astype(np.int32), scores[keep]))
+            return candidates
+        # One matrix product scores every requested movie against all others
+        similarity = np.asarray(self.vectors[feature_rows]) @ np.asarray(self.vectors).T
+        similarity[np.arange(len(feature_rows)), feature_rows] = -np.inf
+        # Movies absent from the catalogue are never recommended
+        similarity[:, self.catalog_rows < 0] = -np.inf
+        k = min(k, similarity.shape[1] - 1)
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        return [(self.catalog_rows[t].astype(np.int32), s) for t, s in zip(top, scores)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the genome content features.')
+    parser.add_argument('--scores', default=None,
+                        help='genome_scores.csv (defaults to the app resources folder).')
+    parser.add_argument('--components', type=int, default=None,
+                        help='Reduce the ~1,100 tag dimensions to this many.')
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    args = parser.parse_args()
+
+    from utils.resources import resource_path
+    args.scores = args.scores or resource_path('data', 'genome_scores.csv')
+    args.output = args.output or resource_path('models', 'genome_features.npy')
+    matrix, movie_ids = build_genome_matrix(args.scores)
+    if args.components:
+        matrix = reduce_dimensions(matrix, args.components)
+    features = GenomeFeatures(normalize(matrix).astype(np.float32), movie_ids)
+    features.save(args.output)
+    print(f"Genome features ({len(movie_ids)} movies x {features.n_dims} dims) saved to: {args.output}")
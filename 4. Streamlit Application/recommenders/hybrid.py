@@ -0,0 +1,246 @@
+"""
+
+    Two-stage hybrid recommender.
+
+    Author: Explore Data Science Academy.
+
+    Description: Instead of ranking the whole catalogue, a request first
+    gathers a few hundred candidates from cheap sources:
+
+        content     the content neighbours of each favourite (the text
+                    neighbour index or genome embeddings, as used by
+                    `content_model`);
+        factors     the best items for the app user folded into the SVD
+                    latent space (through the ANN index when built);
+        popular     the most popular movies of the favourites' genres
+                    (from the fallback lists), or overall.
+
+    The candidates are then re-ranked in one vectorised pass by a weighted
+    blend of three features, each scaled to [0, 1]:
+
+        content     best content similarity to a favourite (0 for
+                    candidates which are not content neighbours);
+        rating      rating predicted by the SVD model for the app user;
+        popularity  log of the movie's number of ratings.
+
+    The favourites themselves are never recommended. Weights are set with
+    the `HYBRID_WEIGHTS` environment variable, e.g.
+    ``HYBRID_WEIGHTS=content=0.5,rating=0.35,popularity=0.15``.
+
+"""
+# Script dependencies
+import os
+import numpy as np
+
+# Custom Libraries
+from recommenders.ann import ANN_NPROBE, factor_queries
+from recommenders.cache import cached_results, validate
+from recommenders.collaborative_based import favourite_ratings
+from recommenders.content_based import CONTENT_BACKEND, genome_candidates, text_candidates
+from utils.tracing import stage
+from utils.resources import (artifact_version, get_ann_index, get_catalog, get_factor_model,
+                             get_fallbacks, get_popularity)
+
+DEFAULT_WEIGHTS = {'content': 0.5, 'rating': 0.35, 'popularity': 0.15}
+
+# Candidates drawn from the item factors and from popularity per request
+# (content candidates are the stored neighbours of each favourite)
+FACTOR_CANDIDATES = 200
+POPULAR_CANDIDATES = 100
+
+
+def parse_weights(text):
+    """Blend weights from a ``name=value,...`` string, defaulting the others."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, value = part.partition('=')
+        if name.strip() not in weights:
+            raise ValueError(f"Unknown hybrid feature: {name.strip()}")
+        weights[name.strip()] = float(value)
+    return weights
+
+HYBRID_WEIGHTS = parse_weights(os.environ.get('HYBRID_WEIGHTS'))
+
+
+def factor_candidates(movie_id_lists, k=FACTOR_CANDIDATES):
+    """Fold the app users into the SVD latent space and take their top items.
+
+    Parameters
+    ----------
+    movie_id_lists : list (list (int))
+        Movie IDs of the favourite movies of each app user.
+    k : int
+        Candidates returned per user.
+
+    Returns
+    -------
+    tuple (ndarray, list (ndarray))
+        The latent vector of each user and the catalogue rows of their
+        top items (items absent from the catalogue are dropped).
+
+    """
+    catalog = get_catalog()
+    scorer = get_factor_model()
+    item_rows = [scorer.item_rows(movie_ids) for movie_ids in movie_id_lists]
+    user_vectors = np.stack([scorer.fold_in(rows, favourite_ratings(len(rows)))
+                             for rows in item_rows])
+    excludes = [rows[rows >= 0] for rows in item_rows]
+    ann = get_ann_index('factors')
+    if ann is not None:
+        top_rows = [rows for rows, _ in ann.search(factor_queries(user_vectors), k, ANN_NPROBE,
+                                                   excludes)]
+    else:
+        top_rows = scorer.rank_items_batch(user_vectors, k, excludes)
+    candidates = []
+    for rows in top_rows:
+        catalog_rows = catalog.rows_of_ids(scorer.raw_item_ids[rows].tolist())
+        candidates.append(catalog_rows[catalog_rows >= 0])
+    return user_vectors, candidates
+
+
+def popular_candidates(rows, k=POPULAR_CANDIDATES):
+    """Most popular movies of the favourites' genres, or overall without fallbacks."""
+    fallbacks = get_fallbacks()
+    if fallbacks is not None:
+        return fallbacks.most_popular(rows, k, exclude=rows)
+    popularity = get_popularity()
+    k = min(k, len(popularity) - 1)
+    return np.argpartition(-popularity, k)[:k]
+
+
+def rerank(candidates, content_scores, user_vector, exclude, top_n, weights):
+    """Blend the features of one request's candidates and keep the best.
+
+    Parameters
+    ----------
+    candidates : ndarray (int)
+        Unique catalogue rows.
+    content_scores : ndarray (float)
+        Best content similarity of each candidate.
+    user_vector : ndarray
+        Latent vector of the app user.
+    exclude : ndarray (int)
+        Rows which may not be recommended (the favourites).
+    top_n : int
+        Number of rows returned.
+    weights : dict
+        Weight of each feature ('content', 'rating', 'popularity').
+
+    Returns
+    -------
+    ndarray (int)
+        The top-n rows, best first.
+
+    """
+    catalog = get_catalog()
+    scorer = get_factor_model()
+    popularity = get_popularity()
+
+    # Predicted rating; movies unknown to the model get the global mean
+    item_rows = scorer.item_rows(catalog.movie_ids[candidates].tolist())
+    known = item_rows >= 0
+    ratings = np.full(len(candidates), scorer.global_mean, dtype=np.float32)
+    ratings[known] += scorer.bi[item_rows[known]] + scorer.qi[item_rows[known]] @ user_vector
+    low, high = scorer.rating_scale
+    ratings = np.clip((ratings - low) / (high - low), 0, 1)
+
+    counts = np.log1p(popularity[candidates])
+    popular = counts / max(np.log1p(popularity.max()), 1e-9)
+
+    scores = (weights['content'] * np.clip(content_scores, 0, 1) + weights['rating'] * ratings
+              + weights['popularity'] * popular)
+    scores[np.isin(candidates, exclude)] = -np.inf
+    top_n = min(top_n, int(np.isfinite(scores).sum()))
+    if top_n == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    # Ties (e.g. equal scores) keep the catalogue order
+    return candidates[top[np.lexsort((candidates[top], -scores[top]))]]
+
+
+def recommend(movie_lists, top_n, weights=None):
+    """Compute hybrid recommendations for several requests (uncached).
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
+    weights : dict or None
+        Blend weights; defaults to `HYBRID_WEIGHTS`.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
+
+    """
+    weights = weights or HYBRID_WEIGHTS
+    catalog = get_catalog()
+    fetch = genome_candidates if CONTENT_BACKEND == 'genome' else text_candidates
+
+    rows_per_list = [catalog.rows_of_titles(movie_list) for movie_list in movie_lists]
+    unique_rows = sorted({int(row) for rows in rows_per_list for row in rows})
+    with stage('hybrid.candidates.content', movies=len(unique_rows)):
+        content = dict(zip(unique_rows, fetch(unique_rows)))
+    with stage('hybrid.candidates.factors', requests=len(movie_lists)):
+        user_vectors, factor_rows = factor_candidates(
+            [catalog.movie_ids[rows].tolist() for rows in rows_per_list])
+
+    recommendations = []
+    for rows, user_vector, from_factors in zip(rows_per_list, user_vectors, factor_rows):
+        with stage('hybrid.candidates.popular', movies=len(rows)):
+            from_popular = popular_candidates(rows)
+        content_rows = np.concatenate([content[row][0] for row in rows]).astype(np.int64)
+        content_scores = np.concatenate([content[row][1] for row in rows]).astype(np.float32)
+        candidates = np.unique(np.concatenate([content_rows, from_factors,
+                                               np.asarray(from_popular, dtype=np.int64)]))
+        with stage('hybrid.rerank', candidates=len(candidates), top_n=top_n):
+            # Best similarity of each candidate to any favourite
+            best = np.zeros(len(candidates), dtype=np.float32)
+            np.maximum.at(best, np.searchsorted(candidates, content_rows), content_scores)
+            top = rerank(candidates, best, user_vector, rows, top_n, weights)
+        recommendations.append(catalog.titles_of_rows(top))
+    return recommendations
+
+
+def hybrid_model(movie_list, top_n=10):
+    """Performs hybrid filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    return hybrid_model_batch([movie_list], top_n)[0]
+
+
+def hybrid_model_batch(movie_lists, top_n=10):
+    """Serve several `hybrid_model` requests together (results are cached).
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
+
+    """
+    with stage('hybrid.request', requests=len(movie_lists), top_n=top_n):
+        validate(artifact_version())
+        return cached_results(f'hybrid_{CONTENT_BACKEND}', movie_lists, top_n, recommend)
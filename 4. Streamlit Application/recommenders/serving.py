@@ -0,0 +1,206 @@
+"""
+
+    Deadline-aware serving of recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: Runs a recommender under a latency budget and degrades
+    to cheaper, precomputed tiers when it overruns or fails:
+
+        primary     the requested recommender (`content_model`,
+                    `collab_model` or `hybrid_model`);
+        neighbours  the merged rating-based neighbours of the favourites;
+        popular     the most popular movies of the favourites' genres,
+                    then overall.
+
+    The primary recommender runs on a small pool of engine threads. A
+    request which finds every engine busy skips straight to the fallbacks
+    (admission control), so a load spike cannot queue unbounded work. A
+    Python thread cannot be interrupted: an engine call which misses its
+    deadline is abandoned and completes in the background, where its
+    result still fills the recommendation caches.
+
+    The fallbacks are built offline by `recommenders.fallback`. Without
+    them there is nothing to degrade to, so the primary recommender runs
+    unbounded as before: a slow request (e.g. the first one, which loads
+    the models) is answered late rather than failed. Should the fallbacks
+    fail too, a late or bypassed primary recommender is still awaited, and
+    only its own failure is raised.
+
+"""
+# Script dependencies
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Custom Libraries
+from recommenders.collaborative_based import collab_model
+from recommenders.content_based import content_model
+from recommenders.hybrid import hybrid_model
+from utils import tracing
+from utils.resources import get_catalog, get_fallbacks
+
+# Seconds a request may spend in the primary recommender
+REQUEST_BUDGET = float(os.environ.get('EDSA_REQUEST_BUDGET', 2.0))
+# Primary recommender calls running at once
+MAX_ENGINE_CALLS = int(os.environ.get('EDSA_MAX_ENGINE_CALLS', 4))
+
+ENGINES = {'content': content_model,
+           'collaborative': collab_model,
+           'hybrid': hybrid_model}
+
+TIERS = ['primary', 'neighbours', 'popular']
+
+# Outcome of a request: the titles, the tier which produced them, the
+# time taken and why the primary recommender was bypassed (if it was)
+Served = namedtuple('Served', ['titles', 'tier', 'seconds', 'reason'])
+
+_executor = ThreadPoolExecutor(max_workers=MAX_ENGINE_CALLS, thread_name_prefix='engine')
+_slots = threading.BoundedSemaphore(MAX_ENGINE_CALLS)
+# Requests answered by each tier, and primary calls bypassed for each reason
+SERVED = {tier: 0 for tier in TIERS}
+BYPASSED = {'deadline': 0, 'overloaded': 0, 'error': 0, 'empty': 0}
+_lock = threading.Lock()
+
+
+def _run(engine, movie_list, top_n, context):
+    if context is not None:
+        # Let the engine thread use the calling Streamlit session's caches
+        add_script_run_ctx(threading.current_thread(), context)
+    try:
+        return engine(movie_list, top_n)
+    finally:
+        _slots.release()
+
+
+def fallback(movie_list, top_n):
+    """Recommend from the precomputed tiers.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favourite movies chosen by the app user.
+    top_n : int
+        Number of recommendations.
+
+    Returns
+    -------
+    tuple (list (str), str) or None
+        Titles and the tier producing them ('neighbours' when the
+        neighbour lists yield anything, topped up with popular movies;
+        'popular' otherwise), or None without fallbacks or when they
+        fail (the failure is recorded, never raised).
+
+    """
+    try:
+        fallbacks = get_fallbacks()
+        if fallbacks is None:
+            return None
+        catalog = get_catalog()
+        with tracing.stage('fallback', movies=len(movie_list), top_n=top_n):
+            rows = catalog.rows_of_titles([title for title in movie_list if title in catalog])
+            similar = fallbacks.similar(rows, top_n, exclude=rows)
+            tier = 'neighbours' if len(similar) else 'popular'
+            if len(similar) < top_n:
+                popular = fallbacks.most_popular(rows, top_n - len(similar),
+                                                 exclude=list(rows) + list(similar))
+                similar = list(similar) + list(popular)
+            return catalog.titles_of_rows(similar), tier
+    except Exception as failure:
+        # The last resort must not replace the primary outcome with its own error
+        tracing.record_error('fallback', failure)
+        return None
+
+
+def _has_fallbacks():
+    try:
+        return get_fallbacks() is not None
+    except Exception as failure:
+        tracing.record_error('fallback', failure)
+        return False
+
+
+def recommend_within(algorithm, movie_list, top_n=10, budget=None):
+    """Recommend with a recommender, falling back when it is late or fails.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `ENGINES`.
+    movie_list : list (str)
+        Favourite movies chosen by the app user.
+    top_n : int
+        Number of recommendations.
+    budget : float or None
+        Seconds allowed for the primary recommender; defaults to
+        `REQUEST_BUDGET`.
+
+    Returns
+    -------
+    Served
+        The recommendations and the tier which produced them.
+
+    Raises
+    ------
+    Exception
+        The primary recommender's failure, when the fallbacks are not
+        built or fail too.
+
+    """
+    engine = ENGINES[algorithm]
+    budget = REQUEST_BUDGET if budget is None else budget
+    start = time.perf_counter()
+    if not _has_fallbacks():
+        # Nothing to degrade to: a late answer beats an error
+        titles = engine(movie_list, top_n)
+        return _served(titles, 'primary', start, None if titles else 'empty')
+
+    future = None
+    if _slots.acquire(blocking=False):
+        context = get_script_run_ctx(suppress_warning=True)
+        future = _executor.submit(_run, engine, movie_list, top_n, context)
+        try:
+            titles = future.result(timeout=budget)
+            reason = None if titles else 'empty'
+        except TimeoutError:
+            reason = 'deadline'
+        except Exception as failure:
+            tracing.record_error(f'{algorithm}.primary', failure)
+            reason = 'error'
+        if reason is None:
+            return _served(titles, 'primary', start, reason)
+    else:
+        reason = 'overloaded'
+
+    result = fallback(movie_list, top_n)
+    if result is not None:
+        if reason == 'deadline' and future.cancel():
+            # Never started, so `_run` will not release its slot
+            _slots.release()
+        return _served(*result, start, reason)
+    # The fallbacks failed: the primary recommender is the only answer left
+    if future is not None and not future.cancel():
+        # Running or done: wait for it (raising its own failure)
+        titles = future.result()
+    else:
+        if future is not None:
+            _slots.release()
+        titles = engine(movie_list, top_n)
+    return _served(titles, 'primary', start, reason)
+
+
+def _served(titles, tier, start, reason):
+    with _lock:
+        SERVED[tier] += 1
+        if reason is not None:
+            BYPASSED[reason] += 1
+    return Served(titles, tier, time.perf_counter() - start, reason)
+
+
+def serving_stats():
+    """Requests served by each tier and why the primary recommender was bypassed."""
+    with _lock:
+        return {'served': dict(SERVED), 'bypassed': dict(BYPASSED)}
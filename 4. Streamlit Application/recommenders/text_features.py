@@ -0,0 +1,214 @@
+"""
+
+    Hashed text features for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Offline feature-build stage turning the cast, director,
+    plot keywords and genres of every movie into a sparse float32
+    movie x feature matrix. Tokens (unigrams and bigrams) are hashed into
+    a fixed number of columns, so no vocabulary has to be fitted over the
+    whole catalogue: chunks of movies are tokenised independently across
+    a process pool, and new movies can be appended to an existing matrix
+    without rebuilding it. Each field is weighted separately, so e.g. a
+    shared director can count for more than a shared genre.
+
+    Build the features from the root of the Streamlit application with:
+
+        python -m recommenders.text_features
+
+    and append movies added to the catalogue since the last build with:
+
+        python -m recommenders.text_features --append
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sps
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Custom Libraries
+from utils.data_loader import read_together, replace_together
+
+# Weight of each metadata field in the feature matrix
+FIELD_WEIGHTS = {'title_cast': 1.0, 'director': 1.0, 'plot_keywords': 1.0, 'genres': 1.0}
+
+# Width of the hashed feature space
+N_FEATURES = 2 ** 20
+
+
+def featurise_chunk(fields, weights=None, n_features=N_FEATURES):
+    """Hash the metadata of a chunk of movies.
+
+    Parameters
+    ----------
+    fields : dict (str, list (str))
+        Pipe-separated text of every field, one entry per movie.
+    weights : dict (str, float) or None
+        Weight of each field; defaults to `FIELD_WEIGHTS`.
+    n_features : int
+        Width of the hashed feature space.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 movie x n_features matrix of weighted token counts.
+
+    """
+    weights = weights or FIELD_WEIGHTS
+    vectorizer = HashingVectorizer(n_features=n_features, ngram_range=(1, 2),
+                                   stop_words='english', alternate_sign=False,
+                                   norm=None, dtype=np.float32)
+    matrix = None
+    for field, weight in weights.items():
+        if not weight:
+            continue
+        texts = [text.replace('|', ' ') for text in fields[field]]
+        counts = vectorizer.transform(texts) * np.float32(weight)
+        matrix = counts if matrix is None else matrix + counts
+    return sps.csr_matrix(matrix, dtype=np.float32)
+
+
+def build_text_features(frame, weights=None, n_features=N_FEATURES, chunksize=5000, n_jobs=None):
+    """Hash the metadata of every movie of a frame.
+
+    Parameters
+    ----------
+    frame : Pandas Dataframe
+        Movies with a text column per field of `weights` (e.g. the output
+        of `utils.resources.get_content_frame`).
+    weights : dict (str, float) or None
+        Weight of each field; defaults to `FIELD_WEIGHTS`.
+    n_features : int
+        Width of the hashed feature space.
+    chunksize : int
+        Movies tokenised per task.
+    n_jobs : int or None
+        Worker processes; defaults to the number of CPU cores. `1` runs
+        in the calling process.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 movie x n_features matrix, one row per row of `frame`.
+
+    """
+    weights = weights or FIELD_WEIGHTS
+    n_jobs = n_jobs or os.cpu_count()
+    chunks = [{field: frame[field].iloc[start:start + chunksize].fillna('').tolist()
+               for field in weights}
+              for start in range(0, len(frame), chunksize)]
+    if not chunks:
+        return sps.csr_matrix((0, n_features), dtype=np.float32)
+    if n_jobs == 1 or len(chunks) == 1:
+        parts = [featurise_chunk(chunk, weights, n_features) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            parts = list(executor.map(featurise_chunk, chunks,
+                                      [weights] * len(chunks), [n_features] * len(chunks)))
+    return sps.vstack(parts, format='csr', dtype=np.float32)
+
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + '_meta.json'
+
+
+def save_text_features(path, matrix, movie_ids, weights=None, n_features=N_FEATURES):
+    """Persist a feature matrix with the movie ID of each row and its settings."""
+    tmp_meta_path = meta_path(path) + '.tmp'
+    with open(tmp_meta_path, 'w') as f:
+        json.dump({'n_features': n_features, 'weights': weights or FIELD_WEIGHTS,
+                   'movie_ids': np.asarray(movie_ids, dtype=np.int64).tolist()}, f)
+    tmp_path = path + '.tmp.npz'
+    sps.save_npz(tmp_path, sps.csr_matrix(matrix, dtype=np.float32))
+    # Both files are swapped in with the matrix last: its modification
+    # time versions the pair
+    replace_together([(tmp_meta_path, meta_path(path)), (tmp_path, path)])
+
+
+def load_text_features(path):
+    """Load features written by `save_text_features`.
+
+    Returns
+    -------
+    tuple (scipy.sparse.csr_matrix, ndarray, dict)
+        The feature matrix, the movie ID of each row and the build
+        settings (`n_features`, `weights`).
+
+    """
+    def read():
+        with open(meta_path(path)) as f:
+            meta = json.load(f)
+        movie_ids = np.asarray(meta.pop('movie_ids'), dtype=np.int64)
+        matrix = sps.load_npz(path).tocsr()
+        if matrix.shape[0] != len(movie_ids):
+            raise ValueError("Text features and their movie IDs differ in length")
+        return matrix, movie_ids, meta
+    return read_together(read, [meta_path(path), path])
+
+
+def append_text_features(path, frame, n_jobs=None):
+    """Add the movies of a frame missing from saved features.
+
+    The saved weights and width are reused, so existing rows stay valid
+    and only the new movies are tokenised.
+
+    Returns
+    -------
+    int
+        Number of movies appended.
+
+    """
+    matrix, movie_ids, meta = load_text_features(path)
+    new = frame[~frame['movieId'].isin(movie_ids)]
+    if len(new):
+        added = build_text_features(new, meta['weights'], meta['n_features'], n_jobs=n_jobs)
+        save_text_features(path, sps.vstack([matrix, added], format='csr'),
+                           np.concatenate([movie_ids, new['movieId'].values]),
+                           meta['weights'], meta['n_features'])
+    return len(new)
+
+
+def align_rows(matrix, movie_ids, catalog):
+    """Reorder feature rows to follow the rows of a `MovieCatalog`.
+
+    Catalogue movies without features get an empty row.
+
+    """
+    if np.array_equal(movie_ids, catalog.movie_ids):
+        return matrix
+    rows = catalog.rows_of_ids(movie_ids.tolist())
+    known = rows >= 0
+    selector = sps.csr_matrix((np.ones(known.sum(), dtype=np.float32),
+                               (rows[known], np.flatnonzero(known))),
+                              shape=(len(catalog), matrix.shape[0]))
+    return (selector @ matrix).tocsr()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the hashed text content features.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only add movies missing from the existing features.')
+    parser.add_argument('--weights', default=None,
+                        help='Field weights as JSON, e.g. \'{"director": 2.0, "genres": 0.5}\'.')
+    parser.add_argument('--n-features', type=int, default=N_FEATURES)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    args = parser.parse_args()
+
+    from utils.resources import get_content_frame, resource_path
+    args.output = args.output or resource_path('models', 'text_features.npz')
+    frame = get_content_frame()
+    if args.append:
+        added = append_text_features(args.output, frame, args.jobs)
+        print(f"{added} movies appended to: {args.output}")
+    else:
+        weights = dict(FIELD_WEIGHTS, **json.loads(args.weights)) if args.weights else FIELD_WEIGHTS
+        matrix = build_text_features(frame, weights, args.n_features, n_jobs=args.jobs)
+        save_text_features(args.output, matrix, frame['movieId'].values, weights, args.n_features)
+        print(f"Text features for {matrix.shape[0]} movies saved to: {args.output}")
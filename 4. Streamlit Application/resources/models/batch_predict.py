@@ -0,0 +1,148 @@
+"""
+
+    Batch offline rating predictions.
+
+    Author: Explore Data Science Academy.
+
+    Description: Scores a (possibly very large) csv of (userId, movieId)
+    pairs, such as the Kaggle `test.csv`, with a trained model. The input
+    is streamed in chunks; each chunk's ids are resolved to factor rows
+    in bulk and scored with vectorised dot products, estimates are clipped
+    to the rating scale, and ids unknown to the model fall back to the
+    remaining bias terms. Chunks are scored across a process pool (workers
+    memory-map the model artifact) and written out in input order as they
+    complete, so memory stays bounded whatever the input size.
+
+    Example (from this folder):
+
+        python batch_predict.py test.csv --model svd_factors --output submission.csv
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Make the application packages importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from recommenders.factor_model import load_factor_model
+
+# Model of each worker process, loaded once by `_init_worker`
+_model = None
+
+def _init_worker(model_path):
+    global _model
+    _model = load_factor_model(model_path)
+
+
+def predict_chunk(model, user_ids, movie_ids):
+    """Estimate the rating of each (user, movie) pair of a chunk.
+
+    Parameters
+    ----------
+    model : FactorModel
+        Trained model.
+    user_ids, movie_ids : ndarray
+        Raw ids of each pair.
+
+    Returns
+    -------
+    ndarray
+        float32 estimates, clipped to the model's rating scale.
+
+    """
+    # Resolve every distinct id once, then expand to the pairs
+    users, user_inverse = np.unique(user_ids, return_inverse=True)
+    movies, movie_inverse = np.unique(movie_ids, return_inverse=True)
+    return model.predict_pairs(model.user_rows(users)[user_inverse],
+                               model.item_rows(movies)[movie_inverse])
+
+
+def _score(chunk):
+    return chunk.assign(rating=predict_chunk(_model, chunk['userId'].values, chunk['movieId'].values))
+
+
+def _format(scored, output_format):
+    if output_format == 'submission':
+        ids = scored['userId'].astype(str) + '_' + scored['movieId'].astype(str)
+        return pd.DataFrame({'Id': ids, 'rating': scored['rating']})
+    return scored[['userId', 'movieId', 'rating']]
+
+
+def batch_predict(input_path, model_path, output_path, chunksize=1_000_000, n_jobs=1,
+                  output_format='submission'):
+    """Score every pair of a csv file and write the predictions.
+
+    Parameters
+    ----------
+    input_path : str
+        csv file with `userId` and `movieId` columns.
+    model_path : str
+        Model artifact, exported factors or pickled surprise model.
+    output_path : str
+        Destination csv; written to a temporary file and moved into
+        place once complete.
+    chunksize : int
+        Pairs read and scored at once.
+    n_jobs : int
+        Worker processes; `1` scores in the calling process.
+    output_format : str
+        'submission' (`Id`, `rating` with ids as `userId_movieId`) or
+        'pairs' (`userId`, `movieId`, `rating`).
+
+    Returns
+    -------
+    int
+        Number of pairs scored.
+
+    """
+    chunks = pd.read_csv(input_path, usecols=['userId', 'movieId'], chunksize=chunksize)
+    tmp_path = output_path + '.tmp'
+    n_pairs = 0
+    with open(tmp_path, 'w', newline='') as out:
+        def write(scored):
+            nonlocal n_pairs
+            _format(scored, output_format).to_csv(out, index=False, header=n_pairs == 0,
+                                                  float_format='%.4f')
+            n_pairs += len(scored)
+
+        if n_jobs == 1:
+            _init_worker(model_path)
+            for chunk in chunks:
+                write(_score(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(model_path,)) as executor:
+                # Bound the chunks in flight so memory does not grow with the input
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_score, chunk))
+                    if len(pending) >= 2 * n_jobs:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    os.replace(tmp_path, output_path)
+    return n_pairs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Predict ratings for (userId, movieId) pairs.')
+    parser.add_argument('input', help='csv file with userId and movieId columns.')
+    parser.add_argument('--model', default='svd_factors',
+                        help='Model artifact, exported factors or pickled surprise model.')
+    parser.add_argument('--output', default='submission.csv')
+    parser.add_argument('--format', choices=['submission', 'pairs'], default='submission')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_pairs = batch_predict(args.input, args.model, args.output, args.chunksize, args.jobs, args.format)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {n_pairs} pairs in {elapsed:.1f}s ({n_pairs / max(elapsed, 1e-9):,.0f} pairs/s). "
+          f"Predictions saved to: {args.output}")
@@ -5,19 +5,26 @@
     Author: Explore Data Science Academy.
 
     Description: Simple script to train and save an instance of the
-    SVDpp algorithm on MovieLens data.
+    SVDpp algorithm on MovieLens data. Its hyperparameters can be
+    searched in parallel with `tune_svd.py`.
 
 """
 # Script dependencies
+import os
+import sys
 import numpy as np
 import pandas as pd
 from surprise import SVD
 import surprise
 import pickle
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+# Make the application packages importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from utils.ratings_store import open_ratings_store
+
+# Importing datasets from the memory-mapped ratings store
+ratings_store = open_ratings_store('ratings_store', 'ratings.csv')
+ratings = ratings_store.to_frame()
 
 def svd_pp(save_path):
     # Check the range of the rating
@@ -0,0 +1,216 @@
+"""
+
+    Parallel hyperparameter search for the SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Tunes the hyperparameters hardcoded in `train_colbased.py`
+    (number of factors, learning rate, regularisation and number of
+    epochs). Trials sample a grid (or, with `--random`, log-uniform ranges)
+    of factors, learning rates and regularisations, and are trained with
+    SGD (`train_sgd`) across a process pool. The number of epochs is not
+    searched: every trial records its validation RMSE after each epoch and
+    keeps the epoch where it was lowest.
+
+    The ratings are split once into folds, saved to a temporary file of
+    the run; workers memory-map the store and the folds themselves, so every
+    process reads the same copy through the OS page cache. Workers share
+    the best validation RMSE reached at each epoch, and a trial stops early
+    when, past `--min-epochs`, it trails that best by more than
+    `--tolerance`, or when it has not improved for `--patience` epochs.
+
+    The results table is printed and written as csv, then the best
+    parameters are retrained on every rating and published in the serving
+    format. Example (from this folder):
+
+        python tune_svd.py --factors 50 100 200 --lr 0.002 0.005 0.01 --reg 0.02 0.05 0.1
+
+"""
+# Script dependencies
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+# Make the application packages importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from utils.ratings_store import RatingsStore, open_ratings_store
+from recommenders.factor_training import train_sgd
+
+PARAMS = ['n_factors', 'lr', 'reg']
+
+
+def grid_trials(space):
+    """Every combination of the values of a search space."""
+    return [dict(zip(PARAMS, values)) for values in itertools.product(*(space[p] for p in PARAMS))]
+
+
+def random_trials(space, n_trials, seed=0):
+    """Trials drawn log-uniformly between the lowest and highest value of each parameter."""
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(n_trials):
+        trial = {name: float(np.exp(rng.uniform(np.log(min(space[name])), np.log(max(space[name])))))
+                 for name in PARAMS}
+        trial['n_factors'] = int(round(trial['n_factors']))
+        trials.append(trial)
+    return trials
+
+
+def assign_folds(n_ratings, n_folds, seed=0):
+    """Fold number of every rating, drawn uniformly."""
+    return np.random.default_rng(seed).integers(0, n_folds, n_ratings, dtype=np.int8)
+
+
+# State of each worker process, set up once by `_init_worker`
+_worker = {}
+
+def _init_worker(store_path, folds_path, best, n_epochs, min_epochs, patience, tolerance,
+                 batch_size):
+    _worker.update(store=RatingsStore(store_path), folds=np.load(folds_path, mmap_mode='r'),
+                   best=best, n_epochs=n_epochs, min_epochs=min_epochs, patience=patience,
+                   tolerance=tolerance, batch_size=batch_size)
+
+
+def _run_trial(trial_id, fold, params, seed):
+    """Train one trial on one fold, returning its validation RMSE curve."""
+    best, n_epochs = _worker['best'], _worker['n_epochs']
+    curve, stopped = [], []
+
+    def prune(epoch, model, entry):
+        # A diverging trial (e.g. too high a learning rate) scores infinity
+        score = entry['valid_rmse'] if np.isfinite(entry['valid_rmse']) else np.inf
+        curve.append(score)
+        if score == np.inf:
+            stopped.append('diverged')
+            return True
+        with best.get_lock():
+            leader = best[fold * n_epochs + epoch]
+            best[fold * n_epochs + epoch] = min(leader, score)
+        if epoch + 1 < _worker['min_epochs']:
+            return False
+        if score > leader * (1 + _worker['tolerance']):
+            stopped.append('pruned')
+        elif epoch - int(np.argmin(curve)) >= _worker['patience']:
+            stopped.append('converged')
+        return bool(stopped)
+
+    start = time.perf_counter()
+    with np.errstate(over='ignore', invalid='ignore'):
+        train_sgd(_worker['store'], n_epochs=n_epochs, mask=np.asarray(_worker['folds']) != fold,
+                  seed=seed, batch_size=_worker['batch_size'], callback=prune, **params)
+    return {'trial': trial_id, 'fold': fold, 'curve': curve,
+            'status': stopped[0] if stopped else 'complete',
+            'seconds': time.perf_counter() - start}
+
+
+def summarise(trials, runs, batch_size):
+    """One row per trial: its parameters, best epoch count and validation RMSE."""
+    rows = []
+    for trial_id, params in enumerate(trials):
+        trial_runs = [run for run in runs if run['trial'] == trial_id]
+        # Average the folds over the epochs they all reached
+        length = min(len(run['curve']) for run in trial_runs)
+        curve = np.mean([run['curve'][:length] for run in trial_runs], axis=0)
+        statuses = {run['status'] for run in trial_runs}
+        rows.append({'trial': trial_id, **params, 'batch_size': batch_size,
+                     'n_epochs': int(np.argmin(curve)) + 1,
+                     'rmse': float(curve.min()), 'epochs_run': length,
+                     'status': next(status for status in ['diverged', 'pruned', 'converged',
+                                                          'complete'] if status in statuses),
+                     'seconds': sum(run['seconds'] for run in trial_runs)})
+    return pd.DataFrame(rows).sort_values(['rmse', 'trial']).reset_index(drop=True)
+
+
+def tune(save_path, args):
+    start = time.perf_counter()
+    ratings_store = open_ratings_store(args.store, args.ratings)
+    space = {'n_factors': args.factors, 'lr': args.lr, 'reg': args.reg}
+    trials = random_trials(space, args.random, args.seed) if args.random else grid_trials(space)
+    print(f"{len(trials)} trials x {args.cv} fold(s) on {ratings_store.n_ratings} ratings")
+
+    # Folds of this run only, removed even if the search fails
+    handle, folds_path = tempfile.mkstemp(prefix='tuning_folds_', suffix='.npy', dir=args.tmp_dir)
+    os.close(handle)
+    try:
+        np.save(folds_path, assign_folds(ratings_store.n_ratings, args.folds, args.seed))
+        # Best validation RMSE reached so far at each (fold, epoch)
+        best = multiprocessing.Array('d', [np.inf] * (args.folds * args.epochs))
+        runs = []
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                 initargs=(ratings_store.path, folds_path, best, args.epochs,
+                                           args.min_epochs, args.patience, args.tolerance,
+                                           args.batch_size)) as executor:
+            futures = [executor.submit(_run_trial, trial_id, fold, params, args.seed)
+                       for trial_id, params in enumerate(trials) for fold in range(args.cv)]
+            for future in as_completed(futures):
+                run = future.result()
+                runs.append(run)
+                print(f"Trial {run['trial']} fold {run['fold']} ({run['status']} after "
+                      f"{len(run['curve'])} epochs, {run['seconds']:.1f}s): "
+                      f"best RMSE {min(run['curve']):.4f}")
+    finally:
+        os.remove(folds_path)
+
+    results = summarise(trials, runs, args.batch_size)
+    results.to_csv(args.results, index=False)
+    print(results.to_string(index=False))
+    print(f"Search completed in {time.perf_counter() - start:.1f}s. Results saved to: {args.results}")
+    if args.no_refit:
+        return
+
+    best_trial = results.iloc[0]
+    params = {'n_factors': int(best_trial['n_factors']), 'lr': float(best_trial['lr']),
+              'reg': float(best_trial['reg'])}
+    print(f"Retraining on every rating with {params} for {best_trial['n_epochs']} epochs")
+    model, _ = train_sgd(ratings_store, n_epochs=int(best_trial['n_epochs']), seed=args.seed,
+                         batch_size=args.batch_size, **params)
+    model.metadata['tuning'] = {'valid_rmse': float(best_trial['rmse']), 'trials': len(trials),
+                                'folds': args.folds, 'cv': args.cv, 'batch_size': args.batch_size}
+    model.publish(save_path)
+    print(f"Tuning completed in {time.perf_counter() - start:.1f}s. Saving model to: {save_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune the SVD hyperparameters in parallel.')
+    parser.add_argument('--ratings', default='ratings.csv')
+    parser.add_argument('--store', default='ratings_store')
+    parser.add_argument('--factors', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--lr', type=float, nargs='+', default=[0.002, 0.005, 0.01])
+    parser.add_argument('--reg', type=float, nargs='+', default=[0.02, 0.05, 0.1])
+    parser.add_argument('--random', type=int, default=0,
+                        help='Draw this many random trials within the ranges of the values '
+                             'above instead of searching their grid.')
+    parser.add_argument('--epochs', type=int, default=40, help='Most epochs of a trial.')
+    parser.add_argument('--folds', type=int, default=5,
+                        help='Folds the ratings are split into; one is held out per run.')
+    parser.add_argument('--cv', type=int, default=1,
+                        help='Folds each trial is validated on (averaged).')
+    parser.add_argument('--min-epochs', type=int, default=5,
+                        help='Epochs a trial runs before it may be stopped.')
+    parser.add_argument('--patience', type=int, default=3,
+                        help='Epochs without improvement before a trial stops.')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Relative RMSE gap to the best trial at which a trial is pruned.')
+    parser.add_argument('--batch-size', type=int, default=1024,
+                        help='Ratings per SGD update (recorded in the results).')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--tmp-dir', default=None,
+                        help='Folder of the shared fold file (defaults to the system one).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default='tune_results.csv')
+    parser.add_argument('--no-refit', action='store_true',
+                        help='Only search, without retraining the best parameters.')
+    parser.add_argument('--output', default='svd_factors',
+                        help='Artifact directory (or a .npz archive) for the best model.')
+    args = parser.parse_args()
+    if args.cv > args.folds:
+        parser.error('--cv cannot exceed --folds')
+
+    tune(args.output, args)
@@ -0,0 +1,55 @@
+"""
+
+    Incremental model update from rating deltas.
+
+    Author: Explore Data Science Academy.
+
+    Description: Refreshes a trained model with a file of new ratings
+    (which may include new users and movies) without a full retrain. The
+    base model is only read; the updated factors are published atomically
+    to the served model path, which the running app picks up on its next
+    request.
+
+    Example (from this folder):
+
+        python update_model.py new_ratings.csv --base svd_factors --output svd_factors
+
+"""
+# Script dependencies
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+
+# Make the application packages importable when run from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from recommenders.factor_model import load_factor_model
+from recommenders.factor_training import incremental_update
+
+
+def update(deltas_path, base_path, save_path, n_epochs, lr, reg):
+    start = time.perf_counter()
+    deltas = pd.read_csv(deltas_path, usecols=['userId', 'movieId', 'rating'])
+    base = load_factor_model(base_path)
+    model = incremental_update(base, deltas['userId'].values, deltas['movieId'].values,
+                               deltas['rating'].values, n_epochs=n_epochs, lr=lr, reg=reg)
+    model.publish(save_path)
+    print(f"Applied {len(deltas)} ratings ({len(model.raw_user_ids) - len(base.raw_user_ids)} new users, "
+          f"{len(model.raw_item_ids) - len(base.raw_item_ids)} new movies) in "
+          f"{time.perf_counter() - start:.1f}s. Published model to: {save_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update a trained model with new ratings.')
+    parser.add_argument('deltas', help='csv file with userId, movieId and rating columns.')
+    parser.add_argument('--base', default='svd_factors',
+                        help='Frozen base model (exported factors or a pickled surprise SVD); '
+                             'defaults to the published model, so updates chain.')
+    parser.add_argument('--output', default='svd_factors')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--lr', type=float, default=0.005)
+    parser.add_argument('--reg', type=float, default=0.02)
+    args = parser.parse_args()
+
+    update(args.deltas, args.base, args.output, args.epochs, args.lr, args.reg)
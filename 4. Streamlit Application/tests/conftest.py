@@ -0,0 +1,72 @@
+"""
+
+    Shared fixtures of the test suite.
+
+    Author: Explore Data Science Academy.
+
+    Description: Small synthetic models and catalogues, so that the tests
+    run without the MovieLens resources. Run the suite from the root of
+    the Streamlit application with:
+
+        python -m pytest -q
+
+"""
+# Script dependencies
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# Make the application packages importable from any working directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Custom Libraries
+from recommenders.factor_model import FactorModel
+from utils.data_loader import MovieCatalog
+
+
+def make_factor_model(n_users=30, n_items=40, n_factors=4, seed=0, metadata=None):
+    """A random `FactorModel`; movie IDs are 1..n_items, user IDs 1..n_users."""
+    rng = np.random.default_rng(seed)
+    return FactorModel(rng.normal(0, 0.1, (n_users, n_factors)),
+                       rng.normal(0, 0.1, (n_items, n_factors)),
+                       rng.normal(0, 0.1, n_users), rng.normal(0, 0.1, n_items), 3.5,
+                       np.arange(1, n_users + 1), np.arange(1, n_items + 1),
+                       metadata=metadata)
+
+
+@pytest.fixture
+def factor_model():
+    return make_factor_model()
+
+
+@pytest.fixture(name='make_factor_model')
+def make_factor_model_fixture():
+    return make_factor_model
+
+
+@pytest.fixture
+def catalog():
+    """Catalogue of the movies of `factor_model` (IDs 1..40)."""
+    movie_ids = np.arange(1, 41)
+    return MovieCatalog(movie_ids, [f'Movie {movie_id} (2000)' for movie_id in movie_ids])
+
+
+def write_movies(path, movie_ids, titles):
+    """Write a MovieLens `movies.csv` with the given rows."""
+    pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': 'Drama'}).to_csv(path,
+                                                                                  index=False)
+
+
+@pytest.fixture(name='write_movies')
+def write_movies_fixture():
+    return write_movies
+
+
+@pytest.fixture
+def movies_csv(tmp_path, catalog):
+    """The movies table of `catalog`, written as a MovieLens `movies.csv`."""
+    path = str(tmp_path / 'movies.csv')
+    write_movies(path, catalog.movie_ids, catalog.titles)
+    return path
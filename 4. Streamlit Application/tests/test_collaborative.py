@@ -0,0 +1,33 @@
+"""
+
+    User matching of the neighbourhood collaborative engine.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import numpy as np
+
+# Custom Libraries
+from recommenders import collaborative_based
+from recommenders.factor_model import FactorModel
+
+
+class Store:
+    """Ratings store stand-in with the users who rated something."""
+
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+
+
+def test_candidates_follow_the_model_they_are_scored_with(monkeypatch, make_factor_model):
+    store = Store(np.arange(5, 26))
+    monkeypatch.setattr(collaborative_based, 'get_ratings_store', lambda: store)
+    old = make_factor_model(n_users=30)
+    # A smaller model, as a host may publish after the files changed
+    new = FactorModel(old.pu[20:], old.qi, old.bu[20:], old.bi, old.global_mean,
+                      old.raw_user_ids[20:], old.raw_item_ids)
+    for model in [old, new, old]:
+        users, rows = collaborative_based.get_candidates(model)
+        np.testing.assert_array_equal(model.raw_user_ids[rows], users)
+        assert set(users) == set(model.raw_user_ids) & set(store.user_ids)
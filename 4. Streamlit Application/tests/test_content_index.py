@@ -0,0 +1,73 @@
+"""
+
+    Precomputed top-K content neighbour index.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import numpy as np
+import scipy.sparse as sps
+
+# Custom Libraries
+from recommenders.content_index import (build_neighbour_index, load_neighbour_index,
+                                        merge_candidates, neighbour_row, save_neighbour_index)
+from utils.resources import _load_neighbour_index, resource_stamp
+
+
+def dense_top_k(features, top_k):
+    """Top-k cosine neighbours of every row from the full similarity matrix."""
+    unit = features / np.linalg.norm(features, axis=1, keepdims=True)
+    similarity = unit @ unit.T
+    np.fill_diagonal(similarity, -np.inf)
+    return np.sort(similarity, axis=1)[:, ::-1][:, :top_k]
+
+
+def test_neighbour_index_matches_dense_similarity():
+    features = np.random.default_rng(0).random((70, 12)).astype(np.float32)
+    # Blocks smaller than the catalogue, sparse and dense input
+    for matrix in [features, sps.csr_matrix(features)]:
+        index = build_neighbour_index(matrix, top_k=5, block_size=16)
+        assert index.shape == (70, 70)
+        assert (np.diff(index.indptr) == 5).all()
+        np.testing.assert_allclose(index.data.reshape(70, 5), dense_top_k(features, 5),
+                                   rtol=1e-5)
+        for row in range(70):
+            rows, scores = neighbour_row(index, row)
+            assert row not in rows
+            assert (np.diff(scores) <= 0).all()
+
+
+def test_neighbour_index_round_trip(tmp_path):
+    index = build_neighbour_index(np.random.default_rng(0).random((10, 4)), top_k=3)
+    path = str(tmp_path / 'content_neighbours.npz')
+    save_neighbour_index(path, index, np.arange(1, 11), [f'Movie {i}' for i in range(10)])
+    loaded, movie_ids, titles = load_neighbour_index(path)
+    assert (loaded != index).nnz == 0
+    assert movie_ids.tolist() == list(range(1, 11))
+    assert titles[3] == 'Movie 3'
+
+
+def test_merge_candidates_keeps_best_score_and_excludes():
+    rows, scores = merge_candidates([(np.array([1, 2, 3]), np.array([0.9, 0.5, 0.4])),
+                                     (np.array([3, 4, 0]), np.array([0.8, 0.6, 0.95]))],
+                                    top_n=3, exclude=[0])
+    assert rows.tolist() == [1, 3, 4]
+    np.testing.assert_allclose(scores, [0.9, 0.8, 0.6])
+
+
+def test_neighbour_index_over_reordered_catalogue(tmp_path, catalog, movies_csv, write_movies):
+    index = sps.random(len(catalog.movie_ids), len(catalog.movie_ids), density=0.1,
+                       format='csr', dtype=np.float32, random_state=0)
+    path = str(tmp_path / 'content_neighbours.npz')
+    save_neighbour_index(path, index, catalog.movie_ids, catalog.titles)
+    loaded = _load_neighbour_index(path, resource_stamp(path), movies_csv,
+                                   resource_stamp(movies_csv))
+    assert loaded is not None
+    np.testing.assert_array_equal(loaded[1].movie_ids, catalog.movie_ids)
+
+    # Same number of movies, in another order: rows would name other movies
+    stale_csv = str(tmp_path / 'movies_reordered.csv')
+    write_movies(stale_csv, catalog.movie_ids[::-1], catalog.titles[::-1])
+    assert _load_neighbour_index(path, resource_stamp(path), stale_csv,
+                                 resource_stamp(stale_csv)) is None
@@ -0,0 +1,98 @@
+"""
+
+    Stability and correctness of the factor model trainers.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+# Custom Libraries
+from recommenders.factor_training import _half_step, sgd_epoch, train_als
+from utils.ratings_store import RatingsStore, convert_ratings
+
+
+def make_store(tmp_path, name, seed):
+    """A ratings store of 300 random ratings (the same users and movies for every seed)."""
+    rng = np.random.default_rng(seed)
+    ratings = pd.DataFrame({'userId': np.repeat(np.arange(1, 31), 10),
+                            'movieId': np.tile(np.arange(1, 11), 30),
+                            'rating': rng.integers(1, 11, 300) / 2})
+    csv_path = str(tmp_path / f'{name}.csv')
+    ratings.to_csv(csv_path, index=False)
+    return RatingsStore(convert_ratings(csv_path, str(tmp_path / name)))
+
+
+def test_sgd_epoch_repeated_item_takes_one_step(make_factor_model):
+    # One popular item rated by every user of a single batch
+    model = make_factor_model(n_users=1000, n_items=1)
+    users = np.arange(1000)
+    items = np.zeros(1000, dtype=np.int64)
+    errors = 5.0 - model.predict_pairs(users, items)
+    before = model.bi[0]
+    sgd_epoch(model, users, items, np.full(1000, 5.0, dtype=np.float32), lr=0.05, reg=0.0,
+              batch_size=1000)
+    # Averaged over its repeats, the item moves by at most lr * the largest error
+    assert 0 < model.bi[0] - before <= 0.05 * errors.max() + 1e-6
+
+
+def test_sgd_epoch_stays_finite_with_popular_items(make_factor_model):
+    rng = np.random.default_rng(0)
+    # Power-law popularity: a few items take most of every batch
+    items = np.minimum(rng.zipf(1.5, 20_000) - 1, 49)
+    users = rng.integers(0, 500, 20_000)
+    ratings = np.clip(3.5 + rng.normal(0, 1, 20_000), 0.5, 5.0).astype(np.float32)
+    for batch_size in [16, 1024, 20_000]:
+        trained = make_factor_model(n_users=500, n_items=50, n_factors=8)
+        for _ in range(3):
+            sgd_epoch(trained, users, items, ratings, lr=0.05, reg=0.02,
+                      batch_size=batch_size, rng=rng)
+        for array in [trained.pu, trained.qi, trained.bu, trained.bi]:
+            assert np.isfinite(array).all()
+        errors = ratings - trained.predict_pairs(users, items)
+        assert np.sqrt(np.mean(errors ** 2)) < 1.5
+
+
+def test_half_step_matches_per_row_solution():
+    rng = np.random.default_rng(0)
+    n_rows, n_cols, k, reg = 60, 25, 3, 0.05
+    # Rows with very different numbers of ratings (some with none)
+    rated = rng.random((n_rows, n_cols)) < rng.random((n_rows, 1))
+    dense = rated * rng.integers(1, 6, (n_rows, n_cols))
+    matrix = sps.csr_matrix(dense.astype(np.float32))
+    positions = np.arange(matrix.nnz)
+    mask = rng.random(matrix.nnz) < 0.9
+    fixed_factors = rng.normal(0, 0.1, (n_cols, k)).astype(np.float32)
+    fixed_biases = rng.normal(0, 0.1, n_cols).astype(np.float32)
+    # The ratings store keeps ratings as half-stars
+    half_stars = (matrix.data * 2).astype(np.uint8)
+    factors, biases = _half_step(matrix.indptr, matrix.indices, half_stars, positions, mask,
+                                 fixed_factors, fixed_biases, 3.0, reg, 2, 16)
+
+    for row in range(n_rows):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        kept = mask[start:end]
+        c, v = matrix.indices[start:end][kept], matrix.data[start:end][kept]
+        z = np.hstack([fixed_factors[c], np.ones((len(c), 1))]).astype(np.float64)
+        gram = z.T @ z + reg * max(len(c), 1) * np.eye(k + 1)
+        solution = np.linalg.solve(gram, z.T @ (v - 3.0 - fixed_biases[c]))
+        np.testing.assert_allclose(factors[row], solution[:k], rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(biases[row], solution[k], rtol=1e-4, atol=1e-6)
+
+
+def test_als_checkpoint_only_resumes_on_the_same_ratings(tmp_path):
+    checkpoint = str(tmp_path / 'als_checkpoint.npz')
+    first, second = make_store(tmp_path, 'first', 0), make_store(tmp_path, 'second', 1)
+    assert first.n_ratings == second.n_ratings
+    train_als(first, n_factors=2, n_epochs=2, checkpoint_path=checkpoint, n_jobs=1)
+
+    # Other ratings of the same size start over rather than resume
+    resumed, history = train_als(second, n_factors=2, n_epochs=2, checkpoint_path=checkpoint,
+                                 n_jobs=1)
+    fresh, _ = train_als(second, n_factors=2, n_epochs=2, n_jobs=1)
+    np.testing.assert_array_equal(resumed.qi, fresh.qi)
+    assert [entry['epoch'] for entry in history] == [0, 1]
+    assert resumed.metadata['data_hash'] == second.fingerprint()
@@ -0,0 +1,47 @@
+"""
+
+    Fold-in of app users with any number of favourite movies.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import numpy as np
+import pytest
+
+# Custom Libraries
+from recommenders import collaborative_based
+from recommenders.collaborative_based import FAVOURITE_RATINGS, favourite_ratings
+
+
+@pytest.mark.parametrize('n_movies', [0, 1, 3, 5, 12])
+def test_favourite_ratings_any_length(n_movies):
+    ratings = favourite_ratings(n_movies)
+    assert ratings.shape == (n_movies,)
+    assert ratings[:3].tolist() == FAVOURITE_RATINGS[:n_movies]
+    assert (ratings[3:] == 5.0).all()
+
+
+def test_fold_in_ignores_unknown_movies(factor_model):
+    rows = factor_model.item_rows([1, 2, 999, 3])
+    assert rows[2] == -1
+    with_unknown = factor_model.fold_in(rows, favourite_ratings(len(rows)))
+    known = factor_model.fold_in(rows[[0, 1, 3]], favourite_ratings(4)[[0, 1, 3]])
+    np.testing.assert_allclose(with_unknown, known, rtol=1e-5)
+
+
+@pytest.fixture
+def registry(monkeypatch, factor_model, catalog):
+    """Point the fold-in engine at the synthetic model, without an ANN index."""
+    monkeypatch.setattr(collaborative_based, 'get_catalog', lambda: catalog)
+    monkeypatch.setattr(collaborative_based, 'get_factor_model', lambda: factor_model)
+    monkeypatch.setattr(collaborative_based, 'get_ann_index', lambda source: None)
+
+
+@pytest.mark.parametrize('n_movies', [3, 4, 7])
+def test_foldin_model_more_than_three_movies(registry, catalog, n_movies):
+    favourites = list(range(1, n_movies + 1))
+    [titles] = collaborative_based.foldin_model([favourites], 5)
+    assert len(titles) == 5
+    assert not set(titles) & set(catalog.titles_of_ids(favourites))
+
@@ -0,0 +1,29 @@
+"""
+
+    Candidate generation of the hybrid engine.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import pytest
+
+# Custom Libraries
+from recommenders import hybrid
+
+
+@pytest.fixture
+def registry(monkeypatch, factor_model, catalog):
+    """Point the hybrid engine at the synthetic model, without an ANN index."""
+    monkeypatch.setattr(hybrid, 'get_catalog', lambda: catalog)
+    monkeypatch.setattr(hybrid, 'get_factor_model', lambda: factor_model)
+    monkeypatch.setattr(hybrid, 'get_ann_index', lambda source: None)
+
+
+@pytest.mark.parametrize('n_movies', [3, 4, 7])
+def test_hybrid_factor_candidates_more_than_three_movies(registry, n_movies):
+    favourites = list(range(1, n_movies + 1))
+    user_vectors, [rows] = hybrid.factor_candidates([favourites], k=10)
+    assert user_vectors.shape == (1, 4)
+    assert len(rows) == 10
+    assert not set(rows.tolist()) & set(range(n_movies))
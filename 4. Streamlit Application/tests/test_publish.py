@@ -0,0 +1,85 @@
+"""
+
+    Visibility of published factor models while they are replaced.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import os
+import threading
+
+# Custom Libraries
+from recommenders.factor_model import load_factor_model
+from utils import publishing
+from utils.publishing import published_versions, resolve_published
+
+
+def test_publish_visible_between_renames(tmp_path, monkeypatch, make_factor_model):
+    path = str(tmp_path / 'svd_factors')
+    make_factor_model(metadata={'generation': 0}).publish(path)
+    replace = os.replace
+    visible = []
+
+    def checked_replace(source, destination):
+        # The state a reader may observe before each rename of `publish`
+        visible.append(load_factor_model(path).metadata['generation'])
+        replace(source, destination)
+
+    monkeypatch.setattr(publishing.os, 'replace', checked_replace)
+    for generation in range(1, 4):
+        make_factor_model(metadata={'generation': generation}).publish(path)
+    assert visible == [0, 1, 2]
+    assert load_factor_model(path).metadata['generation'] == 3
+
+
+def test_publish_is_always_visible(tmp_path, make_factor_model):
+    path = str(tmp_path / 'svd_factors')
+    make_factor_model(metadata={'generation': 0}).publish(path)
+    done = threading.Event()
+    seen, failures = [], []
+
+    def read():
+        while not done.is_set():
+            # The registry resolves the path first, and falls back to other
+            # models when nothing is published
+            if resolve_published(path) is None:
+                failures.append('missing')
+            try:
+                seen.append(load_factor_model(path).metadata['generation'])
+            except Exception as error:
+                failures.append(error)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for generation in range(1, 100):
+            make_factor_model(metadata={'generation': generation}).publish(path, keep=2)
+    finally:
+        done.set()
+        reader.join()
+
+    assert not failures
+    assert seen and seen == sorted(seen)
+    assert load_factor_model(path).metadata['generation'] == 99
+    assert len(published_versions(path)) == 2
+
+
+def test_publish_over_legacy_directory(tmp_path, make_factor_model):
+    path = str(tmp_path / 'svd_factors')
+    make_factor_model(metadata={'generation': 0}).save(path)
+    make_factor_model(metadata={'generation': 1}).publish(path)
+
+    assert os.path.islink(path)
+    assert resolve_published(path) == published_versions(path)[-1]
+    assert load_factor_model(path).metadata['generation'] == 1
+    # The legacy directory is kept as the oldest version
+    assert published_versions(path)[0] == str(tmp_path / 'svd_factors.v0')
+
+
+def test_publish_archive(tmp_path, make_factor_model):
+    path = str(tmp_path / 'svd_factors.npz')
+    for generation in range(2):
+        make_factor_model(metadata={'generation': generation}).publish(path)
+    assert load_factor_model(path).metadata['generation'] == 1
+    assert os.listdir(tmp_path) == ['svd_factors.npz']
@@ -0,0 +1,73 @@
+"""
+
+    Conversion and publishing of the ratings store.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+# Custom Libraries
+from utils import publishing, ratings_store
+from utils.publishing import published_versions
+from utils.ratings_store import open_ratings_store
+
+
+def write_ratings(path, n_users, seed=0):
+    """Ten random ratings of each of `n_users` users."""
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({'userId': np.repeat(np.arange(1, n_users + 1), 10),
+                  'movieId': np.tile(np.arange(1, 11), n_users),
+                  'rating': rng.integers(1, 11, 10 * n_users) / 2}).to_csv(path, index=False)
+
+
+def test_converted_store_is_published(tmp_path):
+    csv_path, store_path = str(tmp_path / 'ratings.csv'), str(tmp_path / 'ratings_store')
+    write_ratings(csv_path, 20)
+    store = open_ratings_store(store_path, csv_path)
+
+    assert os.path.islink(store_path)
+    assert store.path == published_versions(store_path)[-1]
+    assert store.n_users == 20 and store.n_ratings == 200
+    # Only the arrays and header are published, not the raw columns
+    assert not [name for name in os.listdir(store.path) if name.endswith('.bin')]
+
+
+def test_reconversion_keeps_readers_on_one_version(tmp_path, monkeypatch):
+    csv_path, store_path = str(tmp_path / 'ratings.csv'), str(tmp_path / 'ratings_store')
+    write_ratings(csv_path, 20)
+    old = open_ratings_store(store_path, csv_path)
+    write_ratings(csv_path, 30, seed=1)
+    os.utime(csv_path, ns=(0, 0))
+    replace = os.replace
+    visible = []
+
+    def checked_replace(source, destination):
+        # A reader opening the store just before the link is swapped
+        visible.append(ratings_store.RatingsStore(store_path).n_users)
+        replace(source, destination)
+
+    monkeypatch.setattr(publishing.os, 'replace', checked_replace)
+    new = open_ratings_store(store_path, csv_path)
+    assert visible == [20]
+    assert new.n_users == 30 and new.path != old.path
+    # The previous version stays readable for readers still mapping it
+    assert old.n_users == 20 and old.user_items.sum() >= 0
+
+
+@pytest.mark.skipif(ratings_store.fcntl is None, reason='conversion is unlocked')
+def test_busy_conversion_serves_existing_store(tmp_path, monkeypatch):
+    csv_path, store_path = str(tmp_path / 'ratings.csv'), str(tmp_path / 'ratings_store')
+    write_ratings(csv_path, 20)
+    open_ratings_store(store_path, csv_path)
+    write_ratings(csv_path, 30, seed=1)
+    os.utime(csv_path, ns=(0, 0))
+
+    # Another process holds the conversion lock: the stale store is served
+    monkeypatch.setattr(ratings_store, 'convert_ratings', None)
+    with ratings_store._conversion_lock(store_path):
+        assert open_ratings_store(store_path, csv_path).n_users == 20
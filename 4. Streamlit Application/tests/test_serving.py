@@ -0,0 +1,76 @@
+"""
+
+    Deadline-aware serving and its fallbacks.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import os
+import time
+import numpy as np
+import pytest
+import scipy.sparse as sps
+
+# Custom Libraries
+from recommenders import serving
+from recommenders.fallback import Fallbacks
+
+
+def slow_engine(movie_list, top_n):
+    time.sleep(0.2)
+    return ['Slow answer']
+
+
+def failing_engine(movie_list, top_n):
+    raise KeyError('engine failure')
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    monkeypatch.setitem(serving.ENGINES, 'slow', slow_engine)
+    monkeypatch.setitem(serving.ENGINES, 'failing', failing_engine)
+
+
+def test_without_fallbacks_a_late_answer_is_served(monkeypatch, engines):
+    monkeypatch.setattr(serving, 'get_fallbacks', lambda: None)
+    served = serving.recommend_within('slow', ['Movie'], budget=0.01)
+    assert served.titles == ['Slow answer'] and served.tier == 'primary'
+    with pytest.raises(KeyError):
+        serving.recommend_within('failing', ['Movie'], budget=0.01)
+
+
+def test_late_answer_falls_back(monkeypatch, engines):
+    monkeypatch.setattr(serving, 'get_fallbacks', lambda: object())
+    monkeypatch.setattr(serving, 'fallback', lambda movie_list, top_n: (['Popular'], 'popular'))
+    served = serving.recommend_within('slow', ['Movie'], budget=0.01)
+    assert served == (['Popular'], 'popular', served.seconds, 'deadline')
+
+
+def test_failing_fallbacks_wait_for_the_late_answer(monkeypatch, engines):
+    monkeypatch.setattr(serving, 'get_fallbacks', lambda: object())
+    monkeypatch.setattr(serving, 'fallback', lambda movie_list, top_n: None)
+    served = serving.recommend_within('slow', ['Movie'], budget=0.01)
+    assert served.titles == ['Slow answer'] and served.reason == 'deadline'
+
+
+def test_overloaded_without_working_fallbacks_runs_the_engine(monkeypatch, engines):
+    monkeypatch.setattr(serving, 'get_fallbacks', lambda: object())
+    monkeypatch.setattr(serving, 'fallback', lambda movie_list, top_n: None)
+    monkeypatch.setattr(serving, '_slots', serving.threading.BoundedSemaphore(1))
+    serving._slots.acquire()
+    served = serving.recommend_within('slow', ['Movie'], budget=0.01)
+    assert served.titles == ['Slow answer'] and served.reason == 'overloaded'
+
+
+def test_fallbacks_saved_atomically(tmp_path):
+    neighbours = sps.csr_matrix(np.eye(3, k=1, dtype=np.float32))
+    fallbacks = Fallbacks(np.array([1, 2, 3]), neighbours, np.array([2, 0, 1]),
+                          np.array(['Drama']), np.array([1, 1, 0]), np.array([0, 2]),
+                          np.array([0, 1]))
+    path = str(tmp_path / 'fallbacks.npz')
+    fallbacks.save(path)
+    assert os.listdir(tmp_path) == ['fallbacks.npz']
+    loaded = Fallbacks.load(path)
+    assert loaded.similar([0], 2).tolist() == [1]
+    assert loaded.movie_ids.tolist() == [1, 2, 3]
@@ -0,0 +1,43 @@
+"""
+
+    Title search index.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Script dependencies
+import numpy as np
+
+# Custom Libraries
+from utils.resources import _load_title_index, resource_stamp
+from utils.title_search import TitleIndex
+
+
+def test_title_index_rebuilt_for_edited_catalogue(tmp_path, catalog, movies_csv, write_movies):
+    path = str(tmp_path / 'title_index.npz')
+    TitleIndex.build(catalog.titles.tolist(), catalog.movie_ids).save(path)
+    index = _load_title_index(path, resource_stamp(path), movies_csv,
+                              resource_stamp(movies_csv), None)
+    assert index.matches(catalog)
+
+    # One title replaced, keeping the number of movies
+    movie_ids, titles = catalog.movie_ids.copy(), catalog.titles.copy()
+    movie_ids[0], titles[0] = 1000, 'The Matrix (1999)'
+    edited_csv = str(tmp_path / 'movies_edited.csv')
+    write_movies(edited_csv, movie_ids, titles)
+    index = _load_title_index(path, resource_stamp(path), edited_csv,
+                              resource_stamp(edited_csv), None)
+    np.testing.assert_array_equal(index.movie_ids, movie_ids)
+    assert index.search('matrix')[0] == 0
+
+
+def test_title_index_without_movie_ids_is_stale(catalog):
+    index = TitleIndex.build(catalog.titles.tolist(), catalog.movie_ids)
+    index.movie_ids = None
+    assert not index.matches(catalog)
+
+
+def test_title_search_finds_typos():
+    titles = ['Matrix (1999)', 'Matir (2010)', 'Toy Story (1995)']
+    index = TitleIndex.build(titles, np.arange(1, 4))
+    assert index.search('matirx')[0] == 0
@@ -6,6 +6,8 @@
 
 """
 # Data handling dependencies
+import os
+import time
 import pandas as pd
 import numpy as np
 import streamlit as st
@@ -30,3 +32,145 @@ def load_movie_titles(path_to_movies):
     df = df.dropna()
     movie_list = df['title'].to_list()
     return movie_list
+
+
+def replace_together(replacements):
+    """Move temporary files onto their destinations, as one update.
+
+    Parameters
+    ----------
+    replacements : list (tuple (str, str))
+        (temporary file, destination) pairs, written in this order, with
+        the sidecars first and the main file (whose modification time
+        versions the set) last.
+
+    Notes
+    -----
+    The files are only mismatched in the instant between two renames;
+    `read_together` detects it and reads again.
+
+    """
+    for tmp_path, path in replacements:
+        os.replace(tmp_path, path)
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def read_together(read, paths, attempts=3):
+    """Read files updated by `replace_together` without mixing versions.
+
+    Parameters
+    ----------
+    read : callable
+        Reads the files and returns their contents.
+    paths : list (str)
+        The files read, in the order they are replaced (main file last).
+    attempts : int
+        Reads tried before the last result (or error) is returned
+        regardless.
+
+    Returns
+    -------
+    object
+        The result of `read` over files which were neither replaced
+        during the read nor caught midway through an update (a sidecar
+        newer than the main file).
+
+    """
+    for attempt in range(attempts):
+        before = [_file_stamp(path) for path in paths]
+        try:
+            value = read()
+        except (OSError, ValueError):
+            # Mismatched files may not even load (e.g. different lengths)
+            if attempt + 1 == attempts:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+            continue
+        after = [_file_stamp(path) for path in paths]
+        if before == after and None not in before and \
+                max(stamp[1] for stamp in before[:-1]) <= before[-1][1]:
+            return value
+        time.sleep(0.01 * (attempt + 1))
+    return value
+
+
+class MovieCatalog:
+    """Contiguous movie ID/title arrays with O(1) lookups between them.
+
+    Rows follow the order of the source table. Titles are not unique in
+    MovieLens (remakes, re-releases and data-entry duplicates share a
+    title); a title always resolves to its first row in catalogue order,
+    which is the lowest movie ID for the sorted MovieLens files. All rows
+    sharing a title are available through `rows_with_title`.
+
+    Parameters
+    ----------
+    movie_ids : array-like (int)
+        MovieLens movie ID of each row.
+    titles : array-like (str)
+        Title of each row.
+
+    """
+
+    def __init__(self, movie_ids, titles):
+        self.movie_ids = np.ascontiguousarray(movie_ids, dtype=np.int64)
+        self.titles = np.asarray(titles, dtype=object)
+        if len(self.movie_ids) != len(self.titles):
+            raise ValueError("movie_ids and titles must have the same length")
+        self._id_rows = {}
+        self._title_rows = {}
+        for row, (movie_id, title) in enumerate(zip(self.movie_ids.tolist(), self.titles)):
+            self._id_rows.setdefault(movie_id, row)
+            self._title_rows.setdefault(title, []).append(row)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a catalogue from a frame with `movieId` and `title` columns."""
+        return cls(df['movieId'].values, df['title'].values)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def __contains__(self, title):
+        return title in self._title_rows
+
+    def row_of_title(self, title):
+        """Row of a title (its first occurrence); raises KeyError if unknown."""
+        return self._title_rows[title][0]
+
+    def rows_with_title(self, title):
+        """All rows sharing a title, in catalogue order."""
+        return list(self._title_rows.get(title, []))
+
+    def rows_of_titles(self, titles):
+        """Rows of several titles; raises KeyError for an unknown title."""
+        return np.array([self._title_rows[title][0] for title in titles], dtype=np.int64)
+
+    def row_of_id(self, movie_id):
+        """Row of a movie ID; raises KeyError if unknown."""
+        return self._id_rows[movie_id]
+
+    def rows_of_ids(self, movie_ids):
+        """Rows of several movie IDs, using -1 for unknown IDs."""
+        return np.fromiter((self._id_rows.get(movie_id, -1) for movie_id in movie_ids),
+                           dtype=np.int64, count=len(movie_ids))
+
+    def ids_of_titles(self, titles):
+        """Movie IDs of several titles; raises KeyError for an unknown title."""
+        return self.movie_ids[self.rows_of_titles(titles)].tolist()
+
+    def titles_of_rows(self, rows):
+        """Titles of several rows."""
+        return self.titles[np.asarray(rows, dtype=np.int64)].tolist()
+
+    def titles_of_ids(self, movie_ids):
+        """Titles of several movie IDs, skipping IDs absent from the catalogue."""
+        rows = self.rows_of_ids(movie_ids)
+        return self.titles_of_rows(rows[rows >= 0])
@@ -0,0 +1,396 @@
+"""
+
+    Shared-memory model host for multi-process deployments.
+
+    Author: Explore Data Science Academy.
+
+    Description: When several Streamlit (or API) processes serve the app
+    on one node, each of them would otherwise hold a private copy of every
+    artifact that is built or decompressed in memory: the SVD factors of a
+    pickled model, the hashed text features, the content neighbour index
+    and the ANN indexes. The model host is a single local process which
+    loads these artifacts once, through the resource registry, and copies
+    their arrays into POSIX shared memory segments (one per artifact
+    version). A JSON manifest next to the models names each segment and
+    the dtype, shape and offset of every array in it.
+
+    App processes started with `EDSA_MODEL_HOST=1` read the manifest and
+    map the segments read-only, so the recommenders use zero-copy NumPy
+    views of one physical copy. Artifacts missing from the manifest (or a
+    host which is not running) fall back to loading in-process. The
+    ratings store, and artifacts already served from memory-mapped files,
+    are shared through the OS page cache and are not hosted.
+
+    The host polls the artifacts on disk; a new version is copied into a
+    new segment and the manifest is replaced atomically, so processes pick
+    it up on their next request without downtime. Old segments are
+    unlinked after a grace period; processes still reading them keep a
+    valid mapping until they drop it.
+
+    Run the host from the root of the Streamlit application with:
+
+        python -m utils.model_host
+
+"""
+# Script dependencies
+import argparse
+import functools
+import json
+import mmap
+import os
+import signal
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+# Custom Libraries
+from utils.publishing import to_json
+
+MANIFEST_NAME = 'model_host.json'
+MANIFEST_VERSION = 1
+
+# Directory holding the POSIX shared memory segments (Linux)
+SHM_DIR = '/dev/shm'
+# Alignment of every array within a segment, in bytes
+_ALIGNMENT = 64
+
+
+# ---------------------------------------------------------------------
+# Packing artifacts into named arrays and rebuilding them from views
+# ---------------------------------------------------------------------
+
+def _pack_factor_model(model):
+    arrays = {'pu': model.pu, 'qi': model.qi, 'bu': model.bu, 'bi': model.bi,
+              'raw_user_ids': model.raw_user_ids, 'raw_item_ids': model.raw_item_ids,
+              'user_order': model._order('user'), 'item_order': model._order('item')}
+    meta = {'global_mean': model.global_mean, 'rating_scale': list(model.rating_scale),
+            'metadata': model.metadata}
+    return arrays, meta
+
+def _unpack_factor_model(arrays, meta):
+    from recommenders.factor_model import FactorModel
+    model = FactorModel(arrays['pu'], arrays['qi'], arrays['bu'], arrays['bi'],
+                        meta['global_mean'], arrays['raw_user_ids'], arrays['raw_item_ids'],
+                        meta['rating_scale'], meta['metadata'])
+    model.user_order, model.item_order = arrays['user_order'], arrays['item_order']
+    return model
+
+
+def _pack_csr(matrix):
+    arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr}
+    return arrays, {'shape': list(matrix.shape)}
+
+def _unpack_csr(arrays, meta):
+    import scipy.sparse as sps
+    return sps.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                          shape=tuple(meta['shape']), copy=False)
+
+
+def _pack_neighbour_index(value):
+    index, catalog = value
+    arrays, meta = _pack_csr(index)
+    arrays.update(movie_ids=catalog.movie_ids, titles=np.asarray(catalog.titles, dtype=str))
+    return arrays, meta
+
+def _unpack_neighbour_index(arrays, meta):
+    from utils.data_loader import MovieCatalog
+    return _unpack_csr(arrays, meta), MovieCatalog(arrays['movie_ids'], arrays['titles'])
+
+
+def _pack_genome_features(features):
+    arrays = {'vectors': features.vectors, 'movie_ids': features.movie_ids,
+              'catalog_rows': features.catalog_rows, 'feature_rows': features.feature_rows}
+    return arrays, {}
+
+def _unpack_genome_features(arrays, meta):
+    from recommenders.genome_features import GenomeFeatures
+    features = GenomeFeatures(arrays['vectors'], arrays['movie_ids'])
+    features.catalog_rows, features.feature_rows = arrays['catalog_rows'], arrays['feature_rows']
+    return features
+
+
+def _pack_ann_index(index):
+    arrays = {'centroids': index.centroids, 'offsets': index.offsets, 'ids': index.ids,
+              'vectors': index.vectors}
+    return arrays, {'params': index.params}
+
+def _unpack_ann_index(arrays, meta):
+    from recommenders.ann import IVFIndex
+    return IVFIndex(arrays['centroids'], arrays['offsets'], arrays['ids'], arrays['vectors'],
+                    meta['params'])
+
+
+# Hosted artifacts: name -> (pack, unpack). `pack` turns the object
+# returned by the registry into named arrays plus JSON metadata, and
+# `unpack` rebuilds an equivalent object around read-only views.
+ARTIFACTS = {
+    'factor_model': (_pack_factor_model, _unpack_factor_model),
+    'text_features': (_pack_csr, _unpack_csr),
+    'neighbour_index': (_pack_neighbour_index, _unpack_neighbour_index),
+    'genome_features': (_pack_genome_features, _unpack_genome_features),
+    'factors_ann': (_pack_ann_index, _unpack_ann_index),
+    'genome_ann': (_pack_ann_index, _unpack_ann_index),
+}
+
+
+def _plain(array):
+    """A contiguous array with a fixed-size dtype, which can live in shared memory."""
+    array = np.asarray(array)
+    if array.dtype == object:
+        # e.g. raw ids of a surprise trainset
+        array = np.asarray(array.tolist())
+        if array.dtype == object:
+            raise TypeError("object arrays cannot be placed in shared memory")
+    return np.ascontiguousarray(array)
+
+
+# ---------------------------------------------------------------------
+# Client side: attaching to the segments named by the manifest
+# ---------------------------------------------------------------------
+
+_lock = threading.Lock()
+# Currently attached artifact of each name: (segment, object)
+_attached = {}
+# Segments attached through `shared_memory` (non-Linux), kept open for the process lifetime
+_kept = []
+
+
+@functools.lru_cache(maxsize=4)
+def _read_manifest(path, stamp):
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['artifacts']
+
+
+def read_manifest(path):
+    """Artifacts listed in the manifest at `path` ({} when there is none)."""
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _read_manifest(path, stamp)
+
+
+def _map_segment(name):
+    """Read-only mapping of the shared memory segment `name`."""
+    if os.path.isdir(SHM_DIR):
+        with open(os.path.join(SHM_DIR, name), 'rb') as f:
+            # The mapping lives as long as an array refers to it
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    segment = shared_memory.SharedMemory(name)
+    # The host owns the segment: this process must not unlink it at exit
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    _kept.append(segment)
+    return segment.buf.toreadonly()
+
+
+def _views(buffer, layout):
+    return {name: np.frombuffer(buffer, dtype=np.dtype(dtype), count=int(np.prod(shape)),
+                                offset=offset).reshape(shape)
+            for name, (offset, dtype, shape) in layout.items()}
+
+
+def attach(path, name):
+    """The hosted version of artifact `name`, as zero-copy read-only views.
+
+    Parameters
+    ----------
+    path : str
+        Location of the host manifest.
+    name : str
+        Key of `ARTIFACTS`.
+
+    Returns
+    -------
+    object or None
+        The artifact, built like the registry's own, or None when it is
+        not hosted (e.g. no host is running).
+
+    """
+    entry = read_manifest(path).get(name)
+    if entry is None:
+        return None
+    with _lock:
+        segment, value = _attached.get(name, (None, None))
+        if segment == entry['segment']:
+            return value
+        try:
+            buffer = _map_segment(entry['segment'])
+        except FileNotFoundError:
+            # The host may have just retired this version for a newer one:
+            # read the manifest once more before giving up on it
+            entry = read_manifest(path).get(name)
+            if entry is None:
+                return None
+            if entry['segment'] == segment:
+                return value
+            try:
+                buffer = _map_segment(entry['segment'])
+            except FileNotFoundError:
+                # The host has stopped
+                return None
+        value = ARTIFACTS[name][1](_views(buffer, entry['arrays']), entry['meta'])
+        # The previous version is released once in-flight requests drop it
+        _attached[name] = (entry['segment'], value)
+        return value
+
+
+# ---------------------------------------------------------------------
+# Host side
+# ---------------------------------------------------------------------
+
+def _create_segment(name, arrays):
+    """Copy arrays into a new shared memory segment; return it and its layout."""
+    arrays = {key: _plain(array) for key, array in arrays.items()}
+    layout, size = {}, 0
+    for key, array in arrays.items():
+        size = -(-size // _ALIGNMENT) * _ALIGNMENT
+        layout[key] = (size, array.dtype.str, list(array.shape))
+        size += array.nbytes
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        offset, _, _ = layout[key]
+        target = np.ndarray(array.shape, array.dtype, buffer=segment.buf, offset=offset)
+        target[...] = array
+        del target
+    return segment, layout
+
+
+class ModelHost:
+    """Publishes the registry's artifacts into shared memory.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Where the manifest is written.
+    loaders : dict (str, callable)
+        Registry getter of each hosted artifact (returning None when the
+        artifact is unavailable).
+    grace : float
+        Seconds a replaced segment stays available to late attachers.
+
+    """
+
+    def __init__(self, manifest_path, loaders, grace=30.0):
+        self.manifest_path = manifest_path
+        self.loaders = loaders
+        self.grace = grace
+        self.generation = 0
+        # name -> (source object, segment, manifest entry)
+        self.hosted = {}
+        # (unlink time, segment) of replaced versions
+        self.retired = []
+
+    def refresh(self):
+        """Publish every artifact whose registry object has changed.
+
+        Returns
+        -------
+        list (str)
+            Names of the artifacts published (or withdrawn).
+
+        """
+        changed = []
+        for name, loader in self.loaders.items():
+            try:
+                value = loader()
+            except (OSError, ImportError, ValueError):
+                value = None
+            current = self.hosted.get(name)
+            # The registry returns the same object until the files change
+            if current is not None and current[0] is value:
+                continue
+            if current is None and value is None:
+                continue
+            if value is not None:
+                self.generation += 1
+                arrays, meta = ARTIFACTS[name][0](value)
+                segment_name = f'edsa_{os.getpid()}_{self.generation}_{name}'
+                segment, layout = _create_segment(segment_name, arrays)
+                entry = {'segment': segment_name, 'size': segment.size, 'arrays': layout,
+                         'meta': json.loads(json.dumps(meta, default=to_json))}
+                self.hosted[name] = (value, segment, entry)
+            else:
+                del self.hosted[name]
+            if current is not None:
+                self.retired.append((time.monotonic() + self.grace, current[1]))
+            changed.append(name)
+        if changed:
+            self.write_manifest()
+        self.release()
+        return changed
+
+    def write_manifest(self):
+        manifest = {'version': MANIFEST_VERSION, 'pid': os.getpid(),
+                    'generation': self.generation,
+                    'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'artifacts': {name: entry for name, (_, _, entry) in self.hosted.items()}}
+        tmp_path = f'{self.manifest_path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def release(self, force=False):
+        """Unlink the replaced segments whose grace period has passed."""
+        now = time.monotonic()
+        keep = []
+        for deadline, segment in self.retired:
+            if force or deadline <= now:
+                segment.close()
+                segment.unlink()
+            else:
+                keep.append((deadline, segment))
+        self.retired = keep
+
+    @property
+    def nbytes(self):
+        return sum(segment.size for _, segment, _ in self.hosted.values())
+
+    def close(self):
+        """Withdraw the manifest and unlink every segment."""
+        try:
+            os.remove(self.manifest_path)
+        except FileNotFoundError:
+            pass
+        self.retired += [(0, segment) for _, segment, _ in self.hosted.values()]
+        self.hosted = {}
+        self.release(force=True)
+
+    def serve(self, interval=5.0):
+        """Publish the artifacts, then poll them until interrupted."""
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            while True:
+                changed = self.refresh()
+                if changed:
+                    print(f"Published {', '.join(changed)} "
+                          f"({self.nbytes / 2 ** 20:.1f} MiB hosted)", flush=True)
+                if stop.wait(interval):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host the app artifacts in shared memory.')
+    parser.add_argument('--artifacts', nargs='+', choices=list(ARTIFACTS), default=None,
+                        help='Artifacts to host (defaults to all of them).')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='Seconds between checks for new artifact versions.')
+    parser.add_argument('--grace', type=float, default=30.0,
+                        help='Seconds a replaced version stays attachable.')
+    args = parser.parse_args()
+
+    from utils import resources
+    # The host loads the artifacts itself rather than attaching to them
+    resources.MODEL_HOST = False
+    loaders = {name: resources.HOSTED_LOADERS[name] for name in args.artifacts or ARTIFACTS}
+    host = ModelHost(resources.model_host_manifest(), loaders, args.grace)
+    print(f"Hosting {', '.join(loaders)}; manifest: {host.manifest_path}", flush=True)
+    host.serve(args.interval)
@@ -0,0 +1,102 @@
+"""
+
+    Atomic publishing of artifact directories.
+
+    Author: Explore Data Science Academy.
+
+    Description: Artifacts made of several files (e.g. a model's arrays
+    and header, or the columns of the ratings store) are published as
+    versioned directories behind a symbolic link. A new version is written
+    aside and the link is swapped with a single rename, so readers which
+    resolve the link once always see every file of one version. The
+    metadata of every artifact is written with the same JSON conversions.
+
+"""
+# Script dependencies
+import os
+import shutil
+import time
+import numpy as np
+
+
+def to_json(value):
+    """Serialise NumPy scalars found in artifact metadata (a `json` `default`)."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialise {type(value).__name__} to JSON")
+
+
+def published_versions(path):
+    """Version directories published at `path` by `publish_directory`, oldest first."""
+    parent, name = os.path.split(path.rstrip(os.sep))
+    versions = []
+    for entry in os.listdir(parent or '.'):
+        number = entry[len(name) + 2:] if entry.startswith(f'{name}.v') else ''
+        if number.isdigit() and os.path.isdir(os.path.join(parent, entry)):
+            versions.append((int(number), os.path.join(parent, entry)))
+    return [version for _, version in sorted(versions)]
+
+
+def resolve_published(path):
+    """The directory (or file) currently published at `path`.
+
+    Follows the link written by `publish_directory`. Should the link be
+    missing (e.g. while a legacy directory is converted), the newest
+    version directory is used. Returns None when nothing is published.
+
+    """
+    if os.path.exists(path):
+        return os.path.realpath(path) if os.path.islink(path) else path
+    versions = published_versions(path) if os.path.isdir(os.path.dirname(path) or '.') else []
+    return versions[-1] if versions else None
+
+
+def publish_directory(write, path, keep=2):
+    """Atomically replace the artifact directory at `path`.
+
+    The new version is written by `write` into a temporary directory,
+    renamed to `<path>.v<ns>`, and `path` becomes a symbolic link to it:
+    the link is swapped with a single rename, so `path` always names one
+    complete version and readers never mix the files of two. Readers
+    still mapping a previous version keep reading it until they reload.
+
+    Parameters
+    ----------
+    write : callable
+        Called with the directory to fill.
+    path : str
+        Destination link.
+    keep : int
+        Version directories kept, the current one included.
+
+    Returns
+    -------
+    str
+        The new version directory.
+
+    """
+    path = path.rstrip(os.sep)
+    parent, name = os.path.split(path)
+    stamp = time.time_ns()
+    work_dir = os.path.join(parent, f'.{name}.writing-{os.getpid()}-{stamp}')
+    version = f'{name}.v{stamp}'
+    os.makedirs(work_dir)
+    try:
+        write(work_dir)
+        os.rename(work_dir, os.path.join(parent, version))
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    link_path = f'{path}.link-{os.getpid()}'
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(version, link_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # An artifact directory published before versioning: keep it as
+        # the oldest version (readers fall back to the newest meanwhile)
+        os.replace(path, os.path.join(parent, f'{name}.v0'))
+    os.replace(link_path, path)
+    for old in published_versions(path)[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+    return os.path.join(parent, version)
+
@@ -0,0 +1,375 @@
+"""
+
+    Columnar, memory-mapped ratings store.
+
+    Author: Explore Data Science Academy.
+
+    Description: One-time converter from `ratings.csv` to a compact binary
+    layout, and a loader which memory-maps it. Users and movies are coded
+    as contiguous int32 ids, ratings are stored as uint8 half-stars, and
+    the ratings are laid out twice (user-major and item-major) with CSR
+    offsets so that all ratings of a user or of a movie are a zero-copy
+    slice. Since the files are memory-mapped, their pages are shared by
+    every process reading the same store. The store records the size and
+    modification time of its csv, and is converted again when they change.
+    Each conversion is written to a new directory and published by
+    swapping a link, so readers never see a partially converted store.
+
+    Convert a ratings file from the root of the Streamlit application with:
+
+        python -m utils.ratings_store resources/data/ratings.csv
+
+"""
+# Data handling dependencies
+import argparse
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Custom Libraries
+from utils.publishing import publish_directory, resolve_published
+
+# Default locations of the raw ratings and the converted store
+RATINGS_CSV_PATH = 'resources/data/ratings.csv'
+RATINGS_STORE_PATH = 'resources/data/ratings_store'
+
+STORE_VERSION = 1
+
+# Arrays making up a store, written as `<name>.npy`
+_ARRAYS = ['user_ids', 'item_ids', 'user_indptr', 'user_items', 'user_ratings',
+           'item_indptr', 'item_users', 'item_ratings', 'item_order']
+
+
+def source_fingerprint(csv_path):
+    """Size and modification time of a ratings csv, recorded in the store."""
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def convert_ratings(csv_path, store_path=RATINGS_STORE_PATH, chunksize=5_000_000):
+    """Convert a MovieLens ratings file into a ratings store.
+
+    The csv is streamed into one raw file per column, and the store's
+    arrays are then derived and saved one at a time, so the parsed chunks
+    are never held in memory together. The store is written into a new
+    version directory and published behind a link swapped with one rename
+    (see `utils.publishing.publish_directory`): a process opening the store
+    meanwhile reads every file of the previous version, and processes
+    mapping it keep a consistent view of it.
+
+    Parameters
+    ----------
+    csv_path : str
+        Path to a csv file with `userId`, `movieId` and `rating` columns
+        (and optionally `timestamp`).
+    store_path : str
+        Link the store is published at.
+    chunksize : int
+        Number of csv rows parsed at a time.
+
+    Returns
+    -------
+    str
+        The store path.
+
+    """
+    publish_directory(functools.partial(_write_store, csv_path, chunksize=chunksize), store_path)
+    return store_path
+
+
+def _write_store(csv_path, directory, chunksize):
+    """Convert a ratings file into the arrays and header of a store in `directory`."""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    has_timestamps = 'timestamp' in header
+    dtypes = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+    if has_timestamps:
+        dtypes['timestamp'] = np.int64
+    fingerprint = source_fingerprint(csv_path)
+
+    # Raw column files, appended to chunk by chunk
+    columns = {'users': np.int32, 'items': np.int32, 'ratings': np.uint8}
+    if has_timestamps:
+        columns['timestamps'] = np.int64
+    try:
+        files = {name: open(os.path.join(directory, f'{name}.bin'), 'wb') for name in columns}
+        n_ratings = 0
+        try:
+            for chunk in pd.read_csv(csv_path, usecols=list(dtypes), dtype=dtypes,
+                                     chunksize=chunksize):
+                files['users'].write(chunk['userId'].values.tobytes())
+                files['items'].write(chunk['movieId'].values.tobytes())
+                files['ratings'].write(np.rint(chunk['rating'].values * 2).astype(np.uint8).tobytes())
+                if has_timestamps:
+                    files['timestamps'].write(chunk['timestamp'].values.tobytes())
+                n_ratings += len(chunk)
+        finally:
+            for f in files.values():
+                f.close()
+
+        def column(name):
+            if n_ratings == 0:
+                return np.empty(0, dtype=columns[name])
+            return np.memmap(os.path.join(directory, f'{name}.bin'), dtype=columns[name],
+                             mode='r', shape=(n_ratings,))
+
+        def save(name, values):
+            np.save(os.path.join(directory, f'{name}.npy'), values)
+
+        user_ids, user_codes = np.unique(column('users'), return_inverse=True)
+        user_codes = user_codes.astype(np.int32)
+        save('user_ids', user_ids.astype(np.int32))
+        save('user_indptr', np.concatenate([[0], np.cumsum(np.bincount(user_codes,
+                                                                        minlength=len(user_ids)))]))
+        item_ids, item_codes = np.unique(column('items'), return_inverse=True)
+        item_codes = item_codes.astype(np.int32)
+        save('item_ids', item_ids.astype(np.int32))
+        save('item_indptr', np.concatenate([[0], np.cumsum(np.bincount(item_codes,
+                                                                        minlength=len(item_ids)))]))
+
+        # User-major layout, items sorted within each user
+        by_user = np.lexsort((item_codes, user_codes))
+        user_items = item_codes[by_user]
+        del item_codes
+        save('user_items', user_items)
+        # Item-major layout, expressed as positions into the user-major arrays
+        item_order = np.argsort(user_items, kind='stable').astype(np.int64)
+        del user_items
+        save('item_order', item_order)
+        save('item_users', user_codes[by_user][item_order])
+        del user_codes
+        user_ratings = column('ratings')[by_user]
+        save('user_ratings', user_ratings)
+        save('item_ratings', user_ratings[item_order])
+        del user_ratings, item_order
+        if has_timestamps:
+            save('user_timestamps', column('timestamps')[by_user])
+        del by_user
+
+        meta = {'version': STORE_VERSION,
+                'n_ratings': int(n_ratings),
+                'n_users': int(len(user_ids)),
+                'n_items': int(len(item_ids)),
+                'rating_encoding': 'half_stars_uint8',
+                'has_timestamps': has_timestamps,
+                'source': os.path.abspath(csv_path),
+                'source_fingerprint': fingerprint}
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+    finally:
+        # Only the store's own files are published
+        for name in columns:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, f'{name}.bin'))
+
+
+class RatingsStore:
+    """Read-only, memory-mapped view of a converted ratings store.
+
+    Parameters
+    ----------
+    store_path : str
+        Store published by `convert_ratings` (or one of its version
+        directories).
+
+    """
+
+    def __init__(self, store_path=RATINGS_STORE_PATH):
+        # Resolved once, so that every array comes from the same version
+        store_path = resolve_published(store_path) or store_path
+        with open(os.path.join(store_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported ratings store version: {self.meta['version']}")
+        self.path = store_path
+        names = _ARRAYS + (['user_timestamps'] if self.meta['has_timestamps'] else [])
+        for name in names:
+            setattr(self, name, np.load(os.path.join(store_path, f'{name}.npy'), mmap_mode='r'))
+
+    @property
+    def n_users(self):
+        return len(self.user_ids)
+
+    @property
+    def n_items(self):
+        return len(self.item_ids)
+
+    @property
+    def n_ratings(self):
+        return len(self.user_items)
+
+    @staticmethod
+    def decode(ratings):
+        """Convert stored half-star ratings back to float32 star ratings."""
+        return np.asarray(ratings, dtype=np.float32) / 2
+
+    @staticmethod
+    def _codes(sorted_ids, raw_ids):
+        raw_ids = np.asarray(raw_ids)
+        codes = np.searchsorted(sorted_ids, raw_ids)
+        codes = np.minimum(codes, len(sorted_ids) - 1)
+        return np.where(sorted_ids[codes] == raw_ids, codes, -1)
+
+    def user_codes(self, raw_ids):
+        """Map raw user IDs to store codes, using -1 for unknown users."""
+        return self._codes(self.user_ids, raw_ids)
+
+    def item_codes(self, raw_ids):
+        """Map raw movie IDs to store codes, using -1 for unknown movies."""
+        return self._codes(self.item_ids, raw_ids)
+
+    def user_ratings_of(self, user_code):
+        """Item codes and half-star ratings of one user (zero-copy views)."""
+        start, stop = self.user_indptr[user_code], self.user_indptr[user_code + 1]
+        return self.user_items[start:stop], self.user_ratings[start:stop]
+
+    def item_ratings_of(self, item_code):
+        """User codes and half-star ratings of one movie (zero-copy views)."""
+        start, stop = self.item_indptr[item_code], self.item_indptr[item_code + 1]
+        return self.item_users[start:stop], self.item_ratings[start:stop]
+
+    def _positions(self, indptr, codes):
+        """Concatenated [start, stop) ranges of `indptr` for many codes."""
+        codes = np.asarray(codes, dtype=np.int64)
+        codes = codes[codes >= 0]
+        starts, stops = indptr[codes], indptr[codes + 1]
+        lengths = stops - starts
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(lengths.sum()) + offsets
+
+    def fingerprint(self, chunksize=1 << 24):
+        """SHA-256 of the ratings, identifying the data a model was trained on."""
+        digest = hashlib.sha256()
+        for name in ['user_ids', 'item_ids', 'user_indptr', 'user_items', 'user_ratings']:
+            array = getattr(self, name)
+            for start in range(0, len(array), chunksize):
+                digest.update(np.ascontiguousarray(array[start:start + chunksize]).data)
+        return digest.hexdigest()
+
+    def users_rating(self, raw_item_ids):
+        """Raw IDs of all users who rated any of the given movies."""
+        positions = self._positions(self.item_indptr, self.item_codes(raw_item_ids))
+        return self.user_ids[np.unique(self.item_users[positions])]
+
+    def to_frame(self, raw_user_ids=None):
+        """Materialise ratings as a DataFrame, optionally for a subset of users.
+
+        Parameters
+        ----------
+        raw_user_ids : array-like or None
+            Users to include; `None` includes every user.
+
+        Returns
+        -------
+        DataFrame
+            `userId`, `movieId` and float32 `rating` columns, user-major.
+
+        """
+        if raw_user_ids is None:
+            codes = np.arange(self.n_users)
+            positions = slice(None)
+        else:
+            codes = self.user_codes(raw_user_ids)
+            codes = np.unique(codes[codes >= 0])
+            positions = self._positions(self.user_indptr, codes)
+        counts = np.diff(self.user_indptr)[codes]
+        return pd.DataFrame({'userId': np.repeat(self.user_ids[codes], counts),
+                             'movieId': self.item_ids[self.user_items[positions]],
+                             'rating': self.decode(self.user_ratings[positions])})
+
+
+def _stale(store_path, csv_path):
+    """Whether the store needs converting from `csv_path`.
+
+    Returns None when no store exists, and True when it was converted
+    from another version of the csv.
+
+    """
+    store_path = resolve_published(store_path)
+    if store_path is None or not os.path.exists(os.path.join(store_path, 'meta.json')):
+        return None
+    with open(os.path.join(store_path, 'meta.json')) as f:
+        recorded = json.load(f).get('source_fingerprint')
+    return (csv_path is not None and recorded is not None
+            and recorded != source_fingerprint(csv_path))
+
+
+@contextlib.contextmanager
+def _conversion_lock(store_path, wait=True):
+    """Exclusive lock of the conversion of a store, held by one process.
+
+    Yields whether the lock was taken: without `wait`, False when another
+    process holds it. Platforms without `fcntl` convert unlocked.
+
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(store_path.rstrip(os.sep) + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def open_ratings_store(store_path=RATINGS_STORE_PATH, csv_path=RATINGS_CSV_PATH):
+    """Open a ratings store, converting the csv file first if required.
+
+    The store is converted again when the csv differs (in size or
+    modification time) from the one it was converted from. Stores which
+    predate the recorded fingerprint are used as they are.
+
+    A single process converts at a time: others wait for it when there
+    is no store yet, and otherwise keep using the existing store.
+
+    Parameters
+    ----------
+    store_path : str
+        Directory (or published link) of the store.
+    csv_path : str or None
+        Ratings csv converted when no store exists yet, or when it has
+        changed since the store was converted.
+
+    Returns
+    -------
+    RatingsStore
+        The memory-mapped store.
+
+    """
+    has_csv = csv_path is not None and os.path.exists(csv_path)
+    if not has_csv:
+        if _stale(store_path, None) is None:
+            raise FileNotFoundError(f"No ratings store found at: {store_path}")
+        return RatingsStore(store_path)
+    stale = _stale(store_path, csv_path)
+    if stale is not False:
+        # Existing stores keep being served while another process converts
+        with _conversion_lock(store_path, wait=stale is None) as locked:
+            # Checked again, another process may have converted meanwhile
+            if locked and _stale(store_path, csv_path) is not False:
+                convert_ratings(csv_path, store_path)
+    return RatingsStore(store_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert ratings.csv into a ratings store.')
+    parser.add_argument('csv_path', nargs='?', default=RATINGS_CSV_PATH)
+    parser.add_argument('--output', default=RATINGS_STORE_PATH)
+    parser.add_argument('--chunksize', type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    convert_ratings(args.csv_path, args.output, args.chunksize)
+    print(f"Ratings store saved to: {args.output}")
@@ -0,0 +1,460 @@
+"""
+
+    Lazy, process-wide registry of the app's data and model artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: Each artifact is loaded on first use and cached for the
+    lifetime of the process with `st.cache_resource`, so that every
+    browser session served by a Streamlit process shares one in-memory
+    copy. Loaders are keyed on the file modification time of the artifact,
+    so replacing a file on disk makes the next request load the new
+    version and releases the previous one. `warm_up` loads everything ahead of the first request.
+
+    With `EDSA_MODEL_HOST` set, the large in-memory artifacts are attached
+    from a running model host (see `utils.model_host`) instead, so that
+    the app processes of a node share one copy of them.
+
+"""
+# Script dependencies
+import functools
+import os
+import weakref
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Custom Libraries
+from utils import model_host
+from utils.data_loader import MovieCatalog
+from utils.publishing import resolve_published
+from utils.tracing import traced
+
+# Root folder holding the data and model artifacts
+RESOURCE_DIR = os.environ.get('EDSA_RESOURCE_DIR', 'resources')
+# Attach to the artifacts published by a model host when one is running
+MODEL_HOST = os.environ.get('EDSA_MODEL_HOST', '') not in ('', '0')
+
+
+def cache_resource(func=None, *, max_entries=1):
+    """Cache a loader once per process, shared across Streamlit sessions.
+
+    Loaders are keyed on the version stamps of their artifacts, so only
+    the `max_entries` most recent keys are kept: replacing an artifact on
+    disk evicts (and frees) the version loaded before it. Loaders serving
+    several artifacts at once need one entry per artifact.
+
+    Actual loads (cache misses) are traced as stage `load.<name>`.
+
+    """
+    if func is None:
+        return functools.partial(cache_resource, max_entries=max_entries)
+    loader = traced('load.' + func.__name__.lstrip('_').replace('load_', '', 1))(func)
+    cache = getattr(st, 'cache_resource', None)
+    if cache is None:
+        # Streamlit releases without `cache_resource` cannot bound their cache
+        return functools.lru_cache(maxsize=max_entries)(loader)
+    return cache(loader, max_entries=max_entries)
+
+
+def resource_path(*parts):
+    """Location of an artifact below `RESOURCE_DIR`."""
+    return os.path.join(RESOURCE_DIR, *parts)
+
+
+def model_host_manifest():
+    """Location of the model host manifest."""
+    return resource_path('models', model_host.MANIFEST_NAME)
+
+
+def _hosted(name):
+    """Artifact `name` attached from the model host, or None if it is not hosted."""
+    if not MODEL_HOST:
+        return None
+    return model_host.attach(model_host_manifest(), name)
+
+
+def resource_stamp(path):
+    """Modification time of an artifact, or None when it does not exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+@cache_resource
+def _load_movies(path, stamp):
+    return pd.read_csv(path).dropna().reset_index(drop=True)
+
+def get_movies():
+    """The MovieLens movies table (`movieId`, `title`, `genres`)."""
+    path = resource_path('data', 'movies.csv')
+    return _load_movies(path, resource_stamp(path))
+
+
+@cache_resource
+def _load_title_list(path, stamp):
+    return _load_movies(path, stamp)['title'].to_list()
+
+def get_title_list():
+    """All movie titles, in catalogue order."""
+    path = resource_path('data', 'movies.csv')
+    return _load_title_list(path, resource_stamp(path))
+
+
+@cache_resource
+def _load_catalog(path, stamp):
+    return MovieCatalog.from_frame(_load_movies(path, stamp))
+
+def get_catalog():
+    """Shared `MovieCatalog` over the movies table."""
+    path = resource_path('data', 'movies.csv')
+    return _load_catalog(path, resource_stamp(path))
+
+
+@cache_resource
+def _load_popularity(movies_path, movies_stamp, store_stamp):
+    catalog = _load_catalog(movies_path, movies_stamp)
+    store = get_ratings_store()
+    rows = catalog.rows_of_ids(store.item_ids.tolist())
+    known = rows >= 0
+    counts = np.zeros(len(catalog), dtype=np.int64)
+    counts[rows[known]] = np.diff(store.item_indptr)[known]
+    return counts
+
+def get_popularity():
+    """Number of ratings of each catalogue row (0 for unrated movies)."""
+    movies_path = resource_path('data', 'movies.csv')
+    store_stamp = resource_stamp(resource_path('data', 'ratings_store', 'meta.json'))
+    return _load_popularity(movies_path, resource_stamp(movies_path), store_stamp)
+
+
+@cache_resource
+def _load_title_index(path, stamp, movies_path, movies_stamp, store_stamp):
+    from utils.title_search import TitleIndex
+    catalog = _load_catalog(movies_path, movies_stamp)
+    index = TitleIndex.load(path) if stamp is not None else None
+    if index is None or not index.matches(catalog):
+        # Not prebuilt, or built from another version of the movies table
+        index = TitleIndex.build(catalog.titles.tolist(), catalog.movie_ids)
+    try:
+        # Rank equally good matches by their number of ratings
+        index.popularity = _load_popularity(movies_path, movies_stamp, store_stamp)
+    except OSError:
+        pass
+    return index
+
+def get_title_index():
+    """Title search index over the whole catalogue (see `utils.title_search`).
+
+    Uses the index saved in the models folder when it exists, and builds
+    it in-process otherwise.
+
+    """
+    path = resource_path('models', 'title_index.npz')
+    movies_path = resource_path('data', 'movies.csv')
+    store_stamp = resource_stamp(resource_path('data', 'ratings_store', 'meta.json'))
+    return _load_title_index(path, resource_stamp(path), movies_path,
+                             resource_stamp(movies_path), store_stamp)
+
+
+@cache_resource
+def _load_content_frame(movies_path, imdb_path, stamps):
+    movies = _load_movies(movies_path, stamps[0])
+    # One metadata row per movie keeps rows aligned with the catalogue
+    imdb = pd.read_csv(imdb_path).fillna('').drop_duplicates('movieId')
+    movies = pd.merge(movies, imdb, on='movieId', how='left')
+    for column in ['title_cast', 'genres', 'plot_keywords', 'director']:
+        movies[column] = movies[column].fillna('')
+    return movies.reset_index(drop=True)
+
+def get_content_frame():
+    """Movies merged with their IMDB metadata, with missing text blanked."""
+    movies_path = resource_path('data', 'movies.csv')
+    imdb_path = resource_path('data', 'imdb_data.csv')
+    stamps = (resource_stamp(movies_path), resource_stamp(imdb_path))
+    return _load_content_frame(movies_path, imdb_path, stamps)
+
+
+@cache_resource
+def _load_ratings_store(store_path, csv_path, stamp, csv_stamp):
+    from utils.ratings_store import open_ratings_store
+    return open_ratings_store(store_path, csv_path)
+
+def get_ratings_store():
+    """The memory-mapped ratings store, converted from csv if required
+    (or if the csv has changed since)."""
+    store_path = resource_path('data', 'ratings_store')
+    csv_path = resource_path('data', 'ratings.csv')
+    return _load_ratings_store(store_path, csv_path,
+                               resource_stamp(os.path.join(store_path, 'meta.json')),
+                               resource_stamp(csv_path))
+
+
+def _factor_model_path():
+    """Exported factors (e.g. from `train_als.py`) take precedence over the pickle.
+
+    A published artifact is resolved to its current version directory, so
+    each version is cached under its own path.
+
+    """
+    for name in ['svd_factors', 'svd_factors.npz']:
+        path = resolve_published(resource_path('models', name))
+        if path is not None:
+            return path
+    return resource_path('models', 'SVD_01.pkl')
+
+@cache_resource
+def _load_factor_model(path, stamp):
+    from recommenders.factor_model import load_factor_model
+    return load_factor_model(path)
+
+def get_factor_model():
+    """Vectorised scoring engine over the SVD model factors (memory-mapped
+    when served from an artifact directory)."""
+    hosted = _hosted('factor_model')
+    if hosted is not None:
+        return hosted
+    path = _factor_model_path()
+    return _load_factor_model(path, resource_stamp(path))
+
+def factor_model_stamp():
+    """Version of the factor model currently on disk."""
+    path = _factor_model_path()
+    if os.path.isdir(path):
+        # Artifact directories are versioned by their header
+        path = os.path.join(path, 'meta.json')
+    return resource_stamp(path)
+
+
+@cache_resource
+def _load_neighbour_index(path, stamp, movies_path, movies_stamp):
+    from recommenders.content_index import load_neighbour_index
+    index, movie_ids, titles = load_neighbour_index(path)
+    neighbours = index, MovieCatalog(movie_ids, titles)
+    # An index built over another version of the movies table is not served
+    return neighbours if _same_rows(neighbours, _load_catalog(movies_path, movies_stamp)) else None
+
+def _same_rows(neighbours, catalog):
+    """Whether a neighbour index was built over the rows of `catalog`."""
+    return np.array_equal(neighbours[1].movie_ids, catalog.movie_ids)
+
+def get_neighbour_index():
+    """The content neighbour index and a `MovieCatalog` over its rows.
+
+    Returns None when the index has not been built, or was built over
+    another version of the movies table (its rows would then point at
+    the wrong movies).
+
+    """
+    hosted = _hosted('neighbour_index')
+    if hosted is not None:
+        return hosted if _same_rows(hosted, get_catalog()) else None
+    path = resource_path('models', 'content_neighbours.npz')
+    stamp = resource_stamp(path)
+    if stamp is None:
+        return None
+    movies_path = resource_path('data', 'movies.csv')
+    return _load_neighbour_index(path, stamp, movies_path, resource_stamp(movies_path))
+
+
+@cache_resource
+def _load_text_features(path, stamp, movies_path, imdb_path, stamps):
+    from recommenders import text_features
+    if stamp is None:
+        # Nothing built offline: hash the metadata once per process
+        frame = _load_content_frame(movies_path, imdb_path, stamps)
+        return text_features.build_text_features(frame, n_jobs=1)
+    matrix, movie_ids, _ = text_features.load_text_features(path)
+    return text_features.align_rows(matrix, movie_ids, _load_catalog(movies_path, stamps[0]))
+
+def get_text_features():
+    """Hashed text features, one row per catalogue movie.
+
+    Uses the features saved by `recommenders.text_features` when they
+    exist, and builds them in-process otherwise.
+
+    """
+    hosted = _hosted('text_features')
+    if hosted is not None:
+        return hosted
+    path = resource_path('models', 'text_features.npz')
+    movies_path = resource_path('data', 'movies.csv')
+    imdb_path = resource_path('data', 'imdb_data.csv')
+    stamps = (resource_stamp(movies_path), resource_stamp(imdb_path))
+    return _load_text_features(path, resource_stamp(path), movies_path, imdb_path, stamps)
+
+
+@cache_resource
+def _load_genome_features(path, stamp, movies_path, movies_stamp):
+    from recommenders.genome_features import GenomeFeatures
+    return GenomeFeatures.load(path).align(_load_catalog(movies_path, movies_stamp))
+
+def get_genome_features():
+    """Memory-mapped genome embeddings, aligned with the catalogue.
+
+    Returns None when the features have not been built.
+
+    """
+    hosted = _hosted('genome_features')
+    if hosted is not None:
+        return hosted
+    path = resource_path('models', 'genome_features.npy')
+    stamp = resource_stamp(path)
+    if stamp is None:
+        return None
+    movies_path = resource_path('data', 'movies.csv')
+    return _load_genome_features(path, stamp, movies_path, resource_stamp(movies_path))
+
+
+# One index per source ('factors' and 'genome')
+@cache_resource(max_entries=2)
+def _load_ann_index(path, stamp, source, source_stamp):
+    from recommenders.ann import IVFIndex, factor_vectors
+    index = IVFIndex.load(path)
+    if source == 'factors':
+        vectors = factor_vectors(get_factor_model())
+    else:
+        vectors = get_genome_features().vectors
+    # An index built from an older model is ignored rather than served
+    return index if index.matches(vectors) else None
+
+# Whether a hosted ANN index matches the item vectors it was last checked
+# against: {index: (weak reference to the model, result)}
+_ann_checks = weakref.WeakKeyDictionary()
+
+def _hosted_ann_matches(index, source):
+    """Whether a hosted index was built from the vectors this process serves.
+
+    The host may publish an index ahead of (or behind) the model; the
+    check runs once per index and model pair.
+
+    """
+    from recommenders.ann import factor_vectors
+    model = get_factor_model() if source == 'factors' else get_genome_features()
+    if model is None:
+        return False
+    checked = _ann_checks.get(index)
+    if checked is None or checked[0]() is not model:
+        vectors = factor_vectors(model) if source == 'factors' else model.vectors
+        checked = _ann_checks[index] = (weakref.ref(model), index.matches(vectors))
+    return checked[1]
+
+def get_ann_index(source):
+    """ANN index over the item vectors of `source` ('factors' or 'genome').
+
+    Returns None when the index has not been built, or was built from
+    vectors other than the ones currently served (a hosted index which
+    does not match falls back to the local one).
+
+    """
+    hosted = _hosted(f'{source}_ann')
+    if hosted is not None and _hosted_ann_matches(hosted, source):
+        return hosted
+    path = resource_path('models', f'{source}_ann.npz')
+    stamp = resource_stamp(path)
+    if stamp is None:
+        return None
+    if source == 'factors':
+        source_stamp = factor_model_stamp()
+    else:
+        source_stamp = resource_stamp(resource_path('models', 'genome_features.npy'))
+        if source_stamp is None:
+            return None
+    return _load_ann_index(path, stamp, source, source_stamp)
+
+
+@cache_resource
+def _load_fallbacks(path, stamp, movies_path, movies_stamp):
+    from recommenders.fallback import Fallbacks
+    fallbacks = Fallbacks.load(path)
+    # Lists built over another version of the movies table are not served
+    return fallbacks if fallbacks.matches(_load_catalog(movies_path, movies_stamp)) else None
+
+def get_fallbacks():
+    """Precomputed fallback recommendations (see `recommenders.fallback`).
+
+    Returns None when they have not been built, or were built over
+    another catalogue.
+
+    """
+    path = resource_path('models', 'fallbacks.npz')
+    stamp = resource_stamp(path)
+    if stamp is None:
+        return None
+    movies_path = resource_path('data', 'movies.csv')
+    return _load_fallbacks(path, stamp, movies_path, resource_stamp(movies_path))
+
+
+def artifact_version():
+    """Modification times of every data and model artifact.
+
+    Anything derived from the artifacts (e.g. cached recommendations) is
+    stale once this value changes.
+
+    """
+    # Hosted artifacts change when the host republishes them
+    host_stamp = resource_stamp(model_host_manifest()) if MODEL_HOST else None
+    return (resource_stamp(resource_path('data', 'movies.csv')),
+            resource_stamp(resource_path('data', 'imdb_data.csv')),
+            resource_stamp(resource_path('data', 'ratings_store', 'meta.json')),
+            resource_stamp(resource_path('models', 'content_neighbours.npz')),
+            resource_stamp(resource_path('models', 'text_features.npz')),
+            resource_stamp(resource_path('models', 'genome_features.npy')),
+            resource_stamp(resource_path('models', 'factors_ann.npz')),
+            resource_stamp(resource_path('models', 'genome_ann.npz')),
+            factor_model_stamp(),
+            host_stamp)
+
+
+# Registry getters of the artifacts a model host can publish
+HOSTED_LOADERS = {
+    'factor_model': get_factor_model,
+    'text_features': get_text_features,
+    'neighbour_index': get_neighbour_index,
+    'genome_features': get_genome_features,
+    'factors_ann': lambda: get_ann_index('factors'),
+    'genome_ann': lambda: get_ann_index('genome'),
+}
+
+
+# Loaders run by `warm_up`, in order
+WARM_UP_LOADERS = {
+    'movies': get_movies,
+    'titles': get_title_list,
+    'catalog': get_catalog,
+    'title_index': get_title_index,
+    'content_frame': get_content_frame,
+    'neighbour_index': get_neighbour_index,
+    'text_features': get_text_features,
+    'genome_features': get_genome_features,
+    'ratings_store': get_ratings_store,
+    'popularity': get_popularity,
+    'factor_model': get_factor_model,
+    'factors_ann': lambda: get_ann_index('factors'),
+    'genome_ann': lambda: get_ann_index('genome'),
+    'fallbacks': get_fallbacks,
+}
+
+
+def warm_up(names=None):
+    """Load artifacts ahead of the first request.
+
+    Parameters
+    ----------
+    names : list (str) or None
+        Keys of `WARM_UP_LOADERS` to load; `None` loads all of them.
+
+    Returns
+    -------
+    list (str)
+        Names of the artifacts which could not be loaded.
+
+    """
+    failed = []
+    for name in names or WARM_UP_LOADERS:
+        try:
+            WARM_UP_LOADERS[name]()
+        except (OSError, ImportError):
+            failed.append(name)
+    return failed
@@ -0,0 +1,317 @@
+"""
+
+    Type-ahead search over the full movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Titles are normalised (accents and punctuation removed,
+    lower-cased, and MovieLens' trailing articles such as "Matrix, The"
+    moved back to the front) and indexed twice:
+
+    - a sorted array of every word-suffix of every title, so that a query
+      matching the start of any word is found with two binary searches;
+    - an inverted index of character trigrams of every word, which finds
+      misspelt or partial queries by the share of the query's trigrams
+      a title contains. The best of these are re-scored word by word with
+      an edit distance which counts a swap of two letters as one edit, so
+      "matirx" ranks "Matrix, The" as well as any title it shares more
+      trigrams with.
+
+    Matches are ranked by how they match (exact title, title prefix, word
+    prefix, trigram similarity), then by release year when the query
+    names one ("heat 1995"), then by popularity. A lookup takes well under
+    a millisecond for the prefix index and a few milliseconds for trigrams
+    (up to ~20 ms for long misspelt queries whose words were never seen).
+
+    The index records the movie ID of each row, so that an index prebuilt
+    from another version of `movies.csv` is detected and rebuilt. It is
+    built from `movies.csv` on first use, or prebuilt from the root of the
+    Streamlit application with:
+
+        python -m utils.title_search
+
+"""
+# Script dependencies
+import argparse
+import functools
+import os
+import re
+import time
+import unicodedata
+import numpy as np
+
+# Articles which MovieLens moves to the end of a title ("Matrix, The")
+_TRAILING_ARTICLE = re.compile(
+    r"([^()]+?), (The|A|An|Les|Le|La|L'|Il|El|Los|Las|Das|Der|Die|Den|Det|Un|Une)(?=\)|\s\(|\s*$)")
+_YEAR = re.compile(r'\((\d{4})\)\s*$')
+_QUERY_YEAR = re.compile(r'(?:^|\s)\(?(\d{4})\)?\s*$')
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+_LEADING_ARTICLE = re.compile(r'^(the|a|an|les|le|la|l|il|el|los|las|das|der|die|den|det|un|une) ')
+
+# Score of each way of matching; the year and trigram similarity add to it
+EXACT, TITLE_PREFIX, WORD_PREFIX = 3.0, 2.0, 1.0
+YEAR_BONUS = 1.5
+MIN_SIMILARITY = 0.3
+# Trigram matches re-scored by edit distance per query
+FUZZY_SHORTLIST = 64
+
+
+def normalise(text):
+    """Lower-case ASCII words of `text`, separated by single spaces."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def split_title(title):
+    """Normalised name (without year) and release year (0 if unknown) of a title."""
+    year = _YEAR.search(title)
+    name = title[:year.start()] if year else title
+    name = _TRAILING_ARTICLE.sub(r'\2 \1', name)
+    return normalise(name), int(year.group(1)) if year else 0
+
+
+def parse_query(query):
+    """Normalised name and year (0 if none) typed by the user."""
+    year = _QUERY_YEAR.search(query)
+    if year and 1870 <= int(year.group(1)) <= 2100:
+        return normalise(query[:year.start()]), int(year.group(1))
+    return normalise(query), 0
+
+
+def trigrams(text):
+    """Distinct character trigrams of the words of normalised text, each word padded."""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@functools.lru_cache(maxsize=65536)
+def edit_distance(a, b):
+    """Edits (insertion, deletion, substitution or swap of adjacent letters) turning a into b."""
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        before, previous = previous, current
+    return previous[-1]
+
+
+def word_similarity(query_words, title_words):
+    """Mean over the query words of their best edit similarity to a title word."""
+    total = 0.0
+    for word in query_words:
+        best = 0.0
+        for other in title_words:
+            longest = max(len(word), len(other))
+            # The length difference alone bounds the distance
+            if 1 - abs(len(word) - len(other)) / longest > best:
+                best = max(best, 1 - edit_distance(word, other) / longest)
+        total += best
+    return total / len(query_words)
+
+
+class TitleIndex:
+    """Prefix and trigram index over the titles of a catalogue.
+
+    Parameters
+    ----------
+    movie_ids : ndarray (int)
+        MovieLens movie ID of each catalogue row the index was built over.
+    years : ndarray (int)
+        Release year of each catalogue row (0 if unknown).
+    title_keys, title_rows : ndarray
+        Sorted normalised names (with and without a leading article) and
+        their rows.
+    prefix_keys, prefix_rows : ndarray
+        Sorted word-suffixes of every "name year" key and their rows.
+    gram_keys, gram_indptr, gram_rows : ndarray
+        Sorted trigrams and, in CSR layout, the rows containing each.
+    popularity : ndarray or None
+        Ranking weight of each row (e.g. its number of ratings).
+
+    """
+
+    _ARRAYS = ['movie_ids', 'years', 'title_keys', 'title_rows', 'prefix_keys', 'prefix_rows',
+               'gram_keys', 'gram_indptr', 'gram_rows']
+
+    def __init__(self, movie_ids, years, title_keys, title_rows, prefix_keys, prefix_rows,
+                 gram_keys, gram_indptr, gram_rows, popularity=None):
+        self.movie_ids = movie_ids
+        self.years = years
+        self.title_keys = title_keys
+        self.title_rows = title_rows
+        self.prefix_keys = prefix_keys
+        self.prefix_rows = prefix_rows
+        self.gram_keys = gram_keys
+        self.gram_indptr = gram_indptr
+        self.gram_rows = gram_rows
+        self._names = None
+        self.popularity = np.zeros(len(years)) if popularity is None else popularity
+
+    @classmethod
+    def build(cls, titles, movie_ids):
+        """Index MovieLens titles and movie IDs (one of each per catalogue row)."""
+        names, years = zip(*(split_title(title) for title in titles)) if len(titles) else ((), ())
+        title_keys, title_rows, keys, key_rows, grams, gram_rows = [], [], [], [], [], []
+        for row, (name, year) in enumerate(zip(names, years)):
+            # Leading articles are optional ("matrix" finds "the matrix")
+            for title_key in {name, _LEADING_ARTICLE.sub('', name)}:
+                title_keys.append(title_key)
+                title_rows.append(row)
+            words = (f'{name} {year}' if year else name).split()
+            for start in range(len(words)):
+                keys.append(' '.join(words[start:]))
+                key_rows.append(row)
+            row_grams = trigrams(name)
+            grams.extend(row_grams)
+            gram_rows.extend([row] * len(row_grams))
+
+        def sort(keys, rows):
+            keys = np.asarray(keys, dtype=str)
+            order = np.argsort(keys, kind='stable')
+            return keys[order], np.asarray(rows, dtype=np.int32)[order]
+
+        grams, gram_rows = sort(grams, gram_rows)
+        gram_keys, counts = np.unique(grams, return_counts=True)
+        return cls(np.asarray(movie_ids, dtype=np.int64), np.asarray(years, dtype=np.int16),
+                   *sort(title_keys, title_rows),
+                   *sort(keys, key_rows), gram_keys,
+                   np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), gram_rows)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by `save` (`movie_ids` is None in older files)."""
+        with np.load(path) as archive:
+            return cls(*(archive[name] if name in archive.files else None
+                         for name in cls._ARRAYS))
+
+    def matches(self, catalog):
+        """Whether the index was built over the rows of `catalog`."""
+        return self.movie_ids is not None and np.array_equal(self.movie_ids, catalog.movie_ids)
+
+    def save(self, path):
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **{name: getattr(self, name) for name in self._ARRAYS})
+        # Written to a temporary file so readers never see a partial index
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.years)
+
+    @staticmethod
+    def _range(keys, rows, text, prefix=True):
+        """Rows of the sorted keys starting with (or equal to) `text`."""
+        start = np.searchsorted(keys, text, side='left')
+        stop = np.searchsorted(keys, text + '\uffff' if prefix else text, side='right')
+        return np.unique(rows[start:stop])
+
+    @property
+    def names(self):
+        """Normalised name of each row (with its leading article)."""
+        if self._names is None:
+            names = [''] * len(self)
+            for key, row in zip(self.title_keys.tolist(), self.title_rows.tolist()):
+                if len(key) > len(names[row]):
+                    names[row] = key
+            self._names = names
+        return self._names
+
+    def _trigram_rows(self, text):
+        """Rows sharing trigrams with `text` and their similarity.
+
+        The similarity is the share of the query's trigrams found in the
+        title, so that long titles are not penalised for their other
+        words. The `FUZZY_SHORTLIST` best rows (then most popular) score
+        their word-by-word edit similarity instead when it is higher,
+        since a swap of two letters costs a trigram match three grams.
+
+        """
+        grams = np.asarray(sorted(trigrams(text)), dtype='<U3')
+        positions = np.searchsorted(self.gram_keys, grams)
+        found = positions < len(self.gram_keys)
+        found[found] = self.gram_keys[positions[found]] == grams[found]
+        positions = positions[found]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        postings = np.concatenate([self.gram_rows[self.gram_indptr[p]:self.gram_indptr[p + 1]]
+                                   for p in positions])
+        rows, shared = np.unique(postings, return_counts=True)
+        similarity = shared / len(grams)
+        keep = similarity >= MIN_SIMILARITY
+        rows, similarity = rows[keep], similarity[keep]
+        shortlist = np.lexsort((-self.popularity[rows], -similarity))[:FUZZY_SHORTLIST]
+        words = text.split()
+        for i in shortlist:
+            similarity[i] = max(similarity[i], word_similarity(words, self.names[rows[i]].split()))
+        return rows, similarity
+
+    def search(self, query, limit=20):
+        """Catalogue rows best matching what the user typed.
+
+        Parameters
+        ----------
+        query : str
+            Partial title, optionally ending with a year.
+        limit : int
+            Maximum number of rows returned.
+
+        Returns
+        -------
+        ndarray (int)
+            Catalogue rows, best match first.
+
+        """
+        name, year = parse_query(query)
+        if not name and not year:
+            return self.popular(limit)
+        # A query which is only a year matches the "name year" keys
+        rows = self._range(self.prefix_keys, self.prefix_rows, name or str(year))
+        scores = np.full(len(rows), WORD_PREFIX)
+        if name:
+            scores[np.isin(rows, self._range(self.title_keys, self.title_rows, name))] = TITLE_PREFIX
+            scores[np.isin(rows, self._range(self.title_keys, self.title_rows, name, False))] = EXACT
+            if len(rows) < limit:
+                # Too few prefix matches: add similar titles (e.g. typos)
+                similar, similarity = self._trigram_rows(name)
+                new = ~np.isin(similar, rows)
+                rows = np.concatenate([rows, similar[new]])
+                scores = np.concatenate([scores, similarity[new]])
+        if year:
+            scores = scores + YEAR_BONUS * (self.years[rows] == year)
+        # Best score, then most popular, then catalogue order
+        order = np.lexsort((rows, -self.popularity[rows], -scores))[:limit]
+        return rows[order]
+
+    def popular(self, limit=20):
+        """The `limit` most popular rows (catalogue order without popularity)."""
+        return np.argsort(-self.popularity, kind='stable')[:limit]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the title search index.')
+    parser.add_argument('--output', default=None,
+                        help='Destination file (defaults to the app resources folder).')
+    parser.add_argument('--query', nargs='*', default=[],
+                        help='Queries to try against the index once built.')
+    args = parser.parse_args()
+
+    from utils.resources import get_catalog, resource_path
+    args.output = args.output or resource_path('models', 'title_index.npz')
+    catalog = get_catalog()
+    start = time.perf_counter()
+    index = TitleIndex.build(catalog.titles.tolist(), catalog.movie_ids)
+    index.save(args.output)
+    print(f"Title index of {len(index)} movies ({len(index.prefix_keys)} keys) built in "
+          f"{time.perf_counter() - start:.1f}s and saved to: {args.output}")
+    for query in args.query:
+        start = time.perf_counter()
+        rows = index.search(query, 5)
+        print(f"{query!r} ({1000 * (time.perf_counter() - start):.2f} ms): "
+              f"{catalog.titles_of_rows(rows)}")
@@ -0,0 +1,239 @@
+"""
+
+    Lightweight tracing of recommendation and data-loading stages.
+
+    Author: Explore Data Science Academy.
+
+    Description: Code wraps each stage of work in ``with stage(name,
+    **sizes):``. While tracing is enabled, every stage records its wall
+    time, CPU time (of the calling thread), peak Python memory allocation
+    (via `tracemalloc`) and the input sizes passed to it; per-stage totals
+    are kept alongside a bounded log of recent records and failures. The
+    records feed the app's Diagnostics page and can be exported as
+    Prometheus text or JSON lines.
+
+    `tracemalloc` tracks the whole process and each stage resets its
+    peak, so memory figures are only valid single-threaded: a peak counts
+    the allocations of every thread, and is only attributable to a stage
+    when no other thread works meanwhile (e.g. the benchmark runner, or
+    one app user at a time). A stage which overlaps another thread's stage
+    records no peak (`peak_alloc_bytes` is None); its times stay valid.
+
+    Tracing is off unless `EDSA_TRACING` is set (or `enable` is called);
+    a disabled `stage` returns a shared no-op context manager, so the
+    instrumentation costs a single flag check.
+
+"""
+# Script dependencies
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+_enabled = bool(os.environ.get('EDSA_TRACING'))
+_lock = threading.Lock()
+_local = threading.local()
+_NULL = contextlib.nullcontext()
+# Threads inside a stage, and the number of times a thread entered one
+# (a stage saw no other thread's stage when the count did not move)
+_active_threads = 0
+_entries = 0
+
+# Most recent stage records and failures, oldest first
+RECORDS = deque(maxlen=2000)
+ERRORS = deque(maxlen=200)
+# Per-stage totals since the last `reset`
+TOTALS = {}
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    """Start recording stages (and Python memory allocations)."""
+    global _enabled
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    with _lock:
+        RECORDS.clear()
+        ERRORS.clear()
+        TOTALS.clear()
+
+
+class _Stage:
+    """Context manager measuring one stage while tracing is enabled."""
+
+    def __init__(self, name, sizes):
+        self.name = name
+        self.sizes = sizes
+
+    def __enter__(self):
+        global _active_threads, _entries
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if not stack:
+            with _lock:
+                _active_threads += 1
+                _entries += 1
+        # Alone in the process: the memory peak will be this thread's
+        self.entries = _entries if _active_threads == 1 else None
+        if stack:
+            # Make sure the parent's peak survives the reset below
+            stack[-1].child_peak = max(stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+        stack.append(self)
+        self.child_peak = 0
+        self.memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self.cpu_start = time.thread_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, tb):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+        exclusive = self.entries is not None and self.entries == _entries
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_peak = max(stack[-1].child_peak, peak)
+        else:
+            global _active_threads
+            with _lock:
+                _active_threads -= 1
+        record = {'stage': self.name, 'time': time.time(), 'wall_s': wall, 'cpu_s': cpu,
+                  'peak_alloc_bytes': max(peak - self.memory_start, 0) if exclusive else None,
+                  'sizes': self.sizes,
+                  'error': None if error_type is None else error_type.__name__}
+        _add(record)
+        return False
+
+
+def _add(record):
+    with _lock:
+        RECORDS.append(record)
+        totals = TOTALS.setdefault(record['stage'], {'calls': 0, 'errors': 0, 'wall_s': 0.0,
+                                                     'cpu_s': 0.0, 'max_wall_s': 0.0,
+                                                     'max_peak_alloc_bytes': 0})
+        totals['calls'] += 1
+        totals['errors'] += record['error'] is not None
+        totals['wall_s'] += record['wall_s']
+        totals['cpu_s'] += record['cpu_s']
+        totals['max_wall_s'] = max(totals['max_wall_s'], record['wall_s'])
+        if record['peak_alloc_bytes'] is not None:
+            totals['max_peak_alloc_bytes'] = max(totals['max_peak_alloc_bytes'],
+                                                 record['peak_alloc_bytes'])
+
+
+def stage(name, **sizes):
+    """Measure the enclosed block as stage `name`.
+
+    Parameters
+    ----------
+    name : str
+        Dotted stage name, e.g. 'content.similarity'.
+    **sizes : int
+        Input sizes worth recording (e.g. `movies=3`, `nnz=...`).
+
+    """
+    if not _enabled:
+        return _NULL
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _Stage(name, sizes)
+
+
+def traced(name):
+    """Decorator measuring every call of a function as stage `name`."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_error(where, error):
+    """Keep a failure which was handled (e.g. shown to the app user)."""
+    with _lock:
+        ERRORS.append({'where': where, 'time': time.time(),
+                       'error': type(error).__name__, 'message': str(error)})
+
+
+def summary():
+    """Per-stage totals, sorted by total wall time."""
+    with _lock:
+        rows = [dict(stage=name, **totals) for name, totals in TOTALS.items()]
+    for row in rows:
+        row['mean_wall_s'] = row['wall_s'] / row['calls']
+    return sorted(rows, key=lambda row: -row['wall_s'])
+
+
+def to_prometheus(extra=None):
+    """Render the stage totals (and optional extra gauges) as Prometheus text.
+
+    Parameters
+    ----------
+    extra : dict (str, dict (str, float)) or None
+        Additional gauges as ``{metric: {label_value: value}}``, exported
+        as ``edsa_<metric>{name="<label_value>"}``.
+
+    """
+    metrics = [('calls', 'counter', 'Stage executions'),
+               ('errors', 'counter', 'Stage executions which raised'),
+               ('wall_s', 'counter', 'Total wall-clock seconds'),
+               ('cpu_s', 'counter', 'Total CPU seconds of the calling thread'),
+               ('max_wall_s', 'gauge', 'Slowest execution in seconds'),
+               ('max_peak_alloc_bytes', 'gauge', 'Largest peak Python allocation in bytes')]
+    rows = summary()
+    lines = []
+    for key, kind, help_text in metrics:
+        metric = f'edsa_stage_{key}'
+        lines += [f'# HELP {metric} {help_text}.', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{stage="{row["stage"]}"}} {row[key]}' for row in rows]
+    for metric, values in (extra or {}).items():
+        lines.append(f'# TYPE edsa_{metric} gauge')
+        lines += [f'edsa_{metric}{{name="{label}"}} {value}'
+                  for label, value in values.items() if value is not None]
+    return '\n'.join(lines) + '\n'
+
+
+def to_jsonl():
+    """Render the recent stage records as JSON lines."""
+    with _lock:
+        records = list(RECORDS)
+    return ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def write_prometheus(path, extra=None):
+    """Write the Prometheus text exposition to `path` (e.g. for a textfile collector)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(to_prometheus(extra))
+    os.replace(tmp_path, path)
+
+
+def write_jsonl(path):
+    """Append the recent stage records to a JSON-lines file."""
+    with open(path, 'a') as f:
+        f.write(to_jsonl())